@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import time
+import binascii
+
+import Ice
+import argparse
+import logging
+import colorlog
+
+Ice.loadSlice('urfs.ice')
+import URFS
+
+FILES_PATH = 'files'
+BLOCK_SIZE = 1024
+MB = 1024 * 1024
+
+
+class Benchmark(Ice.Application):
+    def run(self, argv):
+        """
+        Mide el rendimiento (MB/s) de subida y descarga de los ficheros de ejemplo usando las dos rutas de
+        transferencia disponibles: la antigua, que viaja como cadenas base64 (`send`/`recv`), y la binaria, que
+        envía bloques `sequence<byte>` sin codificar (`sendBytes`/`recvBytes`).
+
+        Cada fichero se sube, se descarga y se elimina de nuevo por cada ruta, de modo que el sistema queda
+        en el mismo estado que al empezar.
+
+        :param argv: Lista de argumentos de la línea de comandos pasados al método `run`.
+        :return: El código devuelve el valor 0.
+        """
+        ic = self.communicator()
+        proxy = ic.stringToProxy("frontend")
+        self.frontend = URFS.FrontendPrx.checkedCast(proxy)
+
+        if not self.frontend:
+            raise RuntimeError('Proxy inválido')
+
+        files = sorted(os.path.join(ARGS.path, name) for name in os.listdir(ARGS.path))
+        print(f"{'Fichero':<20} {'Tamaño':>10} {'Ruta':>7} {'Subida MB/s':>12} {'Descarga MB/s':>14}")
+        for file_name in files:
+            size = os.path.getsize(file_name)
+            for mode in ('string', 'bytes'):
+                upload_time, file_hash, uploaded = self.upload(file_name, mode)
+                download_time = self.download(file_hash, mode)
+                if uploaded:
+                    self.frontend.removeFile(file_hash)
+                print(f"{os.path.basename(file_name):<20} {size:>10} {mode:>7} "
+                      f"{size / MB / upload_time:>12.2f} {size / MB / download_time:>14.2f}")
+        return 0
+
+    def upload(self, file_name, mode):
+        """
+        Sube un fichero por la ruta indicada y mide el tiempo empleado.
+
+        :param file_name: Ruta del fichero local que se va a subir.
+        :param mode: 'string' para la ruta base64 o 'bytes' para la ruta binaria.
+        :return: Tupla (segundos, hash, subido). `subido` es False si el contenido ya existía en el sistema,
+        en cuyo caso el fichero no se debe eliminar al terminar.
+        """
+        start = time.perf_counter()
+        uploader = self.frontend.uploadFile(file_name)
+        with open(file_name, 'rb') as _file:
+            while True:
+                data = _file.read(BLOCK_SIZE)
+                if not data:
+                    break
+                if mode == 'string':
+                    uploader.send(str(binascii.b2a_base64(data, newline=False)))
+                else:
+                    uploader.sendBytes(data)
+        try:
+            file_hash, uploaded = uploader.save().hash, True
+        except URFS.FileAlreadyExistsError as e:
+            file_hash, uploaded = e.hash, False
+        elapsed = time.perf_counter() - start
+        uploader.destroy()
+        return elapsed, file_hash, uploaded
+
+    def download(self, file_hash, mode):
+        """
+        Descarga un fichero por la ruta indicada, descartando los datos, y mide el tiempo empleado.
+
+        :param file_hash: Hash del fichero que se va a descargar.
+        :param mode: 'string' para la ruta base64 o 'bytes' para la ruta binaria.
+        :return: Segundos empleados en la descarga.
+        """
+        start = time.perf_counter()
+        downloader = self.frontend.downloadFile(file_hash)
+        while True:
+            if mode == 'string':
+                data = binascii.a2b_base64(downloader.recv(BLOCK_SIZE)[2:-1])
+            else:
+                data = downloader.recvBytes(BLOCK_SIZE)
+            if len(data) < BLOCK_SIZE:
+                break
+        elapsed = time.perf_counter() - start
+        downloader.destroy()
+        return elapsed
+
+
+if __name__ == '__main__':
+
+    logging.basicConfig(level=logging.WARNING)
+    log_format = '%(log_color)s[%(levelname)s]%(reset)s - %(message)s'
+
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.WARNING)
+    console_handler.setFormatter(colorlog.ColoredFormatter(log_format))
+
+    logging.getLogger().handlers = []
+    logging.getLogger().addHandler(console_handler)
+
+    my_parser = argparse.ArgumentParser()
+    my_parser.add_argument('-p', '--path',
+        help='Directorio con los ficheros de prueba',
+        action='store',
+        type=str,
+        default=FILES_PATH)
+
+    ARGS, unknown = my_parser.parse_known_args()
+    sys.exit(Benchmark().main(sys.argv))
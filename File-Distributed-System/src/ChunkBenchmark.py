@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+
+import io
+import os
+import sys
+import time
+import hashlib
+
+import argparse
+
+from chunking import Chunker, DEFAULT_AVERAGE_CHUNK_SIZE, chunk_id, np
+
+FILES_PATH = 'files'
+EDIT = b'URFS'  # Bytes que se insertan en mitad de cada fichero para simular una versión nueva
+MB = 1024 * 1024
+
+
+def load_dataset(path, edits):
+    """
+    Lee los ficheros de ejemplo y, si se pide, añade por cada uno una versión editada con unos bytes insertados
+    en mitad del contenido, como haría un usuario que sube de nuevo un documento modificado.
+
+    :param path: Directorio con los ficheros de prueba.
+    :param edits: True para añadir las versiones editadas.
+    :return: Lista de tuplas (nombre, contenido).
+    """
+    dataset = []
+    for name in sorted(os.listdir(path)):
+        with open(os.path.join(path, name), 'rb') as f:
+            data = f.read()
+        dataset.append((name, data))
+        if edits:
+            middle = len(data) // 2
+            dataset.append((name + '~', data[:middle] + EDIT + data[middle:]))
+    return dataset
+
+
+def run_chunker(chunker, dataset):
+    """
+    Divide todos los ficheros con un `Chunker` y mide el tiempo empleado.
+
+    :return: Tupla (MB/s, bytes de bloques distintos, número de bloques).
+    """
+    unique = {}
+    count = 0
+    start = time.perf_counter()
+    for name, data in dataset:
+        for chunk in chunker.split(io.BytesIO(data)):
+            unique[chunk_id(chunk)] = len(chunk)
+            count += 1
+    elapsed = time.perf_counter() - start
+    total = sum(len(data) for _, data in dataset)
+    return total / MB / max(elapsed, 1e-9), sum(unique.values()), count
+
+
+def main():
+    """
+    Compara, sin necesidad de desplegar el sistema, el almacenamiento de ficheros enteros con el de bloques
+    definidos por contenido (`URFS.ChunkingMode=cdc`): ratio de deduplicación de cada modo (bytes subidos /
+    bytes guardados) y velocidad de troceado en MB/s de las implementaciones NumPy y Python puro.
+
+    :return: El código devuelve el valor 0.
+    """
+    dataset = load_dataset(ARGS.path, not ARGS.no_edits)
+    total = sum(len(data) for _, data in dataset)
+    whole = {hashlib.md5(data).hexdigest(): len(data) for _, data in dataset}
+    print(f"Ficheros: {len(dataset)}  Bytes subidos: {total}")
+    print(f"{'Modo':<22} {'Guardado':>12} {'Ratio':>7} {'Bloques':>8} {'MB/s':>8}")
+    print(f"{'fichero entero':<22} {sum(whole.values()):>12} {total / sum(whole.values()):>7.2f} "
+          f"{len(whole):>8} {'-':>8}")
+
+    implementations = [False] if np is None else [True, False]
+    for use_numpy in implementations:
+        chunker = Chunker(ARGS.average_size, use_numpy=use_numpy)
+        speed, stored, count = run_chunker(chunker, dataset)
+        mode = f"cdc ({'numpy' if use_numpy else 'python'})"
+        print(f"{mode:<22} {stored:>12} {total / stored:>7.2f} {count:>8} {speed:>8.2f}")
+    if np is None:
+        print('NumPy no está instalado: solo se mide la implementación en Python puro')
+    return 0
+
+
+if __name__ == '__main__':
+
+    my_parser = argparse.ArgumentParser()
+    my_parser.add_argument('-p', '--path',
+        help='Directorio con los ficheros de prueba',
+        action='store',
+        type=str,
+        default=FILES_PATH)
+    my_parser.add_argument('-a', '--average-size',
+        help='Tamaño medio de bloque en bytes',
+        action='store',
+        type=int,
+        default=DEFAULT_AVERAGE_CHUNK_SIZE)
+    my_parser.add_argument('--no-edits',
+        help='No añadir versiones editadas de los ficheros',
+        action='store_true')
+
+    ARGS = my_parser.parse_args()
+    sys.exit(main())
@@ -1,7 +1,8 @@
 #!/usr/bin/python3
 
+import os
 import sys
-import binascii
+import time
 
 import Ice
 import argparse
@@ -10,9 +11,13 @@ import colorlog
 
 Ice.loadSlice('urfs.ice')
 import URFS
+from util import get_small_object_threshold, get_max_chunk_size
+from transfer import negotiate, send_file, send_delta, download_to, write_verified, file_md5, DigestMismatchError, DEFAULT_UPLOAD_WINDOW, DEFAULT_DOWNLOAD_STREAMS
+from transfer import send_erasure, fetch_erasure
+from erasure import ReedSolomon
+from transfer import load_upload_session, save_upload_session, clear_upload_session
 
 DOWNLOAD_PATH = 'downloads'
-BLOCK_SIZE = 1024
 
 
 class Client(Ice.Application):
@@ -43,12 +48,20 @@ class Client(Ice.Application):
         if not self.frontend:
             raise RuntimeError('Proxy inválido')
 
-        if ARGS.upload:
+        if ARGS.upload and ARGS.delta:
+            self.delta_request(ARGS.upload, ARGS.delta)
+        elif ARGS.upload and ARGS.erasure is not None:
+            self.erasure_request(ARGS.upload, ARGS.erasure)
+        elif ARGS.upload and ARGS.stripe is not None:
+            self.stripe_request(ARGS.upload, ARGS.stripe)
+        elif ARGS.upload:
             self.upload_request(ARGS.upload)
         elif ARGS.download:
             self.download_request(ARGS.download)
         elif ARGS.remove:
             self.remove_request(ARGS.remove)
+        elif ARGS.stats:
+            self.stats_request()
         elif ARGS.list:
             lista_ficheros=self.frontend.getFileList()
             logging.info("Listado de ficheros obtenido: ")
@@ -61,39 +74,301 @@ class Client(Ice.Application):
         ya está en uso en el servidor. En caso de errores, como la inexistencia del archivo o el uso previo del 
         nombre del archivo, registra los errores correspondientes y termina la ejecución.
 
+        Los archivos de como mucho `URFS.SmallObjectThreshold` bytes se suben enteros con una sola llamada
+        (`putSmall`). Para los demás, antes de enviar nada se calcula el hash del archivo en local y se pregunta al frontend si ese contenido ya
+        existe (`hasFile`); en tal caso no se transfiere ningún dato y el nombre se registra como alias del
+        contenido existente (`linkFile`).
+
         :param file_name: El nombre del archivo que se desea cargar en el servidor.
         :return: No devuelve ningún valor. En caso de éxito, la función registra la información del archivo cargado.
          Si se encuentra un error (archivo no encontrado o nombre de archivo en uso), la función termina sin realizar la carga.
         """
 
         try:  #Comprueba si file_name existe
-            open(file_name, 'rb')
+            size = os.path.getsize(file_name)
         except FileNotFoundError:
             logging.error('Archivo no encontrado')
             return
-        try:
-            uploader = self.frontend.uploadFile(file_name)
-        except URFS.FileNameInUseError:
-            logging.error('El nombre del archivo ya está en uso')
+        properties = self.communicator().getProperties()
+        if size <= get_small_object_threshold(properties) and self.put_small(file_name):
             return
+        file_hash = file_md5(file_name)
+        if self.frontend.hasFile(file_hash):  #El contenido ya está en el sistema, no hace falta enviarlo
+            self.discard_upload(file_name)
+            try:
+                file_info = self.frontend.linkFile(file_name, file_hash)
+            except URFS.FileNameInUseError:
+                logging.error('El nombre del archivo ya está en uso')
+                return
+            except URFS.FileNotFoundError:
+                file_info = None  #Se ha eliminado mientras tanto, se sube normalmente
+            if file_info:
+                logging.info(f'El contenido ya existía, se ha registrado el alias. Archivo: {file_info.name}: {file_info.hash}')
+                return
+        uploader, offset = self.resume_upload(file_name)
+        if not uploader:
+            try:
+                uploader = self.frontend.uploadFile(file_name)
+            except URFS.FileNameInUseError:
+                logging.error('El nombre del archivo ya está en uso')
+                return
+            save_upload_session(file_name, uploader.getSessionId())
         
-        with open(file_name, 'rb') as _file:
-            while True:
-                data = _file.read(BLOCK_SIZE)
-                if not data:
-                    break
-                data = str(binascii.b2a_base64(data, newline=False)) # "b'...'" ¡CUIDADO!
-                logging.info("Enviando datos. Tamaño: {}".format(len(data)))
-                uploader.send(data)
+        window = ARGS.window or properties.getPropertyAsIntWithDefault('URFS.UploadWindow', DEFAULT_UPLOAD_WINDOW)
+        sizer = negotiate(uploader, properties)
         try:
+            with open(file_name, 'rb') as _file:
+                _file.seek(offset)
+                send_file(uploader, _file, sizer, window)
             file_info = uploader.save()
         except URFS.FileAlreadyExistsError as e:
             logging.error(f'El archivo ya existe: {e.hash}')
+            clear_upload_session(file_name)
+            uploader.destroy()
+            return
+        except URFS.FileNameInUseError:
+            logging.error('El nombre del archivo ya está en uso')
+            clear_upload_session(file_name)
+            uploader.destroy()
+            return
+        except URFS.TransferError as e:
+            logging.error(f'Error en la subida: {e.reason}')
+            clear_upload_session(file_name)
             uploader.destroy()
             return
+        except Ice.Exception as e:
+            logging.error(f'Subida interrumpida ({e}). Vuelva a ejecutar la subida para reanudarla')
+            return
+        clear_upload_session(file_name)
         uploader.destroy()
         logging.info(f'Subida del archivo finalizada. Archivo: {file_info.name}: {file_info.hash}')
 
+    def delta_request(self, file_name, base_hash):
+        """
+        Sube una versión modificada de un archivo que ya está en el sistema enviando solo lo que ha cambiado:
+        pide las firmas por bloques del archivo base (`getSignatures`), compara con ellas el archivo local y el
+        FileManager que guarda el archivo base reconstruye el nuevo copiando los bloques que coinciden. El
+        FileManager calcula el hash del resultado como en cualquier otra subida.
+
+        Si el contenido ya está en el sistema solo se registra el nombre, como en `upload_request`; si el archivo
+        base no existe, se hace una subida normal.
+
+        :param file_name: El nombre del archivo local que se desea cargar.
+        :param base_hash: Hash del archivo del sistema del que parte la nueva versión.
+        """
+        if not os.path.isfile(file_name):
+            logging.error('Archivo no encontrado')
+            return
+        if self.frontend.hasFile(file_md5(file_name)):
+            self.upload_request(file_name)
+            return
+        try:
+            signatures = self.frontend.getSignatures(base_hash)
+            uploader = self.frontend.uploadDelta(file_name, base_hash)
+        except URFS.FileNameInUseError:
+            logging.error('El nombre del archivo ya está en uso')
+            return
+        except URFS.FileNotFoundError:
+            logging.warning(f'El archivo base {base_hash} no existe, se sube el archivo completo')
+            self.upload_request(file_name)
+            return
+
+        properties = self.communicator().getProperties()
+        window = ARGS.window or properties.getPropertyAsIntWithDefault('URFS.UploadWindow', DEFAULT_UPLOAD_WINDOW)
+        sizer = negotiate(uploader, properties)
+        try:
+            with open(file_name, 'rb') as _file:
+                sent, copied = send_delta(uploader, _file, base_hash, signatures, sizer.maximum, window)
+            file_info = uploader.save()
+        except (URFS.FileNotFoundError, URFS.FileNameInUseError, URFS.TransferError) as e:
+            logging.error(f'Error en la subida: {e}')
+            return
+        finally:
+            uploader.destroy()
+        logging.info(f'Subida delta finalizada: {sent} bytes enviados, {copied} copiados del archivo base. '
+                     f'Archivo: {file_info.name}: {file_info.hash}')
+
+    def erasure_request(self, file_name, spec):
+        """
+        Sube un archivo con código de borrado: el frontend elige k + m FileManager distintos (`planErasure`), el
+        cliente divide el archivo en k fragmentos de datos, calcula m de paridad y sube cada fragmento a su
+        FileManager (`layout_upload`).
+
+        :param file_name: El nombre del archivo local que se desea cargar.
+        :param spec: Parámetros del código con la forma `k+m`, o cadena vacía para los del frontend.
+        """
+        try:
+            data_shards, parity_shards = (int(value) for value in spec.split('+')) if spec else (0, -1)
+        except ValueError:
+            logging.error(f'Parámetros de código de borrado no válidos: {spec} (se esperaba k+m)')
+            return
+        self.layout_upload(file_name, lambda size: self.frontend.planErasure(file_name, size, data_shards, parity_shards))
+
+    def stripe_request(self, file_name, width):
+        """
+        Sube un archivo grande repartido en franjas entre varios FileManager (`planStripes`), que reciben sus
+        bloques a la vez (`layout_upload`). Las descargas los piden también a todos a la vez.
+
+        :param file_name: El nombre del archivo local que se desea cargar.
+        :param width: Número de FileManager, o 0 para el valor del frontend.
+        """
+        self.layout_upload(file_name, lambda size: self.frontend.planStripes(file_name, size, width))
+
+    def layout_upload(self, file_name, plan):
+        """
+        Sube un archivo dividido en fragmentos, uno por FileManager, según la distribución que devuelve `plan`.
+        Cada fragmento se sube a su FileManager como una réplica, que se confirma comprobando su hash
+        (`commitReplica`), y al final el archivo se registra con su distribución (`commitErasure`).
+
+        Si el contenido ya está en el sistema, el archivo está vacío o no hay suficientes FileManager
+        disponibles, se hace una subida normal.
+
+        :param file_name: El nombre del archivo local que se desea cargar.
+        :param plan: Función que recibe el tamaño del archivo y devuelve su `URFS.ErasureLayout`.
+        """
+        if not os.path.isfile(file_name):
+            logging.error('Archivo no encontrado')
+            return
+        size = os.path.getsize(file_name)
+        file_hash = file_md5(file_name)
+        if not size or self.frontend.hasFile(file_hash):
+            self.upload_request(file_name)
+            return
+        try:
+            layout = plan(size)
+        except URFS.FileNameInUseError:
+            logging.error('El nombre del archivo ya está en uso')
+            return
+        except URFS.NotEnoughFileManagersError as e:
+            logging.warning(f'Solo hay {e.available} FileManager disponibles de los {e.required} necesarios, '
+                            f'se sube el archivo completo')
+            self.upload_request(file_name)
+            return
+
+        properties = self.communicator().getProperties()
+        window = ARGS.window or properties.getPropertyAsIntWithDefault('URFS.UploadWindow', DEFAULT_UPLOAD_WINDOW)
+        codec = ReedSolomon(layout.dataShards, layout.parityShards)
+        uploaders = []
+        committed = []
+        start = time.perf_counter()
+        try:
+            for index, shard in enumerate(layout.shards):
+                uploaders.append(shard.fileManager.createReplicaUploader(f'{file_hash}.shard{index}', [], []))
+            layout.cellSize = min([layout.cellSize, get_max_chunk_size(properties)] +
+                                  [uploader.getTransferParams().maxChunkSize for uploader in uploaders])
+            with open(file_name, 'rb') as _file:
+                hashes = send_erasure(uploaders, _file, codec, layout.cellSize, window)
+            for uploader, shard, shard_hash in zip(uploaders, layout.shards, hashes):
+                uploader.commitReplica(shard_hash)
+                shard.hash = shard_hash
+                committed.append(shard)
+            file_info = self.frontend.commitErasure(file_name, file_hash, layout)
+        except (URFS.FileNameInUseError, URFS.TransferError, Ice.Exception) as e:
+            logging.error(f'Error en la subida: {e}')
+            for shard in committed:  # Los fragmentos ya guardados no pertenecen a ningún archivo
+                try:
+                    shard.fileManager.removeFile(shard.hash, '')
+                except (URFS.FileNotFoundError, Ice.Exception):
+                    pass
+            return
+        finally:
+            for uploader in uploaders:
+                try:
+                    uploader.destroy()
+                except Ice.Exception:
+                    pass
+        elapsed = time.perf_counter() - start
+        mode = (f'con código de borrado {layout.dataShards}+{layout.parityShards}' if layout.parityShards
+                else f'repartida en {layout.dataShards} FileManager')
+        logging.info(f'Subida {mode} finalizada ({size / 1024 / 1024 / max(elapsed, 1e-9):.2f} MB/s). '
+                     f'Archivo: {file_info.name}: {file_info.hash}')
+
+    def erasure_download(self, file_hash, layout):
+        """
+        Descarga un archivo con código de borrado reconstruyéndolo a partir de k de sus fragmentos. Los
+        fragmentos cuyo FileManager no responde o que se han perdido se sustituyen por los de paridad (lectura
+        degradada). Los archivos repartidos en franjas (sin paridad) se descargan igual, leyendo de todos sus
+        FileManager a la vez.
+
+        :param file_hash: El hash del archivo.
+        :param layout: Objeto `URFS.ErasureLayout` recibido en `URFS.ErasureCodedError`.
+        """
+        codec = ReedSolomon(layout.dataShards, layout.parityShards)
+
+        def open_shard(index):
+            shard = layout.shards[index]
+            return shard.fileManager.openDownloader(shard.hash).downloader
+
+        properties = self.communicator().getProperties()
+        window = ARGS.streams or properties.getPropertyAsIntWithDefault('URFS.DownloadStreams', DEFAULT_DOWNLOAD_STREAMS)
+        start = time.perf_counter()
+        try:
+            degraded = fetch_erasure(open_shard, f'{DOWNLOAD_PATH}/{file_hash}', file_hash, layout.size, codec,
+                                     layout.cellSize, window)
+        except DigestMismatchError as e:
+            logging.error(f'Descarga corrupta: {e}')
+            return
+        except IOError as e:
+            logging.error(f'No se puede reconstruir el archivo: {e}')
+            return
+        if degraded:
+            logging.warning(f'Lectura degradada: {degraded} franjas reconstruidas con fragmentos de paridad')
+        logging.info(f'Descarga finalizada ({layout.size / 1024 / 1024 / max(time.perf_counter() - start, 1e-9):.2f} MB/s)')
+
+    def put_small(self, file_name):
+        """
+        Sube un archivo pequeño en una sola llamada (`putSmall`).
+
+        :param file_name: El nombre del archivo local.
+        :return: True si la petición se ha atendido (con éxito o con error), False si el frontend lo considera
+        demasiado grande y hay que subirlo por bloques.
+        """
+        with open(file_name, 'rb') as _file:
+            data = _file.read()
+        try:
+            file_info = self.frontend.putSmall(file_name, data)
+        except URFS.FileNameInUseError:
+            logging.error('El nombre del archivo ya está en uso')
+            return True
+        except URFS.ObjectTooLargeError as e:
+            logging.info(f'El archivo supera el tamaño de objeto pequeño ({e.maxSize} bytes), se sube por bloques')
+            return False
+        logging.info(f'Subida del archivo finalizada. Archivo: {file_info.name}: {file_info.hash}')
+        return True
+
+    def discard_upload(self, file_name):
+        """
+        Descarta la sesión de subida pendiente de un fichero, si la hay, liberando el Uploader en el servidor.
+
+        :param file_name: El nombre del archivo local.
+        """
+        uploader, _ = self.resume_upload(file_name)
+        if uploader:
+            uploader.destroy()
+        clear_upload_session(file_name)
+
+    def resume_upload(self, file_name):
+        """
+        Intenta reanudar una subida interrumpida del mismo fichero a partir de la sesión guardada localmente.
+
+        :param file_name: El nombre del archivo que se desea cargar en el servidor.
+        :return: Tupla (uploader, offset). Si no hay sesión pendiente o ya no existe en el servidor, devuelve (None, 0).
+        """
+        session_id = load_upload_session(file_name)
+        if not session_id:
+            return None, 0
+
+        try:
+            uploader = self.frontend.resumeUpload(session_id)
+            offset = uploader.getCommittedOffset()
+        except (URFS.SessionNotFoundError, Ice.ObjectNotExistException):
+            logging.warning(f'La sesión de subida {session_id} ya no existe, se empieza desde el principio')
+            clear_upload_session(file_name)
+            return None, 0
+
+        logging.info(f'Reanudando subida {session_id} desde el offset {offset}')
+        return uploader, offset
+
     def download_request(self, file_hash):
         """
         Esta función se encarga de descargar un archivo desde un servidor frontend utilizando su hash único como identificador.
@@ -101,32 +376,119 @@ class Client(Ice.Application):
         con el hash proporcionado no se encuentre en el servidor.
 
         :param file_hash: El hash del archivo que se desea descargar. Este hash actúa como un identificador único para
-        localizar y recuperar el archivo específico desde el servidor mediante el método `downloadFile`.
+        localizar y recuperar el archivo específico desde el servidor mediante el método `openDownload`, que
+        devuelve también su tamaño. Con él se elige el camino: un objeto pequeño se lee entero con una sola llamada
+        `recvAt` y el resto se descarga por bloques, sin consultas previas que fallen para los grandes.
 
         :return: No retorna ningún valor. La función realiza la descarga y guarda el archivo en el sistema local. Si el archivo
         no se encuentra, registra un mensaje de error y finaliza sin realizar la descarga.
         """
+        properties = self.communicator().getProperties()
+        if ARGS.multi_source or properties.getPropertyAsInt('URFS.MultiSourceDownload'):
+            self.multi_source_download(file_hash)
+            return
+
         try:
-            downloader = self.frontend.downloadFile(file_hash)
+            ticket = self.frontend.openDownload(file_hash)
         except URFS.FileNotFoundError:
             logging.error('Archivo no encontrado')
             return
-        
-        with open(f'{DOWNLOAD_PATH}/{file_hash}', 'wb') as _file: #Abrir directorio y escribir en un archivo que no existe con el nombre del hash
-            while True:
-                data = downloader.recv(BLOCK_SIZE)
-                
-                data = data[2:-1]  # Elimina el prefijo "b''" y el sufijo "'"
-                decoded_data = binascii.a2b_base64(data)  # Decodifica los datos de base64 a bytes
-                
-                _file.write(decoded_data)
-                logging.info(f"Recibiendo datos. Tamaño: {len(decoded_data)}")
-                if len(data) < BLOCK_SIZE:
-                    break
+        except URFS.ErasureCodedError as e:
+            self.erasure_download(file_hash, e.layout)
+            return
+
+        if ticket.size <= get_small_object_threshold(properties):  # Los objetos pequeños se reciben enteros en una sola llamada
+            data = ticket.downloader.recvAt(0, ticket.size)
+            if len(data) == ticket.size:  # Si el FileManager usa bloques más pequeños, se sigue por bloques
+                ticket.downloader.destroy()
+                try:
+                    write_verified(f'{DOWNLOAD_PATH}/{file_hash}', data, file_hash)
+                except DigestMismatchError as e:
+                    logging.error(f'Descarga corrupta: {e}')
+                    return
+                logging.info('Descarga finalizada')
+                return
+
+        downloader = ticket.downloader
+        streams = ARGS.streams or properties.getPropertyAsIntWithDefault('URFS.DownloadStreams', DEFAULT_DOWNLOAD_STREAMS)
+        sizer = negotiate(downloader, properties)
+        try:
+            download_to(downloader, f'{DOWNLOAD_PATH}/{file_hash}', file_hash, sizer, streams, ticket.size) #Escribir en un archivo con el nombre del hash
+        except DigestMismatchError as e:
+            logging.error(f'Descarga corrupta: {e}')
+            downloader.destroy()
+            return
         
         downloader.destroy()
         logging.info('Descarga finalizada')
 
+    def multi_source_download(self, file_hash):
+        """
+        Descarga un archivo de todos los FileManager que lo guardan a la vez: pide al frontend la lista de
+        poseedores (`getHolders`), abre un Downloader en cada uno en paralelo y reparte los rangos entre todos,
+        de modo que los que responden más rápido descargan más. Una réplica que no responde o que falla a mitad
+        de la descarga se descarta sin interrumpirla.
+
+        :param file_hash: El hash del archivo que se desea descargar.
+        """
+        try:
+            holders = self.frontend.getHolders(file_hash)
+        except URFS.FileNotFoundError:
+            logging.error('Archivo no encontrado')
+            return
+        except URFS.ErasureCodedError as e:
+            self.erasure_download(file_hash, e.layout)
+            return
+
+        requests = [(filemanager, filemanager.openDownloaderAsync(file_hash)) for filemanager in holders]
+        tickets = []
+        names = []
+        for filemanager, future in requests:
+            try:
+                tickets.append(future.result())
+                names.append(filemanager.ice_getIdentity().name)
+            except (URFS.FileNotFoundError, Ice.Exception) as e:
+                logging.warning(f'{filemanager.ice_getIdentity().name} no puede servir el archivo: {e}')
+        if not tickets:
+            logging.error('Ningún FileManager puede servir el archivo')
+            return
+        logging.info(f'Descargando de {len(tickets)} fuentes: {", ".join(names)}')
+
+        downloaders = [ticket.downloader for ticket in tickets]
+        properties = self.communicator().getProperties()
+        streams = ARGS.streams or properties.getPropertyAsIntWithDefault('URFS.DownloadStreams', DEFAULT_DOWNLOAD_STREAMS)
+        sizer = negotiate(downloaders[0], properties)
+        start = time.perf_counter()
+        try:
+            download_to(downloaders[0], f'{DOWNLOAD_PATH}/{file_hash}', file_hash, sizer, streams, tickets[0].size,
+                        replicas=downloaders[1:])
+        except DigestMismatchError as e:
+            logging.error(f'Descarga corrupta: {e}')
+            return
+        except Ice.Exception as e:
+            logging.error(f'Descarga interrumpida ({e}). Vuelva a ejecutar la descarga para reanudarla')
+            return
+        finally:
+            for downloader in downloaders:
+                try:
+                    downloader.destroy()
+                except Ice.Exception:
+                    pass
+        elapsed = time.perf_counter() - start
+        logging.info(f'Descarga finalizada ({tickets[0].size / 1024 / 1024 / max(elapsed, 1e-9):.2f} MB/s)')
+
+    def stats_request(self):
+        """
+        Muestra las estadísticas de deduplicación del sistema: subidas recibidas, cuántas eran contenido ya
+        guardado, bytes almacenados, bytes ahorrados y el ratio de deduplicación (bytes lógicos / físicos).
+        """
+        stats = self.frontend.getDedupStats()
+        ratio = (stats.bytesStored + stats.bytesSaved) / stats.bytesStored if stats.bytesStored else 1.0
+        print(f"Subidas: {stats.uploads} (duplicadas: {stats.duplicates})")
+        print(f"Bytes almacenados: {stats.bytesStored}  Bytes ahorrados: {stats.bytesSaved}")
+        print(f"Ratio de deduplicación: {ratio:.2f}")
+        print(f"Bytes recuperados por la compactación: {stats.bytesReclaimed}")
+
     def remove_request(self, file_hash):
         """
         Esta función se encarga de eliminar un archivo en un sistema remoto. Utiliza un identificador único, conocido como 
@@ -184,10 +546,42 @@ if __name__ == '__main__':
         help='Lista todos los archivos en el sistema',
         action='store_true',
         default=False)
+    my_group.add_argument('-S', '--stats',
+        help='Muestra las estadísticas de deduplicación del sistema',
+        action='store_true',
+        default=False)
     my_group.add_argument('-t', '--test',
         help='Prueba la conexión',
         action='store_true',
         default=False)
+    my_parser.add_argument('-D', '--delta',
+        help='Con --upload, sube solo los cambios respecto al archivo del sistema con este hash',
+        action='store',
+        type=str,)
+    my_parser.add_argument('-E', '--erasure',
+        help='Con --upload, guarda el archivo con código de borrado k+m (por ejemplo 4+2; sin valor, el del frontend)',
+        action='store',
+        nargs='?',
+        const='',
+        type=str,)
+    my_parser.add_argument('-P', '--stripe',
+        help='Con --upload, reparte el archivo en franjas entre N FileManager (sin valor, el número del frontend)',
+        action='store',
+        nargs='?',
+        const=0,
+        type=int,)
+    my_parser.add_argument('-M', '--multi-source',
+        help='Con --download, descarga a la vez de todos los FileManager que guardan el archivo',
+        action='store_true',
+        default=False)
+    my_parser.add_argument('-w', '--window',
+        help='Número de bloques en vuelo durante la subida (1 = síncrona)',
+        action='store',
+        type=int,)
+    my_parser.add_argument('-s', '--streams',
+        help='Número de conexiones paralelas durante la descarga (1 = secuencial)',
+        action='store',
+        type=int,)
     
     ARGS, unknown = my_parser.parse_known_args()
     sys.exit(Client().main(sys.argv))
@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import time
+
+import argparse
+
+from erasure import ReedSolomon, DEFAULT_CELL_SIZE, np
+
+CONFIGURATIONS = '2+1,4+2,6+3,10+4'
+DATA_SIZE = 32 * 1024 * 1024
+MB = 1024 * 1024
+
+
+def measure(codec, data, cell_size):
+    """
+    Codifica `data` franja a franja y lo reconstruye después sin los m primeros fragmentos de datos, el peor
+    caso de una lectura degradada.
+
+    :return: Tupla (MB/s de codificación, MB/s de decodificación), sobre el tamaño de los datos originales.
+    """
+    stripe_size = codec.data_shards * cell_size
+    stripes = [codec.split(data[offset:offset + stripe_size], cell_size) for offset in range(0, len(data), stripe_size)]
+
+    start = time.perf_counter()
+    encoded = [cells + codec.encode(cells) for cells in stripes]
+    encode_elapsed = time.perf_counter() - start
+
+    lost = set(range(min(codec.parity_shards, codec.data_shards)))
+    start = time.perf_counter()
+    for cells, shards in zip(stripes, encoded):
+        decoded = codec.decode({index: cell for index, cell in enumerate(shards) if index not in lost})
+        if decoded != cells:
+            raise RuntimeError(f'La reconstrucción {codec.data_shards}+{codec.parity_shards} no coincide')
+    decode_elapsed = time.perf_counter() - start
+    return len(data) / MB / max(encode_elapsed, 1e-9), len(data) / MB / max(decode_elapsed, 1e-9)
+
+
+def main():
+    """
+    Mide, sin necesidad de desplegar el sistema, la velocidad de codificación y de decodificación (con m
+    fragmentos de datos perdidos) del código Reed-Solomon para varias configuraciones k+m, con las
+    implementaciones NumPy y Python puro. También muestra el coste en disco de cada configuración frente a
+    guardar réplicas completas.
+
+    :return: El código devuelve el valor 0.
+    """
+    data = os.urandom(ARGS.size)
+    print(f"Datos: {len(data)} bytes  Celda: {ARGS.cell_size} bytes")
+    print(f"{'Código':<8} {'Impl.':<8} {'Disco':>6} {'Tolera':>7} {'Cod. MB/s':>10} {'Dec. MB/s':>10}")
+    implementations = [False] if np is None else [True, False]
+    for configuration in ARGS.configurations.split(','):
+        data_shards, parity_shards = (int(value) for value in configuration.split('+'))
+        for use_numpy in implementations:
+            codec = ReedSolomon(data_shards, parity_shards, use_numpy=use_numpy)
+            encode_speed, decode_speed = measure(codec, data, ARGS.cell_size)
+            overhead = codec.total_shards / codec.data_shards
+            print(f"{configuration:<8} {'numpy' if use_numpy else 'python':<8} {overhead:>5.2f}x {parity_shards:>7} "
+                  f"{encode_speed:>10.2f} {decode_speed:>10.2f}")
+    if np is None:
+        print('NumPy no está instalado: solo se mide la implementación en Python puro')
+    return 0
+
+
+if __name__ == '__main__':
+
+    my_parser = argparse.ArgumentParser()
+    my_parser.add_argument('-c', '--configurations',
+        help='Configuraciones k+m separadas por comas',
+        action='store',
+        type=str,
+        default=CONFIGURATIONS)
+    my_parser.add_argument('-s', '--size',
+        help='Bytes de datos aleatorios que se codifican',
+        action='store',
+        type=int,
+        default=DATA_SIZE)
+    my_parser.add_argument('--cell-size',
+        help='Tamaño de celda en bytes',
+        action='store',
+        type=int,
+        default=DEFAULT_CELL_SIZE)
+
+    ARGS = my_parser.parse_args()
+    sys.exit(main())
@@ -6,7 +6,16 @@ import binascii
 import Ice
 import IceStorm
 import hashlib
-from util import get_topic_manager
+import threading
+import queue
+import time
+import uuid
+from collections import deque
+from util import get_topic_manager, get_max_chunk_size, get_preferred_chunk_size, get_small_object_threshold
+from storage import ObjectStore, Compactor, Throttle
+from chunking import Chunker, DEFAULT_AVERAGE_CHUNK_SIZE
+from delta import delta_block_size, signatures
+from collections import namedtuple
 import logging
 import colorlog
 
@@ -14,8 +23,125 @@ Ice.loadSlice('urfs.ice')
 import URFS
 
 STORAGE_PATH = 'storage'
+MAX_PENDING_BLOCKS = 64  # Bloques fuera de orden que un Uploader acepta antes de rechazar más
+MAX_PENDING_BYTES = 32 * 1024 * 1024  # Bytes fuera de orden que un Uploader guarda en memoria como mucho
+WRITE_QUEUE_BLOCKS = 8  # Bloques en cola hacia el hilo escritor antes de frenar la recepción
+DEFAULT_COMPACTION_INTERVAL = 60  # Segundos entre pasadas del compactador
+DEFAULT_COMPACTION_LIVE_RATIO = 50  # Porcentaje de datos vivos por debajo del cual se reescribe un segmento
+DEFAULT_COMPACTION_BANDWIDTH = 8 * 1024 * 1024  # Bytes por segundo de E/S del compactador
+DEFAULT_COMPACTION_MIN_RECLAIM = 1024 * 1024  # Bytes recuperables por debajo de los cuales no se reescribe un segmento
+DEFAULT_CHUNKING_MODE = 'file'  # 'file' guarda cada fichero entero; 'cdc' lo divide en bloques por contenido
+COPY_BLOCK_SIZE = 1024 * 1024  # Bytes que el hilo escritor lee de una vez al copiar de un objeto base
+REPLICATION_WINDOW = 4  # Bloques en vuelo hacia la siguiente réplica de la cadena
+DEFAULT_ANTI_ENTROPY_INTERVAL = 300  # Segundos entre pasadas de anti-entropía (0 = desactivada)
+DEFAULT_ANTI_ENTROPY_BANDWIDTH = 4 * 1024 * 1024  # Bytes por segundo de las reparaciones
+DEFAULT_UPLOAD_SESSION_TIMEOUT = 3600  # Segundos sin actividad tras los que se expira una subida (0 = nunca)
+SESSION_REAP_INTERVAL = 60  # Segundos máximos entre revisiones de las subidas inactivas
+MERKLE_LEAF_ENTRIES = 64  # Entradas a partir de las cuales un nodo distinto se divide en sus 16 hijos
+MERKLE_MAX_DEPTH = 8  # Longitud máxima de los prefijos de hash
+REPAIR_ENTRY_BATCH = 64  # Hojas cuyas entradas se piden en una misma llamada
+TOMBSTONE_RETENTION = 7 * 24 * 3600  # Segundos que se conservan las lápidas de réplica
+HEX_DIGITS = '0123456789abcdef'
+
+# Instrucción de una subida delta: copiar `size` bytes del objeto abierto en `reader` a partir de `offset`.
+CopyRange = namedtuple('CopyRange', 'reader offset size')
+
+
+def replica_peers(replica_set, own):
+    """
+    Devuelve los otros FileManager de un conjunto de réplicas, tal como se registran en el índice.
+
+    :param replica_set: Proxies de todos los FileManager que deben guardar un objeto.
+    :param own: Nombre de la identidad de este FileManager, que se excluye.
+    :return: Diccionario nombre de la identidad -> proxy en texto.
+    """
+    return {peer.ice_getIdentity().name: peer.ice_toString() for peer in replica_set
+            if peer and peer.ice_getIdentity().name != own}
+
+
+class LoadCounter:
+    def __init__(self):
+        """
+        Cuenta las transferencias (Uploader y Downloader) activas en un FileManager, que los Frontend consultan
+        con `getLoad` para repartir las descargas entre las réplicas.
+        """
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            self.value += 1
+
+    def release(self):
+        with self.lock:
+            self.value -= 1
+
+
+class UploadSessions:
+    def __init__(self, timeout):
+        """
+        Sesiones de subida abiertas en un FileManager. Un hilo en segundo plano destruye las que llevan más de
+        `timeout` segundos sin actividad, para que una subida abandonada y nunca reanudada no retenga para
+        siempre su servant, su temporal, su hilo escritor, su plaza en el `LoadCounter` ni la sesión de la
+        siguiente réplica.
+
+        :param timeout: Segundos sin actividad tras los que se expira una sesión (0 = nunca).
+        """
+        self.timeout = timeout
+        self.sessions = {}  # Identidad -> (UploaderI, adaptador)
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+
+    def start(self):
+        if self.timeout > 0:
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def add(self, identity, servant, adapter):
+        with self.lock:
+            self.sessions[identity] = (servant, adapter)
+
+    def loop(self):
+        while not self.stopped.wait(min(self.timeout, SESSION_REAP_INTERVAL)):
+            try:
+                self.expire_idle()
+            except Exception:
+                logging.exception("Error al expirar las sesiones de subida")
+
+    def expire_idle(self):
+        """
+        Destruye las sesiones inactivas y olvida las que ya se han destruido.
+
+        :return: Número de sesiones expiradas.
+        """
+        now = time.monotonic()
+        with self.lock:
+            idle = [(identity, servant, adapter) for identity, (servant, adapter) in self.sessions.items()
+                    if servant.released or now - servant.last_activity > self.timeout]
+            for identity, servant, adapter in idle:
+                del self.sessions[identity]
+
+        expired = 0
+        for identity, servant, adapter in idle:
+            if servant.released:
+                continue
+            try:
+                adapter.remove(identity)
+            except Ice.NotRegisteredException:
+                pass
+            except Ice.ObjectAdapterDeactivatedException:
+                return expired
+            servant.release()
+            expired += 1
+            logging.info(f"Sesión de subida expirada por inactividad --> {servant.session_id}")
+        return expired
+
+
 class UploaderI(URFS.Uploader):
-    def __init__(self, filename, publisher, filemanager):      
+    def __init__(self, filename, publisher, filemanager, transfer_params, session_id, store, link_existing, downstream=None, replica=False, load=None, peers=None):      
         """
         Esta función inicializa un objeto con atributos para manejo de archivos, editor, nombre, 
         nombre de archivo, archivo y objeto hash.
@@ -23,13 +149,49 @@ class UploaderI(URFS.Uploader):
         :param publisher: Es un parámetro que se utiliza para gestionar la publicación de eventos en el canal FileUpdates. 
         :param filemanager: Es un parámetro que representa el objeto de manejo de archivos que se utilizará.
         para administrar archivos. El propósito de este parámetro es proporcionar una forma de interactuar con los archivos.
+        :param transfer_params: Objeto `URFS.TransferParams` con los tamaños de bloque que anuncia el FileManager.
+        :param session_id: Identificador estable de la sesión de subida, que permite reanudarla tras una desconexión.
+        :param store: Almacenamiento `ObjectStore` del FileManager, en el que se confirma la subida.
+        :param link_existing: Función que recibe un nombre, un hash y el proxy de este FileManager y, si el
+        contenido ya está guardado en algún FileManager del sistema, registra el nombre como alias y devuelve su `URFS.FileInfo` (o None si no está).
+        :param downstream: Proxy `URFS.UploaderPrx` de la siguiente réplica de la cadena, al que se reenvía cada
+        bloque en cuanto se escribe, o None si no se replica.
+        :param replica: True si esta subida es una réplica: se confirma con `commitReplica` y no se publica.
+        :param load: `LoadCounter` del FileManager, en el que la subida cuenta mientras está activa.
+        :param peers: Otros FileManager que deben guardar el contenido (nombre de la identidad -> proxy en texto),
+        que se registran en el índice para la anti-entropía al confirmar la subida.
         """
+        self.store = store
+        self.peers = peers or {}
+        self.downstream = downstream
+        self.replica = replica
+        self.load = load or LoadCounter()
+        self.load.acquire()
+        self.released = False  # La sesión ya se ha destruido o ha expirado
+        self.last_activity = time.monotonic()  # Para expirar la sesión si se abandona
+        self.forwarded = 0  # Bytes reenviados a la siguiente réplica
+        self.in_flight = deque()  # Reenvíos a la siguiente réplica pendientes de respuesta
+        self.link_existing = link_existing
         self.filemanager = filemanager
+        self.transfer_params = transfer_params
+        self.session_id = session_id
         self.publisher = publisher
         self.filename = os.path.basename(filename)
-        full_path = f'{STORAGE_PATH}/{self.filename}' 
-        self.file = open(full_path, 'wb')
+        self.path = store.create_temp()  # La subida se escribe en un temporal hasta que se confirma
+        self.file = open(self.path, 'wb')
+        self.saved = False
+        self.closed = False  # El hilo escritor ya se ha detenido: no se aceptan más bloques
         self.hash_object = hashlib.md5()
+        self.offset = 0  # Bytes escritos en orden hasta ahora
+        self.pending = {}  # Bloques recibidos por delante de self.offset, indexados por su offset
+        self.pending_bytes = 0  # Bytes de datos guardados en self.pending (las copias de una subida delta no cuentan)
+        self.sources = {}  # Objetos base de una subida delta abiertos para copiar de ellos, indexados por su hash
+        self.copied = 0  # Bytes tomados de objetos base en lugar de recibirse por la red
+        self.lock = threading.Lock()
+        self.write_queue = queue.Queue(WRITE_QUEUE_BLOCKS)
+        self.write_error = None
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)  # Decodifica, escribe y calcula el hash
+        self.writer.start()
 
     def send(self, block, current=None):
         """
@@ -41,33 +203,337 @@ class UploaderI(URFS.Uploader):
         """
         if block.startswith("b'") and block.endswith("'"): # Comprueba si el bloque comienza con "b'" y termina con "'"
             block = block[2:-1]  # Elimina el prefijo "b'" y el sufijo "'"
-            decoded_data = binascii.a2b_base64(block)  # Decodifica los datos de base64 a bytes
-            self.file.write(decoded_data)  # Almacena los datos en el atributo data
-            self.hash_object.update(decoded_data)  # Actualiza el objeto hash con los datos decodificados
-            logging.info(f"Recibiendo datos. Tamaño: {len(decoded_data)}")
+            size = len(block) // 4 * 3 - block.endswith('=') - block.endswith('==')  # Tamaño una vez decodificado
+            with self.lock:
+                self.enqueue_block(block, size, encoded=True)  # La decodificación se hace en el hilo escritor
         else:
             logging.error("El formato de los datos del bloque es incorrecto.")
 
+    def sendBytes(self, data, current=None):
+        """
+        Almacena un bloque de datos binarios tal cual llega por la red, sin codificación base64 intermedia.
+        
+        :param data: Bloque de bytes (`sequence<byte>` en Slice) que se escribe en el fichero y se añade al hash.
+        """
+        with self.lock:
+            self.enqueue_block(data, len(data))
+
+    def sendAt(self, offset, data, current=None):
+        """
+        Almacena un bloque indicando su posición en el fichero, lo que permite al cliente tener varios
+        bloques en vuelo a la vez. Los bloques se aplican siempre en orden: si llega uno por delante del
+        offset actual se guarda en memoria hasta que lleguen los anteriores, y si llega uno ya escrito
+        (un reintento) se ignora.
+        
+        :param offset: Posición del primer byte del bloque dentro del fichero.
+        :param data: Bloque de bytes.
+        """
+        with self.lock:
+            self.enqueue_at(offset, data)
+
+    def enqueue_at(self, offset, data):
+        """
+        Aplica un bloque con posición (`sendAt`/`copyAt`): lo entrega al hilo escritor si es el siguiente, junto
+        con los pendientes que le sigan, o lo guarda como pendiente si llega por delante. Debe llamarse con
+        `self.lock` adquirido.
+        
+        :param offset: Posición del bloque dentro del fichero.
+        :param data: Bloque de bytes o `CopyRange`.
+        """
+        self.touch()
+        if self.closed:
+            raise URFS.TransferError("La subida ya está cerrada")
+        if offset < self.offset:
+            logging.warning(f"Bloque duplicado ignorado. Offset: {offset}")
+            return
+
+        if offset > self.offset:
+            size = 0 if isinstance(data, CopyRange) else len(data)
+            previous = self.pending.get(offset)
+            if previous is not None and not isinstance(previous, CopyRange):
+                size -= len(previous)  # Un reintento sustituye al bloque que ya estaba pendiente
+            if previous is None and len(self.pending) >= MAX_PENDING_BLOCKS or \
+                    self.pending_bytes + size > MAX_PENDING_BYTES:
+                raise URFS.TransferError(f"Demasiados bloques fuera de orden (esperado offset {self.offset})")
+            self.pending[offset] = data
+            self.pending_bytes += size
+            return
+
+        while True:
+            self.enqueue_block(data, data.size if isinstance(data, CopyRange) else len(data))
+            if self.offset not in self.pending:
+                return
+            data = self.pending.pop(self.offset)
+            if not isinstance(data, CopyRange):
+                self.pending_bytes -= len(data)
+
+    def copyAt(self, offset, baseHash, baseOffset, size, current=None):
+        """
+        Instrucción de una subida delta: en lugar de recibir un tramo del fichero, lo copia de un objeto que ya
+        está en este FileManager. Se ordena con el resto de bloques igual que `sendAt`.
+        
+        :param offset: Posición del tramo dentro del fichero que se está subiendo.
+        :param baseHash: Hash del objeto del que se copia.
+        :param baseOffset: Posición del tramo dentro del objeto base.
+        :param size: Número de bytes que se copian.
+        """
+        with self.lock:
+            reader = self.sources.get(baseHash)
+            if not reader:
+                location = self.store.lookup(baseHash)
+                if not location:
+                    raise URFS.FileNotFoundError()
+                try:
+                    reader = self.sources[baseHash] = self.store.open(location)
+                except FileNotFoundError:
+                    raise URFS.FileNotFoundError()
+            if baseOffset < 0 or size < 0 or baseOffset + size > reader.size:
+                raise URFS.TransferError(f"Rango fuera del objeto base: {baseOffset}+{size} > {reader.size}")
+            self.enqueue_at(offset, CopyRange(reader, baseOffset, size))
+
+    def enqueue_block(self, data, size, encoded=False):
+        """
+        Entrega un bloque, ya en orden, al hilo escritor y avanza `self.offset`. La cola está acotada, así que
+        si el disco va más lento que la red la llamada espera y la recepción se frena. Debe llamarse con
+        `self.lock` adquirido.
+        
+        :param data: Bloque de bytes, cadena base64 si `encoded` es True, o `CopyRange` de una subida delta.
+        :param size: Tamaño del bloque una vez decodificado.
+        :param encoded: Indica si el bloque viene codificado en base64.
+        """
+        self.touch()
+        if self.closed:
+            raise URFS.TransferError("La subida ya está cerrada")
+        if self.write_error:
+            raise URFS.TransferError(f"Error al escribir la subida: {self.write_error}")
+        self.write_queue.put((data, encoded))
+        self.offset += size
+
+    def write_loop(self):
+        """
+        Hilo escritor: decodifica los bloques que lo necesiten, los escribe al final del fichero y los añade al
+        hash, fuera del hilo de despacho de Ice. `hashlib` y la escritura liberan el GIL con bloques grandes,
+        así que la recepción de red, el cálculo del hash y la E/S de disco se solapan. Termina al recibir None.
+        """
+        while True:
+            item = self.write_queue.get()
+            if item is None:
+                return
+            if self.write_error:
+                continue  # Tras un error se siguen vaciando los bloques para no bloquear a quien los envía
+
+            data, encoded = item
+            try:
+                if isinstance(data, CopyRange):
+                    self.write_copy(data)
+                    continue
+                if encoded:
+                    data = binascii.a2b_base64(data)  # Decodifica los datos de base64 a bytes
+                self.file.write(data)  # Almacena los datos en el fichero
+                self.hash_object.update(data)  # Actualiza el objeto hash con los datos recibidos
+                self.forward(data)
+                logging.info(f"Recibiendo datos. Tamaño: {len(data)}")
+            except Exception as e:
+                logging.error(f"Error al escribir la subida {self.session_id}: {e}")
+                self.write_error = e
+
+    def write_copy(self, copy):
+        """
+        Copia al fichero, por partes, un tramo de un objeto base. Se ejecuta en el hilo escritor.
+        
+        :param copy: `CopyRange` con el lector del objeto base, el offset y el tamaño.
+        """
+        for offset in range(copy.offset, copy.offset + copy.size, COPY_BLOCK_SIZE):
+            data = copy.reader.pread(min(COPY_BLOCK_SIZE, copy.offset + copy.size - offset), offset)
+            self.file.write(data)
+            self.hash_object.update(data)
+            self.forward(data)
+        self.copied += copy.size
+        logging.info(f"Copiando del objeto base. Offset: {copy.offset} Tamaño: {copy.size}")
+
+    def forward(self, data):
+        """
+        Replicación en cadena: reenvía a la siguiente réplica un bloque ya escrito, con hasta
+        `REPLICATION_WINDOW` bloques en vuelo. Si la réplica falla se descarta y la subida continúa sin ella.
+        Se ejecuta en el hilo escritor.
+        
+        :param data: Bloque de bytes.
+        """
+        if not self.downstream:
+            return
+        try:
+            while len(self.in_flight) >= REPLICATION_WINDOW:
+                self.in_flight.popleft().result()
+            self.in_flight.append(self.downstream.sendAtAsync(self.forwarded, data))
+            self.forwarded += len(data)
+        except Ice.Exception as e:
+            self.release_downstream(e)
+
+    def release_downstream(self, error=None):
+        """
+        Deja de replicar: cancela los reenvíos pendientes y destruye la sesión de la siguiente réplica.
+        
+        :param error: Excepción que ha provocado el descarte, si lo hay.
+        """
+        if not self.downstream:
+            return
+        if error:
+            logging.warning(f"Réplica descartada de la subida {self.session_id}: {error}")
+        for future in self.in_flight:
+            future.cancel()
+        self.in_flight.clear()
+        downstream, self.downstream = self.downstream, None
+        try:
+            downstream.destroy()
+        except Ice.Exception:
+            pass
+
+    def flush(self):
+        """
+        Barrera: espera a que el hilo escritor haya procesado todos los bloques entregados y lo detiene. Desde
+        ese momento la subida queda cerrada y los bloques que lleguen se rechazan. Después cierra los objetos
+        base de los que se haya copiado y espera a que la siguiente réplica haya recibido todos los bloques.
+        """
+        with self.lock:
+            self.closed = True
+        if self.writer.is_alive():
+            self.write_queue.put(None)
+            self.writer.join()
+        for reader in self.sources.values():
+            reader.close()
+        self.sources.clear()
+        try:
+            while self.in_flight:
+                self.in_flight.popleft().result()
+        except Ice.Exception as e:
+            self.release_downstream(e)
+
+    def release(self):
+        """
+        Libera la sesión al destruirse o expirar, una sola vez: deja de contar como transferencia activa y, si la
+        subida no se ha confirmado, descarta su temporal.
+        """
+        with self.lock:
+            if self.released:
+                return
+            self.released = True
+        self.load.release()
+        if not self.saved:  # Una subida abandonada no deja su temporal en el almacenamiento
+            self.discard()
+
+    def discard(self):
+        """
+        Libera lo que retiene una subida que no se ha confirmado: el hilo escritor, el temporal y la sesión de
+        la siguiente réplica. Se puede llamar más de una vez.
+        """
+        self.flush()
+        self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.release_downstream()
+
+    def commit_replicas(self, hash):
+        """
+        Confirma la subida en el resto de la cadena de réplicas y libera sus sesiones.
+        
+        :param hash: Hash MD5 del contenido, que cada réplica comprueba antes de confirmar.
+        :return: Lista de proxies de los FileManager que guardan el contenido, empezando por este.
+        """
+        holders = [URFS.FileManagerPrx.uncheckedCast(self.filemanager)]
+        if self.downstream:
+            try:
+                holders += self.downstream.commitReplica(hash)
+            except Ice.Exception as e:
+                logging.warning(f"No se ha podido confirmar la réplica de {hash}: {e}")
+            self.release_downstream()
+        return holders
+
+    def getTransferParams(self, current=None):
+        """
+        Devuelve los tamaños de bloque preferido y máximo que acepta este FileManager.
+        
+        :return: Objeto `URFS.TransferParams`.
+        """
+        return self.transfer_params
+
+    def getSessionId(self, current=None):
+        """
+        Devuelve el identificador de la sesión de subida, con el que se puede reanudar mediante `resumeUpload`.
+        """
+        return self.session_id
+
+    def getCommittedOffset(self, current=None):
+        """
+        Devuelve el número de bytes ya escritos en orden. Una subida reanudada debe continuar desde este offset.
+        """
+        with self.lock:
+            self.touch()
+            return self.offset
+
+    def discard_pending(self):
+        """
+        Descarta los bloques recibidos fuera de orden. Se usa al reanudar una sesión, ya que el cliente vuelve
+        a enviar todo a partir del offset confirmado, posiblemente con otro tamaño de bloque.
+        """
+        with self.lock:
+            self.touch()
+            self.pending.clear()
+            self.pending_bytes = 0
+
+    def touch(self):
+        """
+        Registra actividad en la sesión, que así no expira.
+        """
+        self.last_activity = time.monotonic()
+
     def save(self, current=None):
         """
-        Este método guarda un archivo después de calcular su hash. Luego verifica si ya existe un archivo 
-        con el mismo hash en el directorio especificado por STORAGE_PATH. Si el archivo ya existe, se lanza 
-        un error y se elimina el archivo existente. Si no existe, los datos del archivo se envían a un canal 
-        de actualización de archivos.
+        Este método guarda un archivo después de calcular su hash. El temporal de la subida se mueve de forma
+        atómica a su ruta definitiva en el almacenamiento por contenido. Si ya existe un archivo con el mismo
+        hash, ya sea en este FileManager o en cualquier otro según el índice global de los Frontend, el temporal
+        se elimina y el nombre se registra como alias del contenido existente. Si no existe, los datos del
+        archivo se envían a un canal de actualización de archivos.
         
         :return: El método devuelve una instancia de la clase `URFS.FileInfo` con los atributos `filename` y `hash`.
         """
+        self.touch()
+        if self.replica:
+            raise URFS.TransferError("Las réplicas se confirman con commitReplica")
+        if self.closed:
+            raise URFS.TransferError("La subida ya se ha confirmado o ha fallado al confirmarse")
+        if self.pending:
+            raise URFS.TransferError(f"Faltan bloques a partir del offset {self.offset}")
+
+        self.flush()  # Espera a que todos los bloques estén escritos y en el hash
+        if self.write_error:
+            raise URFS.TransferError(f"Error al escribir la subida: {self.write_error}")
+
         self.hash = self.hash_object.hexdigest()  # Obtiene el hash en formato hexadecimal
-        for file in os.listdir(STORAGE_PATH):  # Comprueba si un archivo con ese hash ya existe en el directorio
-            f = open(f'{STORAGE_PATH}/{file}', 'rb') 
-            file_data = f.read()
-            file_hash = hashlib.md5(file_data).hexdigest()
-            
-            if file_hash == self.hash:
-                    f.close()  
-                    os.remove(os.path.join(STORAGE_PATH, self.filename))
-                    self.file.close() 
-                    raise URFS.FileAlreadyExistsError(self.hash)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        try:
+            file_info = self.link_existing(self.filename, self.hash, self.filemanager)
+            if file_info:  # El contenido ya está guardado: solo se añade el nombre
+                self.discard()
+                self.saved = True
+                return file_info
+            committed = self.store.commit(self.path, self.hash, self.filename)
+        except Exception:  # Nombre en uso o fallo al guardar: la subida no deja nada retenido
+            self.discard()
+            raise
+        self.saved = True
+        if not committed:  # Otra subida del mismo contenido se ha adelantado
+            self.release_downstream()
+            file_info = self.link_existing(self.filename, self.hash, self.filemanager)
+            if not file_info:
+                raise URFS.TransferError(f"El contenido {self.hash} se ha eliminado mientras se guardaba la subida")
+            return file_info
+        self.store.record_upload(self.offset, duplicate=False)
+        self.store.index.add_replicas(self.hash, self.peers)
+        if self.copied:
+            logging.info(f"Subida delta: {self.copied} de {self.offset} bytes copiados de objetos base")
+        holders = self.commit_replicas(self.hash)
 
         file_updates = URFS.FileUpdatesPrx.uncheckedCast(self.publisher)
         logging.info(f"Archivo guardado. Nombre: {self.filename} Hash: {self.hash}")
@@ -77,9 +543,42 @@ class UploaderI(URFS.Uploader):
         else:
             logging.info(f"Enviando file_data a canal de eventos file_updates --> {self.filename} {self.hash}")
         
-        file_updates.new(URFS.FileData(URFS.FileInfo(self.filename, self.hash), URFS.FileManagerPrx.uncheckedCast(self.filemanager)))
-        self.file.close()   
+        file_updates.new(URFS.FileData(URFS.FileInfo(self.filename, self.hash), URFS.FileManagerPrx.uncheckedCast(self.filemanager), holders))
         return URFS.FileInfo(self.filename, self.hash)
+
+    def commitReplica(self, hash, current=None):
+        """
+        Confirma una réplica: comprueba que el contenido recibido tiene el hash del original, lo guarda con el
+        mismo nombre y confirma a su vez la siguiente réplica de la cadena. No se publica ningún evento: lo
+        hace el FileManager que recibió la subida, con la lista completa de réplicas.
+        
+        :param hash: Hash MD5 que ha calculado el FileManager anterior de la cadena.
+        :return: Lista de proxies de los FileManager de la cadena que guardan el contenido, desde este.
+        """
+        self.touch()
+        if not self.replica:
+            raise URFS.TransferError("Solo las réplicas se confirman con commitReplica")
+        if self.closed:
+            raise URFS.TransferError("La réplica ya se ha confirmado o ha fallado al confirmarse")
+        if self.pending:
+            raise URFS.TransferError(f"Faltan bloques a partir del offset {self.offset}")
+        self.flush()
+        if self.write_error:
+            raise URFS.TransferError(f"Error al escribir la réplica: {self.write_error}")
+
+        self.hash = self.hash_object.hexdigest()
+        if self.hash != hash:
+            raise URFS.TransferError(f"El hash de la réplica {self.hash} no coincide con {hash}")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        committed = self.store.commit(self.path, hash, self.filename)
+        self.saved = True
+        if not committed:  # Ya estaba guardado: solo se añade el nombre
+            self.store.link(hash, self.filename)
+        self.store.index.add_replicas(hash, self.peers)
+        logging.info(f"Réplica guardada. Nombre: {self.filename} Hash: {hash}")
+        return self.commit_replicas(hash)
             
     def destroy(self, current=None):
         """
@@ -91,19 +590,43 @@ class UploaderI(URFS.Uploader):
         o métodos de la instancia actual del objeto que se está destruyendo.
         """
         current.adapter.remove(current.id)  # Eliminar la instancia actual del objeto desde su adaptador      
+        self.release()
         logging.info(f'El archivo "{self.filename}" ha sido destruido.')  # Registrar un mensaje para confirmar que la instancia del objeto ha sido destruida
 
 
 class DownloaderI(URFS.Downloader):
-    def __init__(self, file):
+    def __init__(self, reader, transfer_params, load=None):
         """
-        Inicializa un objeto DownloaderI con un archivo. Abre el archivo especificado en modo binario para lectura.
+        Inicializa un objeto DownloaderI con un lector del almacenamiento. Todas las lecturas se hacen con
+        `pread` dentro de los límites del objeto, que puede ocupar un fichero propio, un tramo de un segmento o
+        varios bloques de un manifiesto.
         
-        :param file: Esta es una cadena que representa la ruta completa o el nombre del archivo que se va a abrir. 
-        Es el archivo con el que este objeto DownloaderI trabajará.
+        :param reader: Lector devuelto por `ObjectStore.open`.
+        :param transfer_params: Objeto `URFS.TransferParams` con los tamaños de bloque que anuncia el FileManager.
+        :param load: `LoadCounter` del FileManager, en el que la descarga cuenta mientras está activa.
+        """
+        self.load = load or LoadCounter()
+        self.load.acquire()
+        self.released = False  # La sesión ya se ha destruido o ha expirado
+        self.last_activity = time.monotonic()  # Para expirar la sesión si se abandona
+        self.reader = reader
+        self.size = reader.size
+        self.position = 0  # Posición de la lectura secuencial dentro del objeto
+        self.transfer_params = transfer_params
+
+    def read_at(self, offset, size):
+        """
+        Lee como mucho `size` bytes del objeto a partir de `offset`, sin pasar de su final.
+        """
+        return self.reader.pread(int(size), offset)
+
+    def read(self, size):
+        """
+        Lee los siguientes bytes de la lectura secuencial y avanza la posición.
         """
-        self.file = file
-        self.f = open(self.file, 'rb')  # Abre el archivo en modo binario para lectura
+        data = self.read_at(self.position, size)
+        self.position += len(data)
+        return data
 
     def recv(self, size, current=None):
         """
@@ -113,10 +636,69 @@ class DownloaderI(URFS.Downloader):
         :param size: Es el número de bytes que se leerán del archivo.
         :return: Devuelve una cadena que representa los datos binarios leídos, codificados en base64.
         """
-        data = self.f.read(int(size))
+        data = self.read(size)
         logging.info(f"Enviando datos con tamaño de {len(data)}")
         return str(binascii.b2a_base64(data, newline=False))
 
+    def recvBytes(self, size, current=None):
+        """
+        Lee una cantidad especificada de datos del archivo y los devuelve en binario, sin codificar.
+        
+        :param size: Es el número de bytes que se leerán del archivo.
+        :return: Devuelve los bytes leídos. Un bloque más corto que `size` indica el final del archivo.
+        """
+        data = self.read(size)
+        logging.info(f"Enviando datos con tamaño de {len(data)}")
+        return data
+
+    def recvChunk(self, size, current=None):
+        """
+        Lee el siguiente bloque del archivo e indica explícitamente si es el último, de modo que el cliente
+        termina en exactamente ceil(tamaño / bloque) llamadas sin deducir el final por la longitud recibida.
+        
+        :param size: Es el número de bytes que se leerán del archivo, limitado al tamaño máximo de bloque.
+        :return: Objeto `URFS.Chunk` con los datos leídos y la marca `eof`.
+        """
+        data = self.read(min(int(size), self.transfer_params.maxChunkSize))
+        logging.info(f"Enviando datos con tamaño de {len(data)}")
+        return URFS.Chunk(data, self.position >= self.size)
+
+    def recvAt(self, offset, size, current=None):
+        """
+        Lee un rango del archivo sin depender de la posición de lectura actual, de modo que varios clientes
+        (o varias conexiones del mismo cliente) pueden descargar rangos distintos a la vez.
+        
+        :param offset: Posición del primer byte que se quiere leer.
+        :param size: Número máximo de bytes que se leerán, limitado al tamaño máximo de bloque.
+        :return: Devuelve los bytes leídos. Un bloque más corto que `size` indica el final del archivo.
+        """
+        data = self.read_at(offset, min(int(size), self.transfer_params.maxChunkSize))
+        logging.info(f"Enviando rango. Offset: {offset} Tamaño: {len(data)}")
+        return data
+
+    def seek(self, offset, current=None):
+        """
+        Coloca la lectura secuencial (`recv`/`recvBytes`) en un offset, para reanudar una descarga parcial.
+        
+        :param offset: Posición desde la que continuarán las siguientes lecturas.
+        """
+        self.position = min(offset, self.size)
+        logging.info(f"Descarga reanudada desde el offset {offset}")
+
+    def getSize(self, current=None):
+        """
+        Devuelve el tamaño en bytes del archivo que se está descargando.
+        """
+        return self.size
+
+    def getTransferParams(self, current=None):
+        """
+        Devuelve los tamaños de bloque preferido y máximo que admite este FileManager.
+        
+        :return: Objeto `URFS.TransferParams`.
+        """
+        return self.transfer_params
+
     def destroy(self, current=None):
         """
         Elimina el objeto actual de su adaptador y registra un mensaje indicando que el objeto ha sido destruido.
@@ -127,7 +709,235 @@ class DownloaderI(URFS.Downloader):
         o métodos de la instancia actual del objeto que se está destruyendo.
         """
         current.adapter.remove(current.id)
-        logging.info(f'El archivo {self.file} ha sido destruido')
+        self.load.release()
+        self.reader.close()
+        logging.info('El Downloader ha sido destruido')
+
+
+class AntiEntropy:
+    def __init__(self, filemanager, proxy, interval, bandwidth):
+        """
+        Tarea en segundo plano que hace converger las réplicas. El índice guarda, por cada objeto replicado, qué
+        otros FileManager deberían tenerlo y si se ha borrado; con cada uno de ellos se compara un árbol de
+        Merkle de esas entradas, con un nodo por prefijo hexadecimal del hash. Se empieza por la raíz y solo se
+        baja (pidiendo todos los hijos de un nivel en una llamada) por los nodos cuyo resumen difiere, hasta
+        hojas pequeñas cuyas entradas se piden y se comparan una a una, así que el número de mensajes crece con
+        las diferencias y con el logaritmo del número de objetos, no con el total.
+
+        Cada lado solo arregla lo que le toca: un objeto vivo aquí que falta en el otro FileManager (o que
+        se borró allí antes de volver a subirse aquí) se le envía como réplica, y uno que el otro ha borrado
+        después se borra aquí. El caso contrario lo resuelve la pasada del otro FileManager. Los envíos se
+        limitan a `bandwidth` bytes por segundo para no competir con las transferencias.
+
+        Además atiende, en otro hilo y en orden de llegada, las reparaciones en lectura que piden los Frontend
+        (`schedule`), aunque las pasadas periódicas estén desactivadas.
+
+        :param filemanager: `FileManagerI` cuyo almacenamiento se sincroniza.
+        :param proxy: Proxy `URFS.FileManagerPrx` de este FileManager.
+        :param interval: Segundos entre pasadas (0 = sin pasadas).
+        :param bandwidth: Bytes por segundo de las reparaciones (0 = sin límite).
+        """
+        self.filemanager = filemanager
+        self.store = filemanager.store
+        self.proxy = proxy
+        self.key = proxy.ice_getIdentity().name
+        self.interval = interval
+        self.throttle = Throttle(bandwidth)  # Compartido por las pasadas y las reparaciones en lectura
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.repairs = queue.Queue()  # Tuplas (hash, proxy del FileManager al que le falta)
+        self.scheduled = set()  # (hash, nombre de la identidad) en cola, para no repetir la misma reparación
+        self.lock = threading.Lock()
+        self.repairer = threading.Thread(target=self.repair_loop, daemon=True)
+
+    def start(self):
+        if self.interval > 0:
+            self.thread.start()
+        self.repairer.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.repairs.put(None)
+
+    def schedule(self, hash, target):
+        """
+        Encola el envío de un objeto a un FileManager que debería tenerlo y no lo tiene. Si ya estaba en cola
+        no se repite.
+
+        :param hash: Hash MD5 del contenido.
+        :param target: Proxy `URFS.FileManagerPrx` del FileManager al que le falta.
+        :return: True si se ha encolado, False si ya lo estaba.
+        """
+        key = (hash, target.ice_getIdentity().name)
+        with self.lock:
+            if key in self.scheduled:
+                return False
+            self.scheduled.add(key)
+        self.repairs.put((hash, target))
+        return True
+
+    def repair_loop(self):
+        while True:
+            item = self.repairs.get()
+            if item is None:
+                return
+            hash, target = item
+            key = target.ice_getIdentity().name
+            try:
+                # El destino pasa a ser réplica también para la anti-entropía, en los dos sentidos
+                self.store.index.add_replicas(hash, {key: target.ice_toString()})
+                if not self.push(hash, target, self.throttle):
+                    logging.warning(f"No se puede reparar {hash} en {key}: tampoco está aquí")
+            except Ice.Exception as e:
+                logging.warning(f"No se ha podido reparar {hash} en {key}: {e}")
+            except Exception:
+                logging.exception(f"Error al reparar {hash} en {key}")
+            finally:
+                with self.lock:
+                    self.scheduled.discard((hash, key))
+
+    def loop(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception:
+                logging.exception("Error durante la anti-entropía")
+
+    def run_once(self):
+        """
+        Hace una pasada de anti-entropía con cada FileManager con el que se comparten objetos.
+
+        :return: Tupla (objetos enviados, objetos borrados aquí).
+        """
+        self.store.index.purge_replicas(time.time() - TOMBSTONE_RETENTION)
+        communicator = self.proxy.ice_getCommunicator()
+        pushed = removed = 0
+        for key, proxy in self.store.index.replica_peers().items():
+            if self.stopped.is_set():
+                break
+            peer = URFS.FileManagerPrx.uncheckedCast(communicator.stringToProxy(proxy))
+            try:
+                result = self.sync(key, peer, self.throttle)
+            except Ice.Exception as e:
+                logging.warning(f"No se ha podido sincronizar con {key}: {e}")
+                continue
+            pushed += result[0]
+            removed += result[1]
+        return pushed, removed
+
+    def sync(self, key, peer, throttle):
+        """
+        Compara el árbol de Merkle compartido con un FileManager y repara las diferencias que tocan a este.
+
+        :param key: Nombre de la identidad del otro FileManager.
+        :param peer: Proxy `URFS.FileManagerPrx` del otro FileManager.
+        :param throttle: `Throttle` compartido por todos los envíos de reparación.
+        :return: Tupla (objetos enviados, objetos borrados aquí).
+        """
+        leaves, messages = self.diff(key, peer)
+        if not leaves:
+            return 0, 0
+
+        pushed = removed = 0
+        for start in range(0, len(leaves), REPAIR_ENTRY_BATCH):
+            batch = leaves[start:start + REPAIR_ENTRY_BATCH]
+            theirs = {entry.hash: entry for entry in peer.getReplicaEntries(self.key, batch)}
+            messages += 1
+            for prefix in batch:
+                for hash, deleted, updated in self.store.index.replica_rows(key, prefix):
+                    if deleted:
+                        continue  # Si el otro lo tiene vivo, su pasada le indicará que lo borre o nos lo enviará
+                    entry = theirs.get(hash)
+                    if entry and entry.deleted and entry.updated > updated:
+                        logging.info(f"Anti-entropía: {key} borró {hash}, se borra aquí")
+                        self.filemanager.forget(hash, self.proxy)
+                        removed += 1
+                    elif not entry or entry.deleted:
+                        if self.push(hash, peer, throttle):
+                            pushed += 1
+        logging.info(f"Anti-entropía con {key}: {len(leaves)} hojas distintas, {messages} mensajes, "
+                     f"{pushed} objetos enviados, {removed} borrados aquí")
+        return pushed, removed
+
+    def diff(self, key, peer):
+        """
+        Baja por el árbol de Merkle compartido con un FileManager, un nivel por llamada, hasta las hojas que
+        difieren. Un nodo distinto es hoja si ninguno de los dos lados tiene más de `MERKLE_LEAF_ENTRIES`
+        entradas en él o si se ha llegado a `MERKLE_MAX_DEPTH`.
+
+        :return: Tupla (prefijos de las hojas que difieren, mensajes intercambiados).
+        """
+        prefixes = ['']
+        leaves = []
+        messages = 0
+        while prefixes:
+            remote = peer.getMerkleNodes(self.key, prefixes)
+            messages += 1
+            children = []
+            for prefix, (digest, count), node in zip(prefixes, self.store.index.merkle_nodes(key, prefixes), remote):
+                if digest == node.digest:
+                    continue
+                if max(count, node.count) <= MERKLE_LEAF_ENTRIES or len(prefix) >= MERKLE_MAX_DEPTH:
+                    leaves.append(prefix)
+                else:
+                    children += [prefix + digit for digit in HEX_DIGITS]
+            prefixes = children
+        return leaves, messages
+
+    def push(self, hash, peer, throttle):
+        """
+        Envía un objeto como réplica a otro FileManager, con todos sus nombres, y publica que ya lo guarda para
+        que los Frontend lo registren como poseedor. Los objetos pequeños van en una sola llamada.
+
+        :return: True si se ha enviado, False si los datos ya no están aquí.
+        """
+        location = self.store.lookup(hash)
+        if not location:
+            self.store.index.drop_replicas(hash)  # Sus datos se han perdido: ahora nos lo enviarán a nosotros
+            return False
+        names = self.store.index.names(hash) or [hash]
+        communicator = self.proxy.ice_getCommunicator()
+        replica_set = [self.proxy] + [URFS.FileManagerPrx.uncheckedCast(communicator.stringToProxy(proxy))
+                                      for proxy in self.store.index.replica_peers(hash).values()]
+        reader = self.store.open(location)
+        try:
+            self.send(reader, names[0], hash, peer, replica_set, throttle)
+        finally:
+            reader.close()
+        for name in names[1:]:
+            try:
+                peer.linkFile(name, hash)
+            except URFS.FileNameInUseError:
+                logging.warning(f"El alias {name} ya se usa en {peer.ice_getIdentity().name} para otro contenido")
+        logging.info(f"Anti-entropía: {names[0]} {hash} enviado a {peer.ice_getIdentity().name}")
+        file_updates = URFS.FileUpdatesPrx.uncheckedCast(self.filemanager.publisher)
+        file_updates.new(URFS.FileData(URFS.FileInfo(names[0], hash), peer, [peer]))
+        return True
+
+    def send(self, reader, name, hash, peer, replica_set, throttle):
+        """
+        Envía los datos de un objeto abierto a otro FileManager: con `putReplica` si es pequeño y el otro lo
+        acepta, y si no por bloques con una sesión de réplica.
+        """
+        if reader.size <= self.filemanager.small_object_threshold:
+            data = reader.pread(reader.size, 0)
+            throttle.consume(len(data))
+            try:
+                peer.putReplica(name, data, [], replica_set)
+                return
+            except URFS.ObjectTooLargeError:
+                pass  # El otro FileManager tiene un umbral menor
+
+        uploader = peer.createReplicaUploader(name, [], replica_set)
+        try:
+            chunk_size = min(COPY_BLOCK_SIZE, uploader.getTransferParams().maxChunkSize)
+            for offset in range(0, reader.size, chunk_size):
+                data = reader.pread(chunk_size, offset)
+                throttle.consume(len(data))
+                uploader.sendAt(offset, data)
+            uploader.commitReplica(hash)
+        finally:
+            uploader.destroy()
 
 
 class FileManagerI(URFS.FileManager):
@@ -140,6 +950,28 @@ class FileManagerI(URFS.FileManager):
         Este objeto es crucial para gestionar la comunicación entre el publicador y el suscriptor.
         """
         self.publisher=None
+        properties = broker.getProperties()
+        self.transfer_params = URFS.TransferParams(get_preferred_chunk_size(properties), get_max_chunk_size(properties))
+        logging.info(f"Tamaños de bloque anunciados --> {self.transfer_params}")
+        self.small_object_threshold = get_small_object_threshold(properties)
+        chunker = None
+        if properties.getPropertyWithDefault('URFS.ChunkingMode', DEFAULT_CHUNKING_MODE) == 'cdc':
+            chunker = Chunker(properties.getPropertyAsIntWithDefault('URFS.ChunkAverageSize', DEFAULT_AVERAGE_CHUNK_SIZE))
+            logging.info(f"Ficheros divididos en bloques por contenido de {chunker.average_size} bytes de media")
+        self.store = ObjectStore(STORAGE_PATH, self.small_object_threshold, chunker)  # Almacenamiento por contenido; los objetos pequeños van en segmentos
+        self.compactor = Compactor(self.store,
+            properties.getPropertyAsIntWithDefault('URFS.CompactionInterval', DEFAULT_COMPACTION_INTERVAL),
+            properties.getPropertyAsIntWithDefault('URFS.CompactionLiveRatio', DEFAULT_COMPACTION_LIVE_RATIO) / 100,
+            properties.getPropertyAsIntWithDefault('URFS.CompactionBandwidth', DEFAULT_COMPACTION_BANDWIDTH),
+            properties.getPropertyAsIntWithDefault('URFS.CompactionMinReclaim', DEFAULT_COMPACTION_MIN_RECLAIM))
+        self.compactor.start()  # Recupera en segundo plano el espacio de los objetos eliminados
+        self.uploads = UploadSessions(properties.getPropertyAsIntWithDefault('URFS.UploadSessionTimeout',
+                                                                             DEFAULT_UPLOAD_SESSION_TIMEOUT))
+        self.uploads.start()  # Expira las subidas abandonadas
+        self.load = LoadCounter()  # Transferencias activas, para que los Frontend repartan las descargas
+        self.anti_entropy = None  # Se arranca con start_anti_entropy, cuando ya se conoce el proxy propio
+        self.frontend = URFS.FrontendPrx.uncheckedCast(broker.stringToProxy(
+            properties.getPropertyWithDefault('URFS.Frontend', 'frontend')))  # Índice global de ficheros
         self.topic_mgr = get_topic_manager(broker) # Obtenemos el gestor de temas a partir del intermediario (broker).
 
         if not self.topic_mgr: # Comprobamos si el gestor de temas es válido. Si no es válido, registramos un error y lanzamos una excepción.
@@ -154,12 +986,14 @@ class FileManagerI(URFS.FileManager):
 
         self.publisher = topic.getPublisher() # Obtenemos el publicador del tema.
 
-    def createUploader(self, filename, current=None):
+    def createUploader(self, filename, chain, current=None):
         """
         Este método crea un objeto de subida (uploader) y devuelve su proxy correspondiente.
         
         :param filename: El parámetro de nombre de archivo es una cadena que representa el nombre del
         archivo que se cargará
+        :param chain: FileManager en los que se replica la subida, en orden. Cada bloque se reenvía al primero
+        en cuanto se escribe y este lo reenvía al siguiente.
         :param current: Es un parámetro opcional que representa el contexto de solicitud actual.
         Se utiliza en aplicaciones Ice para acceder a información sobre la solicitud actual, como la 
         identidad del cliente o la conexión actual. En este código, se utiliza para crear un objeto proxy para el usuario 
@@ -167,53 +1001,353 @@ class FileManagerI(URFS.FileManager):
         
         :return: Devuelve un objeto de tipo `URFS.UploaderPrx`. Este objeto es el proxy del objeto de subida (uploader) y se utiliza para interactuar con él.
         """
-        servant = UploaderI(filename, self.publisher, current.adapter.createProxy(current.id))
-        proxy = current.adapter.addWithUUID(servant)
+        replica_set = [URFS.FileManagerPrx.uncheckedCast(current.adapter.createProxy(current.id))] + chain
+        return self.new_uploader(filename, chain, False, current, replica_set if chain else [])
+
+    def createReplicaUploader(self, filename, chain, replicaSet, current=None):
+        """
+        Crea la sesión de subida de una réplica. Recibe los bloques del FileManager anterior de la cadena con
+        `sendAt` y se confirma con `commitReplica`.
+        
+        :param filename: Nombre del archivo.
+        :param chain: Resto de FileManager de la cadena, después de este.
+        :param replicaSet: Todos los FileManager que deben guardar el contenido, que se registran para la
+        anti-entropía. Vacío para los fragmentos de código de borrado y de franjas, que no tienen réplicas.
+        :return: Proxy `URFS.UploaderPrx` de la réplica.
+        """
+        return self.new_uploader(filename, chain, True, current, replicaSet)
+
+    def new_uploader(self, filename, chain, replica, current, replica_set):
+        """
+        Crea un UploaderI y, si hay cadena de réplicas, la sesión de la siguiente réplica. Un FileManager de la
+        cadena que no responde se salta.
+        
+        :return: Proxy `URFS.UploaderPrx` de la sesión.
+        """
+        downstream = None
+        for i, peer in enumerate(chain):
+            try:
+                downstream = peer.createReplicaUploader(filename, chain[i + 1:], replica_set)
+                break
+            except Ice.Exception as e:
+                logging.warning(f"No se ha podido crear la réplica en {peer.ice_getIdentity().name}: {e}")
+
+        identity = Ice.Identity(str(uuid.uuid4()), current.id.name)  # La categoría identifica a este FileManager
+        session_id = current.adapter.getCommunicator().identityToString(identity)
+        servant = UploaderI(filename, self.publisher, current.adapter.createProxy(current.id), self.transfer_params, session_id, self.store, self.link_existing,
+                            downstream, replica, self.load, replica_peers(replica_set, current.id.name))
+        proxy = current.adapter.add(servant, identity)
+        self.uploads.add(identity, servant, current.adapter)
+        logging.info(f"Sesión de {'réplica' if replica else 'subida'} creada --> {session_id}")
         return URFS.UploaderPrx.checkedCast(proxy)
+
+    def link_existing(self, name, hash, proxy):
+        """
+        Si un contenido ya está guardado, en este FileManager o en cualquier otro según el índice global de los
+        Frontend, registra `name` como alias suyo. Se pregunta primero al Frontend, que registra el alias en
+        todas las réplicas del contenido; si no lo conoce todavía o no responde, solo cuenta la comprobación
+        local del almacenamiento.
+        
+        :param name: Nombre con el que se subió el archivo.
+        :param hash: Hash MD5 del contenido.
+        :param proxy: Proxy de este FileManager, que se publica junto con el alias.
+        :return: Objeto `URFS.FileInfo` del alias, o None si el contenido no está en el sistema.
+        """
+        try:
+            if self.frontend.hasFile(hash):
+                return self.frontend.linkFile(name, hash)
+        except URFS.FileNotFoundError:
+            pass  # Se ha eliminado mientras tanto: se guarda como contenido nuevo
+        except URFS.FileNameInUseError:
+            raise
+        except Ice.Exception as e:
+            logging.warning(f"No se ha podido consultar el índice global ({e}), solo se comprueba el almacenamiento local")
+        if self.store.lookup(hash):
+            return self.link(name, hash, proxy)
+        return None
+
+    def link(self, name, hash, proxy):
+        """
+        Añade un alias a un contenido guardado en este FileManager y lo publica en el canal de eventos.
+        
+        :param name: Nombre que se añade.
+        :param hash: Hash MD5 del contenido.
+        :param proxy: Proxy de este FileManager, que se publica junto con el alias.
+        :return: Objeto `URFS.FileInfo` del alias.
+        """
+        try:
+            size = self.store.link(hash, name)
+        except FileNotFoundError:
+            raise URFS.FileNotFoundError()
+        if size is None:
+            raise URFS.FileNameInUseError()
+
+        self.store.record_upload(size, duplicate=True)
+        logging.info(f"Alias registrado. Nombre: {name} Hash: {hash}")
+        file_updates = URFS.FileUpdatesPrx.uncheckedCast(self.publisher)
+        filemanager = URFS.FileManagerPrx.uncheckedCast(proxy)
+        file_updates.new(URFS.FileData(URFS.FileInfo(name, hash), filemanager, [filemanager]))
+        return URFS.FileInfo(name, hash)
+
+    def putSmall(self, name, data, chain, current=None):
+        """
+        Guarda un objeto pequeño recibido entero en una sola llamada, sin crear un Uploader. Si el contenido ya
+        existe en el sistema, solo se registra el nombre como alias.
+        
+        :param name: Nombre del archivo.
+        :param data: Contenido completo del archivo, de como mucho `URFS.SmallObjectThreshold` bytes.
+        :param chain: FileManager en los que se replica el objeto, en orden.
+        :return: Objeto `URFS.FileInfo` con el nombre y el hash.
+        """
+        if len(data) > self.small_object_threshold:
+            raise URFS.ObjectTooLargeError(self.small_object_threshold)
+
+        name = os.path.basename(name)
+        hash = hashlib.md5(data).hexdigest()
+        proxy = current.adapter.createProxy(current.id)
+        file_info = self.link_existing(name, hash, proxy)
+        if file_info:
+            return file_info
+
+        if not self.store.put(hash, data, name):  # Otra subida del mismo contenido se ha adelantado
+            return self.link_existing(name, hash, proxy)
+        self.store.record_upload(len(data), duplicate=False)
+        replica_set = [URFS.FileManagerPrx.uncheckedCast(proxy)] + chain if chain else []
+        self.store.index.add_replicas(hash, replica_peers(replica_set, current.id.name))
+        holders = [URFS.FileManagerPrx.uncheckedCast(proxy)] + self.replicate_small(name, data, chain, replica_set)
+
+        logging.info(f"Objeto pequeño guardado. Nombre: {name} Hash: {hash}")
+        file_updates = URFS.FileUpdatesPrx.uncheckedCast(self.publisher)
+        file_updates.new(URFS.FileData(URFS.FileInfo(name, hash), URFS.FileManagerPrx.uncheckedCast(proxy), holders))
+        return URFS.FileInfo(name, hash)
+
+    def putReplica(self, name, data, chain, replicaSet, current=None):
+        """
+        Guarda la réplica de un objeto pequeño y la reenvía al resto de la cadena. No se publica ningún evento:
+        lo hace el FileManager que recibió el objeto, con la lista completa de réplicas.
+        
+        :param name: Nombre del archivo.
+        :param data: Contenido completo del archivo.
+        :param chain: Resto de FileManager de la cadena, después de este.
+        :param replicaSet: Todos los FileManager que deben guardar el objeto, que se registran para la anti-entropía.
+        :return: Lista de proxies de los FileManager de la cadena que guardan el objeto, desde este.
+        """
+        if len(data) > self.small_object_threshold:
+            raise URFS.ObjectTooLargeError(self.small_object_threshold)
+
+        hash = hashlib.md5(data).hexdigest()
+        if not self.store.put(hash, data, name):  # Ya estaba guardado: solo se añade el nombre
+            self.store.link(hash, name)
+        self.store.index.add_replicas(hash, replica_peers(replicaSet, current.id.name))
+        logging.info(f"Réplica guardada. Nombre: {name} Hash: {hash}")
+        return [URFS.FileManagerPrx.uncheckedCast(current.adapter.createProxy(current.id))] + self.replicate_small(name, data, chain, replicaSet)
+
+    def replicate_small(self, name, data, chain, replica_set):
+        """
+        Envía un objeto pequeño a la cadena de réplicas. Un FileManager de la cadena que no responde se salta.
+        
+        :return: Lista de proxies de los FileManager de la cadena que lo han guardado.
+        """
+        for i, peer in enumerate(chain):
+            try:
+                return peer.putReplica(name, data, chain[i + 1:], replica_set)
+            except Ice.Exception as e:
+                logging.warning(f"No se ha podido replicar {name} en {peer.ice_getIdentity().name}: {e}")
+        return []
+
+    def getSmall(self, hash, current=None):
+        """
+        Devuelve entero, en una sola llamada, un objeto de como mucho `URFS.SmallObjectThreshold` bytes.
+        
+        :param hash: Hash MD5 del contenido.
+        :return: Contenido del archivo.
+        """
+        location = self.store.lookup(hash)
+        if not location:
+            raise URFS.FileNotFoundError()
+        if location.size > self.small_object_threshold:
+            raise URFS.ObjectTooLargeError(self.small_object_threshold)
+
+        return self.store.read(location)
+
+    def linkFile(self, name, hash, current=None):
+        """
+        Registra un nombre nuevo para un contenido guardado en este FileManager. Solo modifica metadatos, sin
+        transferir ni copiar datos.
+        
+        :param name: Nombre (alias) que se añade.
+        :param hash: Hash MD5 del contenido.
+        :return: Objeto `URFS.FileInfo` con el nombre y el hash.
+        """
+        return self.link(os.path.basename(name), hash, current.adapter.createProxy(current.id))
+
+    def getSignatures(self, hash, current=None):
+        """
+        Calcula las firmas por bloques (suma débil rodante y MD5) de un archivo, para que un cliente pueda subir
+        una versión modificada enviando solo lo que cambia (`Frontend.uploadDelta`).
+        
+        :param hash: Hash del archivo base.
+        :return: Objeto `URFS.Signatures` con el tamaño del archivo, el tamaño de bloque y una firma por bloque.
+        """
+        reader = self.open_object(hash)
+        try:
+            block_size = delta_block_size(reader.size)
+            blocks = [URFS.BlockSignature(weak, strong) for weak, strong in signatures(reader, block_size)]
+            logging.info(f"Firmas calculadas. Hash: {hash} Bloques: {len(blocks)} de {block_size} bytes")
+            return URFS.Signatures(reader.size, block_size, blocks)
+        finally:
+            reader.close()
+
+    def getDedupStats(self, current=None):
+        """
+        Devuelve las estadísticas de deduplicación de este FileManager y los bytes recuperados por el compactador.
+        
+        :return: Objeto `URFS.DedupStats`.
+        """
+        stats = self.store.stats()
+        return URFS.DedupStats(stats['uploads'], stats['duplicates'], stats['bytes_stored'], stats['bytes_saved'],
+                               stats['bytes_reclaimed'])
+
+    def getLoad(self, current=None):
+        """
+        Devuelve el número de transferencias (Uploader y Downloader) activas en este FileManager.
+        """
+        return self.load.value
+
+    def getMerkleNodes(self, peer, prefixes, current=None):
+        """
+        Devuelve nodos del árbol de Merkle de los objetos que este FileManager comparte con `peer`, para que
+        este compare los suyos y baje solo por las ramas que difieren.
+        
+        :param peer: Nombre de la identidad del FileManager que pregunta.
+        :param prefixes: Prefijos hexadecimales de hash de los nodos ('' es la raíz).
+        :return: Lista de `URFS.MerkleNode`, una por prefijo y en el mismo orden.
+        """
+        return [URFS.MerkleNode(digest, count) for digest, count in self.store.index.merkle_nodes(peer, prefixes)]
+
+    def getReplicaEntries(self, peer, prefixes, current=None):
+        """
+        Devuelve las entradas de las hojas del árbol de Merkle compartido con `peer` que no coinciden.
+        
+        :param peer: Nombre de la identidad del FileManager que pregunta.
+        :param prefixes: Prefijos hexadecimales de hash de las hojas.
+        :return: Lista de `URFS.ReplicaEntry` con el hash, si está borrado y la hora del último cambio.
+        """
+        return [URFS.ReplicaEntry(hash, bool(deleted), updated) for prefix in prefixes
+                for hash, deleted, updated in self.store.index.replica_rows(peer, prefix)]
+
+    def start_anti_entropy(self, proxy):
+        """
+        Arranca la anti-entropía con los demás FileManager y el hilo de las reparaciones en lectura. Necesita el
+        proxy de este FileManager, que se anuncia a los otros al enviarles objetos, así que se llama después de
+        añadirlo al adaptador.
+        
+        :param proxy: Proxy `URFS.FileManagerPrx` de este FileManager.
+        """
+        properties = proxy.ice_getCommunicator().getProperties()
+        self.anti_entropy = AntiEntropy(self, proxy,
+            properties.getPropertyAsIntWithDefault('URFS.AntiEntropyInterval', DEFAULT_ANTI_ENTROPY_INTERVAL),
+            properties.getPropertyAsIntWithDefault('URFS.AntiEntropyBandwidth', DEFAULT_ANTI_ENTROPY_BANDWIDTH))
+        self.anti_entropy.start()
+
+    def repairReplica(self, hash, target, current=None):
+        """
+        Pide a este FileManager que envíe en segundo plano una copia de un objeto a otro FileManager que debería
+        tenerlo y no lo tiene (reparación en lectura). Vuelve en cuanto la reparación queda en cola.
+        
+        :param hash: Hash MD5 del contenido.
+        :param target: Proxy `URFS.FileManagerPrx` del FileManager al que le falta.
+        """
+        if not self.anti_entropy:
+            logging.warning(f"Reparación de {hash} descartada: la anti-entropía no está arrancada")
+            return
+        if self.anti_entropy.schedule(hash, target):
+            logging.info(f"Reparación en lectura en cola --> {hash} a {target.ice_getIdentity().name}")
+
+    def resumeUploader(self, sessionId, current=None):
+        """
+        Recupera el Uploader de una sesión de subida interrumpida, conservando los datos escritos y el estado
+        parcial del hash, para que el cliente continúe desde `getCommittedOffset()`.
+        
+        :param sessionId: Identificador devuelto por `Uploader.getSessionId()`.
+        :return: Proxy `URFS.UploaderPrx` de la sesión.
+        """
+        try:
+            identity = current.adapter.getCommunicator().stringToIdentity(sessionId)
+        except Ice.IdentityParseException:
+            raise URFS.SessionNotFoundError()
+
+        servant = current.adapter.find(identity)
+        if not isinstance(servant, UploaderI):
+            raise URFS.SessionNotFoundError()
+
+        servant.discard_pending()
+        logging.info(f"Sesión de subida reanudada --> {sessionId}")
+        return URFS.UploaderPrx.uncheckedCast(current.adapter.createProxy(identity))
                 
     def createDownloader(self, hash, current=None):
         """
-        Busca un archivo en un directorio según su hash y devuelve un objeto proxy para descargar el archivo.
+        Busca un archivo en el índice según su hash y devuelve un objeto proxy para descargar el archivo.
         
         :param hash: Es una cadena que representa el valor hash de un archivo. Se
-        utiliza para buscar un archivo en el directorio `STORAGE_PATH`
+        utiliza para buscar el archivo en el índice del directorio `STORAGE_PATH`
         :param current: Es un parámetro opcional que representa el contexto de solicitud actual.
         Se utiliza en aplicaciones Ice para acceder a información sobre la solicitud actual, como la 
         identidad del cliente o la conexión actual. En este código, se utiliza para agregar 
         el servidor `DownloaderI` al adaptador
         :return: un objeto proxy de tipo `URFS.DownloaderPrx`.
         """
-        for filename in os.listdir(STORAGE_PATH):   #Busca fichero en directorio STORAGE_PATH por el hash
-            with open(os.path.join(STORAGE_PATH, filename), 'rb') as f:
-                file_data = f.read()
-                file_hash = hashlib.md5(file_data).hexdigest()
-                if file_hash == hash:                    
-                    self.file = os.path.join(STORAGE_PATH, filename)
-                    break
-        else:
+        servant = DownloaderI(self.open_object(hash), self.transfer_params, self.load)
+        proxy = current.adapter.addWithUUID(servant)
+        return URFS.DownloaderPrx.checkedCast(proxy)
+
+    def open_object(self, hash):
+        """
+        Busca un archivo en el índice por su hash y lo abre para leerlo.
+        
+        :param hash: Hash del archivo.
+        :return: Lector devuelto por `ObjectStore.open`.
+        :raises URFS.FileNotFoundError: Si el archivo (o alguno de sus bloques) no está en el almacenamiento.
+        """
+        location = self.store.lookup(hash)  #Busca fichero en el índice por el hash
+        if not location:
             raise URFS.FileNotFoundError()
+        try:
+            return self.store.open(location)
+        except FileNotFoundError:
+            logging.error(f"Faltan datos del archivo en el almacenamiento --> {hash}")
+            raise URFS.FileNotFoundError()
+
+    def openDownloader(self, hash, current=None):
+        """
+        Igual que `createDownloader`, pero devuelve también el tamaño del archivo, para que el cliente pueda
+        reservar la salida y planificar sus lecturas sin llamadas adicionales.
         
-        servant = DownloaderI(os.path.join(STORAGE_PATH, filename))
+        :param hash: Hash del archivo que se quiere descargar.
+        :return: Objeto `URFS.DownloadTicket` con el proxy del Downloader y el tamaño del archivo.
+        """
+        servant = DownloaderI(self.open_object(hash), self.transfer_params, self.load)
         proxy = current.adapter.addWithUUID(servant)
-        return URFS.DownloaderPrx.checkedCast(proxy)
+        return URFS.DownloadTicket(URFS.DownloaderPrx.uncheckedCast(proxy), servant.size)
 
-    def removeFile(self, hash, current=None):
+    def removeFile(self, hash, name, current=None):
         """
-        Elimina un archivo del directorio STORAGE_PATH según su hash.
+        Elimina un archivo del directorio STORAGE_PATH según su hash, localizándolo mediante el índice. Si el
+        contenido tiene varios nombres solo se elimina el indicado, que el Frontend elige para que todas las
+        réplicas eliminen el mismo aunque sus alias difieran. Al eliminar el último nombre solo se escribe una
+        lápida (o se mueve el fichero a la papelera); el compactador recupera el espacio después.
         
         param hash: Es una cadena que representa el valor hash de un archivo.
-        Si no encuentra el archivo, lanza una excepción.
+        param name: Nombre que se elimina, o cadena vacía para el más reciente (los fragmentos de código de
+        borrado, que tienen uno solo).
+        Si no encuentra el archivo con ese nombre, lanza una excepción.
         
         """
-        for filename in os.listdir(STORAGE_PATH):
-            with open(os.path.join(STORAGE_PATH, filename), 'rb') as f:
-                file_data = f.read()
-                file_hash = hashlib.md5(file_data).hexdigest()
-                if file_hash == hash:
-                    os.remove(os.path.join(STORAGE_PATH, filename))
-                    logging.info(f"File removed: {filename} {hash}")
-                    name = filename
-                    break
+        name = self.store.remove(hash, name or None)
+        if name is None:
+            raise URFS.FileNotFoundError()
+
+        logging.info(f"File removed: {name} {hash}")
         
         file_updates = URFS.FileUpdatesPrx.uncheckedCast(self.publisher)
         if not file_updates:
@@ -221,7 +1355,24 @@ class FileManagerI(URFS.FileManager):
         else:
             logging.info(f"Enviando info de borrado de archivo  a canal de eventos file_updates")
 
-        file_updates.removed(URFS.FileData(URFS.FileInfo(name, hash), URFS.FileManagerPrx.uncheckedCast(current.adapter.createProxy(current.id))))
+        filemanager = URFS.FileManagerPrx.uncheckedCast(current.adapter.createProxy(current.id))
+        file_updates.removed(URFS.FileData(URFS.FileInfo(name, hash), filemanager, [filemanager]))
+
+    def forget(self, hash, proxy):
+        """
+        Elimina todos los nombres de un objeto que otra réplica ha borrado mientras este FileManager no estaba
+        disponible, y publica cada borrado como lo haría `removeFile`.
+        
+        :param hash: Hash MD5 del contenido.
+        :param proxy: Proxy de este FileManager, que se publica junto con el borrado.
+        """
+        file_updates = URFS.FileUpdatesPrx.uncheckedCast(self.publisher)
+        while True:
+            name = self.store.remove(hash)
+            if name is None:
+                return
+            logging.info(f"File removed: {name} {hash}")
+            file_updates.removed(URFS.FileData(URFS.FileInfo(name, hash), proxy, [proxy]))
 
 class FileManager(Ice.Application):
     def run(self, argv):
@@ -250,6 +1401,7 @@ class FileManager(Ice.Application):
         adapter = broker.createObjectAdapter("FileManagerAdapter")
         _id = properties.getProperty("Identity")
         proxy = adapter.add(servant, broker.stringToIdentity(_id))
+        servant.start_anti_entropy(URFS.FileManagerPrx.uncheckedCast(proxy))
 
         # adapter = broker.createObjectAdapter("FileManagerAdapter1")
         # proxy = adapter.add(servant, broker.stringToIdentity("FileManager1"))
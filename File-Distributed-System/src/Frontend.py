@@ -5,13 +5,22 @@ import Ice
 import IceStorm
 from util import get_topic_manager
 import os
+import hashlib
 import logging
+import threading
 import colorlog
 
 Ice.loadSlice('urfs.ice')
 import URFS
 import IceGrid
 
+DEFAULT_REPLICATION_FACTOR = 1  # Copias de cada objeto, en FileManager distintos
+DEFAULT_ERASURE_DATA_SHARDS = 2  # Fragmentos de datos (k) de los objetos con código de borrado
+DEFAULT_ERASURE_PARITY_SHARDS = 1  # Fragmentos de paridad (m)
+DEFAULT_ERASURE_CELL_SIZE = 64 * 1024  # Bytes de cada celda: una franja ocupa k celdas de datos y m de paridad
+DEFAULT_STRIPE_WIDTH = 0  # FileManager entre los que se reparte un fichero en franjas; 0 = todos los disponibles
+DEFAULT_STRIPE_SIZE = 1024 * 1024  # Bytes de cada bloque de un fichero repartido en franjas
+
 class FrontendUpdatesI(URFS.FrontendUpdates):
     
     def __init__(self, topic_mgr, oldFrontend, oldFrontend_proxy, current=None):
@@ -60,9 +69,12 @@ class FrontendUpdatesI(URFS.FrontendUpdates):
         #ACTUALIZAR REGISTRO DE FICHEROS DEL FRONTEND MEDIANTE EL REGISTRO DE FICHEROS DE LOS FRONTEND ANTIGUOS A TRAVES DEL CANAL DE EVENTOS FILEUPDATES
         file_updates = URFS.FileUpdatesPrx.uncheckedCast(self.publisher) #
 
-        for file_data in self.oldFrontend.files:
+        for file_data in self.oldFrontend.files.values():
             logging.info(f"actualizando registro de ficheros del nuevo frontend --> {file_data}")
             file_updates.new(file_data)
+        for file_info, layout in self.oldFrontend.files.layout_values():
+            logging.info(f"actualizando registro de ficheros del nuevo frontend --> {file_info}")
+            file_updates.newErasure(file_info, layout)
         
 
 class FileUpdatesI(URFS.FileUpdates):
@@ -101,16 +113,231 @@ class FileUpdatesI(URFS.FileUpdates):
         logging.info(f"Archivo eliminado con hash {file_data.fileInfo.hash}")
         self.frontend.removeFrom_registro(file_data)
 
+    def newErasure(self, file_info, layout, current=None):
+        """
+        Registra un archivo guardado con código de borrado y su distribución en fragmentos.
+        
+        :param file_info: Objeto `URFS.FileInfo` con el nombre y el hash del archivo.
+        :param layout: Objeto `URFS.ErasureLayout` con los fragmentos y los FileManager que los guardan.
+        :param current: Parámetro opcional que representa el objeto actual. Si se pasa como parámetro
+        Zeroc Ice puede tener comportamientos inesperados.
+        """
+        logging.info(f"Nuevo archivo con código de borrado --> {file_info}")
+        self.frontend.addErasureTo_registro(file_info, layout)
+
+def filemanager_key(filemanager):
+    """
+    Devuelve la clave con la que el registro identifica a un FileManager: el nombre de su identidad
+    (por ejemplo "FileManager1"), que es la misma tanto en los proxies de IceGrid como en los de los eventos.
+    
+    :param filemanager: Proxy del FileManager.
+    """
+    return filemanager.ice_getIdentity().name
+
+
+class FileRegistry:
+    def __init__(self):
+        """
+        Registro de ficheros del Frontend, indexado por hash y por nombre, con el número de ficheros de cada
+        FileManager mantenido de forma incremental. Todas las consultas y actualizaciones son O(1).
+
+        Un mismo contenido puede estar registrado con varios nombres (alias): el contenido se cuenta una sola
+        vez y desaparece del registro cuando se elimina su último nombre.
+
+        Con replicación un contenido está en varios FileManager: todos se registran como poseedores y el
+        fichero cuenta en la carga de cada uno. Los contenidos con código de borrado no tienen poseedores sino
+        una distribución en fragmentos (`URFS.ErasureLayout`), y cuentan en la carga de cada FileManager que
+        guarda uno de sus fragmentos.
+        """
+        self.by_hash = {}  # hash -> FileData con el FileManager que recibió el contenido
+        self.layouts = {}  # hash -> ErasureLayout de los contenidos con código de borrado
+        self.holders = {}  # hash -> {nombre de la identidad: proxy} de los FileManager que lo guardan
+        self.names = {}  # hash -> nombres del contenido, en orden de creación
+        self.by_name = {}  # nombre -> hash
+        self.counts = {}  # nombre de la identidad del FileManager -> número de ficheros
+        self.lock = threading.Lock()
+
+    def add(self, file_data):
+        """
+        Añade un fichero al registro. Si el hash ya estaba, el nombre se añade como alias (los eventos pueden
+        llegar repetidos, así que un nombre ya registrado se ignora). Los poseedores del evento se añaden a los
+        que ya hubiera.
+        
+        :param file_data: Objeto `URFS.FileData` del fichero.
+        :return: True si se ha añadido el fichero o el alias, False si ya estaba.
+        """
+        name, hash = file_data.fileInfo.name, file_data.fileInfo.hash
+        with self.lock:
+            if hash in self.layouts:
+                return self.add_name(name, hash)
+            if hash not in self.by_hash:
+                self.by_hash[hash] = file_data
+                self.holders[hash] = {}
+                self.names[hash] = []
+            holders = self.holders[hash]
+            for filemanager in file_data.replicas or [file_data.fileManager]:
+                key = filemanager_key(filemanager)
+                if key not in holders:
+                    holders[key] = filemanager
+                    self.counts[key] = self.counts.get(key, 0) + 1
+            return self.add_name(name, hash)
+
+    def add_layout(self, file_info, layout):
+        """
+        Añade un fichero con código de borrado al registro, o un alias si el hash ya estaba.
+        
+        :param file_info: Objeto `URFS.FileInfo` del fichero.
+        :param layout: Objeto `URFS.ErasureLayout` con sus fragmentos.
+        :return: True si se ha añadido el fichero o el alias, False si ya estaba.
+        """
+        name, hash = file_info.name, file_info.hash
+        with self.lock:
+            if hash not in self.layouts and hash not in self.by_hash:
+                self.layouts[hash] = layout
+                self.names[hash] = []
+                for shard in layout.shards:
+                    key = filemanager_key(shard.fileManager)
+                    self.counts[key] = self.counts.get(key, 0) + 1
+            return self.add_name(name, hash)
+
+    def add_name(self, name, hash):
+        """
+        Registra un nombre de un hash ya registrado. Debe llamarse con el cerrojo adquirido.
+        """
+        if name in self.by_name:
+            return False
+        self.names[hash].append(name)
+        self.by_name[name] = hash
+        return True
+
+    def remove(self, hash, name=None):
+        """
+        Elimina un nombre de un fichero, o todos si no se indica ninguno. El contenido sale del registro
+        cuando no le queda ningún nombre.
+        
+        :param hash: Hash del fichero.
+        :param name: Nombre (alias) que se elimina.
+        :return: True si se ha eliminado algo, False si no estaba.
+        """
+        with self.lock:
+            names = self.names.get(hash)
+            if names is None:
+                return False
+            if name is None:
+                removed = list(names)
+            elif name in names:
+                removed = [name]
+            else:
+                return False
+            for alias in removed:
+                names.remove(alias)
+                del self.by_name[alias]
+            if not names:
+                del self.names[hash]
+                if hash in self.layouts:
+                    keys = [filemanager_key(shard.fileManager) for shard in self.layouts.pop(hash).shards]
+                else:
+                    del self.by_hash[hash]
+                    keys = self.holders.pop(hash)
+                for key in keys:
+                    self.counts[key] -= 1
+                    if not self.counts[key]:
+                        del self.counts[key]
+            return True
+
+    def get(self, hash):
+        """
+        Devuelve el `URFS.FileData` de un hash, o None si no está registrado.
+        """
+        return self.by_hash.get(hash)
+
+    def layout_of(self, hash):
+        """
+        Devuelve el `URFS.ErasureLayout` de un hash guardado con código de borrado, o None si no lo está.
+        """
+        return self.layouts.get(hash)
+
+    def names_of(self, hash):
+        """
+        Devuelve los nombres registrados de un hash, en orden de creación.
+        """
+        with self.lock:
+            return list(self.names.get(hash, []))
+
+    def holders_of(self, hash):
+        """
+        Devuelve los proxies de los FileManager que guardan un hash, empezando por el que recibió la subida.
+        """
+        with self.lock:
+            return list(self.holders.get(hash, {}).values())
+
+    def has_name(self, name):
+        """
+        Indica si ya hay un fichero registrado con ese nombre.
+        """
+        return name in self.by_name
+
+    def hash_of(self, name):
+        """
+        Devuelve el hash del fichero registrado con ese nombre, o None si no hay ninguno.
+        """
+        return self.by_name.get(name)
+
+    def count(self, filemanager):
+        """
+        Devuelve el número de ficheros registrados en un FileManager.
+        
+        :param filemanager: Proxy del FileManager.
+        """
+        return self.counts.get(filemanager_key(filemanager), 0)
+
+    def values(self):
+        """
+        Devuelve una copia de los `URFS.FileData` registrados, uno por nombre, que se puede recorrer mientras
+        llegan eventos.
+        """
+        with self.lock:
+            return [URFS.FileData(URFS.FileInfo(name, hash), file_data.fileManager, list(self.holders[hash].values()))
+                    for hash, file_data in self.by_hash.items() for name in self.names[hash]]
+
+    def layout_values(self):
+        """
+        Devuelve una copia de los ficheros con código de borrado registrados, como tuplas (`URFS.FileInfo`,
+        `URFS.ErasureLayout`), una por nombre.
+        """
+        with self.lock:
+            return [(URFS.FileInfo(name, hash), layout)
+                    for hash, layout in self.layouts.items() for name in self.names[hash]]
+
+    def __contains__(self, hash):
+        return hash in self.by_hash or hash in self.layouts
+
+    def __len__(self):
+        return len(self.by_hash) + len(self.layouts)
+
+
 class FrontendI(URFS.Frontend):
     def __init__(self, broker):
         """
-        Constructor que inicializa un objeto con un broker y una lista vacía de archivos. Esta lista sera el registro del Frontend
+        Constructor que inicializa un objeto con un broker y un registro de archivos vacío. Este sera el registro del Frontend
         
         :param broker: Variable que representa un objeto de broker. Se utiliza para establecer una conexión o 
         comunicación con un sistema de intermediario de mensajería.
         """
         self.broker = broker
-        self.files = []
+        self.files = FileRegistry()
+        self.file_updates = None  # Publicador de FileUpdates, para los eventos de los archivos con código de borrado
+        properties = broker.getProperties()
+        self.replication_factor = properties.getPropertyAsIntWithDefault(
+            'URFS.ReplicationFactor', DEFAULT_REPLICATION_FACTOR)
+        self.erasure_data_shards = properties.getPropertyAsIntWithDefault(
+            'URFS.ErasureDataShards', DEFAULT_ERASURE_DATA_SHARDS)
+        self.erasure_parity_shards = properties.getPropertyAsIntWithDefault(
+            'URFS.ErasureParityShards', DEFAULT_ERASURE_PARITY_SHARDS)
+        self.erasure_cell_size = properties.getPropertyAsIntWithDefault(
+            'URFS.ErasureCellSize', DEFAULT_ERASURE_CELL_SIZE)
+        self.stripe_width = properties.getPropertyAsIntWithDefault('URFS.StripeWidth', DEFAULT_STRIPE_WIDTH)
+        self.stripe_size = properties.getPropertyAsIntWithDefault('URFS.StripeSize', DEFAULT_STRIPE_SIZE)
 
 
     def getFileList(self, current=None):
@@ -121,10 +348,8 @@ class FrontendI(URFS.Frontend):
         Zeroc Ice puede tener comportamientos inesperados.
         """
         logging.info("Petición de listar ficheros")
-        file_info_list = []
-        for file_info in self.files:
-            file_info_list.append(file_info.fileInfo)
-        return file_info_list
+        return [file_data.fileInfo for file_data in self.files.values()] + \
+               [file_info for file_info, _ in self.files.layout_values()]
     
     def uploadFile(self, name, current=None):
         """
@@ -136,14 +361,103 @@ class FrontendI(URFS.Frontend):
         :return: El objeto `uploader` generado a partir de `filemanager_for_upload`con el nombre del archivo que se 
         quiere subir.
         """
+        if self.files.has_name(os.path.basename(name)):
+            raise URFS.FileNameInUseError()
         filemanager_for_upload = self.get_filemanager_for_upload(self.broker)
-        for file_data in self.files:
-            if file_data.fileInfo.name == os.path.basename(name):
-                raise URFS.FileNameInUseError()
         logging.info(f"Petición de subir fichero con nombre: {name}")
-        uploader = filemanager_for_upload.createUploader(name)
+        uploader = filemanager_for_upload.createUploader(name, self.get_replica_chain(filemanager_for_upload, self.broker))
         return uploader
+
+    def uploadDelta(self, name, baseHash, current=None):
+        """
+        Crea un cargador para subir una versión modificada de un archivo existente. Se crea en el FileManager que
+        guarda el archivo base, de modo que el cliente puede enviar solo los tramos nuevos (`sendAt`) y pedir que
+        el resto se copie del archivo base (`copyAt`).
+        
+        :param name: El nombre del archivo que se va a cargar.
+        :param baseHash: Hash del archivo del que se parte.
+        :param current: Parámetro opcional que representa el objeto actual. Si se pasa como parámetro
+        Zeroc Ice puede tener comportamientos inesperados.
+        :return: El objeto `uploader` creado en el FileManager del archivo base.
+        """
+        if self.files.has_name(os.path.basename(name)):
+            raise URFS.FileNameInUseError()
+        filemanager = self.get_filemanager_for_download_remove(baseHash, self.broker)
+        if not filemanager:
+            raise URFS.FileNotFoundError()
+        logging.info(f"Petición de subir fichero con nombre: {name} a partir de: {baseHash}")
+        return filemanager.createUploader(name, self.get_replica_chain(filemanager, self.broker))
+
+    def getSignatures(self, hash, current=None):
+        """
+        Devuelve las firmas por bloques de un archivo, calculadas por el FileManager que lo guarda.
+        
+        :param hash: Hash del archivo.
+        :param current: Parámetro opcional que representa el objeto actual. Si se pasa como parámetro
+        Zeroc Ice puede tener comportamientos inesperados.
+        :return: Objeto `URFS.Signatures`.
+        """
+        filemanager = self.get_filemanager_for_download_remove(hash, self.broker)
+        if not filemanager:
+            raise URFS.FileNotFoundError()
+        return filemanager.getSignatures(hash)
+
+    def resumeUpload(self, sessionId, current=None):
+        """
+        Reanuda una subida interrumpida. La categoría del identificador de sesión es la identidad del FileManager
+        que atiende la subida, por lo que se le delega la petición directamente.
         
+        :param sessionId: Identificador devuelto por `Uploader.getSessionId()`, de la forma `FileManagerN/uuid`.
+        :param current: Parámetro opcional que representa el objeto actual. Si se pasa como parámetro
+        Zeroc Ice puede tener comportamientos inesperados.
+        :return: El objeto `uploader` de la sesión, listo para continuar desde `getCommittedOffset()`.
+        """
+        logging.info(f"Petición de reanudar subida con sesión: {sessionId}")
+        try:
+            filemanager_name = self.broker.stringToIdentity(sessionId).category
+            filemanager = URFS.FileManagerPrx.checkedCast(self.broker.stringToProxy(filemanager_name))
+        except Ice.Exception:
+            raise URFS.SessionNotFoundError()
+
+        if not filemanager:
+            raise URFS.SessionNotFoundError()
+        return filemanager.resumeUploader(sessionId)
+        
+
+    def hasFile(self, hash, current=None):
+        """
+        Indica si algún FileManager guarda ya un archivo con el hash dado, para que el cliente pueda evitar
+        subir un contenido que ya está en el sistema.
+        
+        :param hash: Hash MD5 del contenido.
+        :param current: Parámetro opcional que representa el objeto actual. Si se pasa como parámetro
+        Zeroc Ice puede tener comportamientos inesperados.
+        :return: True si el archivo está en el registro.
+        """
+        return hash in self.files
+
+    def getDedupStats(self, current=None):
+        """
+        Suma las estadísticas de deduplicación de todos los FileManager disponibles. Los que no responden se
+        omiten.
+        
+        :param current: Parámetro opcional que representa el objeto actual. Si se pasa como parámetro
+        Zeroc Ice puede tener comportamientos inesperados.
+        :return: Objeto `URFS.DedupStats` con los totales del sistema.
+        """
+        total = URFS.DedupStats(0, 0, 0, 0, 0)
+        for filemanager in self.get_filemanagers(self.broker):
+            try:
+                stats = URFS.FileManagerPrx.uncheckedCast(filemanager).getDedupStats()
+            except Ice.Exception as e:
+                logging.warning(f"No se han podido obtener las estadísticas de {filemanager_key(filemanager)}: {e}")
+                continue
+            total.uploads += stats.uploads
+            total.duplicates += stats.duplicates
+            total.bytesStored += stats.bytesStored
+            total.bytesSaved += stats.bytesSaved
+            total.bytesReclaimed += stats.bytesReclaimed
+        return total
 
     def downloadFile(self, hash, current=None):
         """
@@ -157,30 +471,345 @@ class FrontendI(URFS.Frontend):
         """
         
         logging.info(f"Petición de descargar fichero con hash: {hash}")
+        self.check_erasure(hash)
 
     #OBTENER FILEMANAGER QUE TENGA EL FICHERO CON EL HASH
-        filemanager_for_download = self.get_filemanager_for_download_remove(hash, self.broker)
-        if not filemanager_for_download:
+        return self.read_from_holders(hash, lambda filemanager: filemanager.createDownloader(hash))
+
+    def openDownload(self, hash, current=None):
+        """
+        Igual que `downloadFile`, pero devuelve también el tamaño del archivo informado por el FileManager.
+        
+        :param hash: Identificador único para el archivo que debe descargarse.
+        :param current: Parámetro opcional que representa el objeto actual. Si se pasa como parámetro
+        Zeroc Ice puede tener comportamientos inesperados.
+        :return: Objeto `URFS.DownloadTicket` con el `downloader` y el tamaño del archivo.
+        """
+        logging.info(f"Petición de descargar fichero con hash: {hash}")
+        self.check_erasure(hash)
+        return self.read_from_holders(hash, lambda filemanager: filemanager.openDownloader(hash))
+
+    def getHolders(self, hash, current=None):
+        """
+        Devuelve todos los FileManager que guardan un archivo entero, para que el cliente descargue rangos
+        distintos de cada uno a la vez. Como cada poseedor tiene el archivo completo, cualquier rango se puede
+        pedir a cualquiera de ellos.
+        
+        :param hash: Hash del archivo.
+        :param current: Parámetro opcional que representa el objeto actual. Si se pasa como parámetro
+        Zeroc Ice puede tener comportamientos inesperados.
+        :return: Lista de proxies `URFS.FileManagerPrx`, empezando por el que recibió la subida.
+        """
+        logging.info(f"Petición de poseedores del fichero con hash: {hash}")
+        self.check_erasure(hash)
+        holders = self.files.holders_of(hash)
+        if not holders:
+            raise URFS.FileNotFoundError()
+        return [URFS.FileManagerPrx.uncheckedCast(filemanager) for filemanager in holders]
+
+    def linkFile(self, name, hash, current=None):
+        """
+        Registra un nombre nuevo para un contenido que ya está guardado, sin transferir datos. La petición se
+        delega en todos los FileManager que guardan el contenido, para que las réplicas tengan los mismos
+        nombres. Si el nombre ya apunta a ese mismo contenido, no se hace nada.
+        
+        :param name: Nombre (alias) que se quiere registrar.
+        :param hash: Hash del contenido existente.
+        :param current: Parámetro opcional que representa el objeto actual. Si se pasa como parámetro
+        Zeroc Ice puede tener comportamientos inesperados.
+        :return: Objeto `URFS.FileInfo` con el nombre y el hash.
+        """
+        name = os.path.basename(name)
+        logging.info(f"Petición de enlazar {name} con hash: {hash}")
+        if self.files.hash_of(name) == hash:
+            return URFS.FileInfo(name, hash)
+        if self.files.has_name(name):
+            raise URFS.FileNameInUseError()
+
+        layout = self.files.layout_of(hash)
+        if layout:  # Sin FileManager que guarde el archivo entero: el alias solo existe en los Frontend
+            file_info = URFS.FileInfo(name, hash)
+            self.addErasureTo_registro(file_info, layout)
+            self.file_updates.newErasure(file_info, layout)
+            return file_info
+
+        file_info = None
+        for filemanager in self.files.holders_of(hash):
+            try:
+                file_info = URFS.FileManagerPrx.uncheckedCast(filemanager).linkFile(name, hash)
+            except URFS.FileNameInUseError:
+                raise
+            except (URFS.FileNotFoundError, Ice.Exception) as e:
+                logging.warning(f"No se ha podido enlazar {name} en {filemanager_key(filemanager)}: {e}")
+        if not file_info:
+            raise URFS.FileNotFoundError()
+        return file_info
+
+    def putSmall(self, name, data, current=None):
+        """
+        Sube un objeto pequeño en una sola llamada. Si el contenido ya está en el sistema solo se registra el
+        nombre; si no, los datos se envían al FileManager menos cargado.
+        
+        :param name: Nombre del archivo.
+        :param data: Contenido completo del archivo.
+        :param current: Parámetro opcional que representa el objeto actual. Si se pasa como parámetro
+        Zeroc Ice puede tener comportamientos inesperados.
+        :return: Objeto `URFS.FileInfo` con el nombre y el hash.
+        """
+        name = os.path.basename(name)
+        hash = hashlib.md5(data).hexdigest()
+        logging.info(f"Petición de subir objeto pequeño con nombre: {name}")
+        if hash in self.files:
+            return self.linkFile(name, hash)
+        if self.files.has_name(name):
+            raise URFS.FileNameInUseError()
+
+        filemanager = self.get_filemanager_for_upload(self.broker)
+        return filemanager.putSmall(name, data, self.get_replica_chain(filemanager, self.broker))
+
+    def getSmall(self, hash, current=None):
+        """
+        Descarga un objeto pequeño en una sola llamada desde el FileManager que lo guarda.
+        
+        :param hash: Hash del archivo.
+        :param current: Parámetro opcional que representa el objeto actual. Si se pasa como parámetro
+        Zeroc Ice puede tener comportamientos inesperados.
+        :return: Contenido del archivo.
+        """
+        self.check_erasure(hash)
+        return self.read_from_holders(hash, lambda filemanager: filemanager.getSmall(hash))
+
+    def read_from_holders(self, hash, read):
+        """
+        Hace una lectura en el poseedor elegido de un archivo y, si este no lo encuentra aunque el registro
+        diga que lo guarda, la repite en los demás poseedores, en orden y sin más consultas previas. Cuando
+        uno responde, se le pide en segundo plano que envíe una copia a cada poseedor que ha fallado (reparación
+        en lectura), sin esperar a que termine. Los poseedores inalcanzables también se saltan, pero no se reparan.
+        
+        :param hash: Hash del archivo.
+        :param read: Función que recibe el proxy `URFS.FileManagerPrx` de un poseedor y hace la lectura.
+        :return: Lo que devuelva `read` en el primer poseedor que encuentra el archivo.
+        :raises URFS.FileNotFoundError: Si no lo encuentra ningún poseedor.
+        :raises Ice.LocalException: Si no se ha podido contactar con ninguno.
+        """
+        filemanager = self.get_filemanager_for_download_remove(hash, self.broker)
+        if not filemanager:
             raise URFS.FileNotFoundError()
+        candidates = [filemanager] + [URFS.FileManagerPrx.uncheckedCast(holder) for holder in self.files.holders_of(hash)
+                                      if filemanager_key(holder) != filemanager_key(filemanager)]
+        missing = []
+        error = None
+        for filemanager in candidates:
+            try:
+                result = read(filemanager)
+            except URFS.FileNotFoundError:
+                logging.warning(f"{filemanager_key(filemanager)} no tiene {hash} aunque está registrado, se prueba otro")
+                missing.append(filemanager)
+                continue
+            except Ice.LocalException as e:  # Inalcanzable: no se le puede reparar ahora, se prueba otro
+                logging.warning(f"No se ha podido contactar con {filemanager_key(filemanager)} para leer {hash}: {e}")
+                error = e
+                continue
+            for target in missing:
+                self.schedule_repair(hash, filemanager, target)
+            return result
+        if error and not missing:
+            raise error
+        raise URFS.FileNotFoundError()
+
+    def schedule_repair(self, hash, source, target):
+        """
+        Pide a `source` que envíe en segundo plano una copia de un archivo a `target`. La llamada es asíncrona:
+        solo se registra si falla.
+        
+        :param hash: Hash del archivo.
+        :param source: Proxy `URFS.FileManagerPrx` de un poseedor que sí lo tiene.
+        :param target: Proxy `URFS.FileManagerPrx` del poseedor al que le falta.
+        """
+        logging.info(f"Reparación en lectura de {hash}: {filemanager_key(source)} -> {filemanager_key(target)}")
+
+        def done(future):
+            if future.exception():
+                logging.warning(f"No se ha podido pedir la reparación de {hash} a {filemanager_key(source)}: "
+                                f"{future.exception()}")
+
+        source.repairReplicaAsync(hash, target).add_done_callback(done)
+
+    def check_erasure(self, hash):
+        """
+        Los archivos con código de borrado no están enteros en ningún FileManager: el cliente los reconstruye a
+        partir de sus fragmentos. Si el hash es uno de ellos, se devuelve su distribución en la excepción.
+        
+        :param hash: Hash del archivo.
+        :raises URFS.ErasureCodedError: Si el archivo está guardado con código de borrado.
+        """
+        layout = self.files.layout_of(hash)
+        if layout:
+            raise URFS.ErasureCodedError(layout)
+
+    def planErasure(self, name, size, dataShards, parityShards, current=None):
+        """
+        Prepara la subida de un archivo con código de borrado: elige k + m FileManager distintos, los menos
+        cargados de entre los que responden, para guardar sus k fragmentos de datos y sus m de paridad. El
+        cliente codifica el archivo, sube cada fragmento a su FileManager y confirma la subida con
+        `commitErasure`.
+        
+        :param name: El nombre del archivo que se va a cargar.
+        :param size: Tamaño del archivo.
+        :param dataShards: Fragmentos de datos (k), o 0 para usar `URFS.ErasureDataShards`.
+        :param parityShards: Fragmentos de paridad (m), o un valor negativo para usar `URFS.ErasureParityShards`.
+        :param current: Parámetro opcional que representa el objeto actual. Si se pasa como parámetro
+        Zeroc Ice puede tener comportamientos inesperados.
+        :return: Objeto `URFS.ErasureLayout` con un fragmento por FileManager elegido, aún sin hash.
+        """
+        if self.files.has_name(os.path.basename(name)):
+            raise URFS.FileNameInUseError()
+        data_shards = dataShards if dataShards > 0 else self.erasure_data_shards
+        parity_shards = parityShards if parityShards >= 0 else self.erasure_parity_shards
+        required = data_shards + parity_shards
+        logging.info(f"Petición de subir fichero con nombre: {name} con código de borrado {data_shards}+{parity_shards}")
+
+        available = self.available_filemanagers()
+        if len(available) < required or required > 256:
+            raise URFS.NotEnoughFileManagersError(len(available), required)
+        shards = [URFS.Shard('', filemanager) for filemanager in available[:required]]
+        return URFS.ErasureLayout(size, data_shards, parity_shards, self.erasure_cell_size, shards)
+
+    def planStripes(self, name, size, width, current=None):
+        """
+        Prepara la subida de un archivo grande repartido en franjas: el archivo se divide en bloques de
+        `URFS.StripeSize` bytes que se reparten por turnos entre `width` FileManager distintos, de modo que la
+        subida y las descargas usan a la vez el disco y la red de todos ellos. Es un código de borrado sin
+        paridad (k+0), así que se sube y se confirma igual (`commitErasure`).
 
-        downloader = filemanager_for_download.createDownloader(hash)
-        return downloader
+        Nunca se usan más FileManager que bloques tiene el archivo; si no salen al menos dos, no compensa
+        repartirlo y se lanza `NotEnoughFileManagersError` para que el cliente haga una subida normal.
+        
+        :param name: El nombre del archivo que se va a cargar.
+        :param size: Tamaño del archivo.
+        :param width: Número de FileManager, o 0 para usar `URFS.StripeWidth` (por defecto, todos los que
+        responden).
+        :param current: Parámetro opcional que representa el objeto actual. Si se pasa como parámetro
+        Zeroc Ice puede tener comportamientos inesperados.
+        :return: Objeto `URFS.ErasureLayout` sin paridad, con un fragmento por FileManager elegido.
+        """
+        if self.files.has_name(os.path.basename(name)):
+            raise URFS.FileNameInUseError()
+        available = self.available_filemanagers()
+        width = width if width > 0 else self.stripe_width or len(available)
+        width = min(width, 256, -(-size // self.stripe_size))
+        logging.info(f"Petición de subir fichero con nombre: {name} repartido en {width} FileManager")
+        if width < 2 or len(available) < width:
+            raise URFS.NotEnoughFileManagersError(len(available), max(width, 2))
+        shards = [URFS.Shard('', filemanager) for filemanager in available[:width]]
+        return URFS.ErasureLayout(size, width, 0, self.stripe_size, shards)
+
+    def available_filemanagers(self):
+        """
+        Devuelve los FileManager que responden, de menos a más cargado según el registro. Se comprueban todos a
+        la vez.
+        
+        :return: Lista de proxies `URFS.FileManagerPrx`.
+        """
+        candidates = sorted(self.get_filemanagers(self.broker), key=self.files.count)
+        requests = [(filemanager, filemanager.ice_pingAsync()) for filemanager in candidates]
+        available = []
+        for filemanager, future in requests:
+            try:
+                future.result()
+                available.append(URFS.FileManagerPrx.uncheckedCast(filemanager))
+            except Ice.Exception as e:
+                logging.warning(f"{filemanager_key(filemanager)} no responde: {e}")
+        return available
+
+    def commitErasure(self, name, hash, layout, current=None):
+        """
+        Registra un archivo cuyos fragmentos ya están guardados y lo publica en el canal de eventos. Si mientras
+        tanto se ha guardado el mismo contenido, se registra el nombre como alias y se eliminan los fragmentos.
+        
+        :param name: Nombre del archivo.
+        :param hash: Hash MD5 del contenido completo.
+        :param layout: Objeto `URFS.ErasureLayout` devuelto por `planErasure`, con el hash de cada fragmento.
+        :param current: Parámetro opcional que representa el objeto actual. Si se pasa como parámetro
+        Zeroc Ice puede tener comportamientos inesperados.
+        :return: Objeto `URFS.FileInfo` con el nombre y el hash.
+        """
+        name = os.path.basename(name)
+        if hash in self.files:
+            file_info = self.linkFile(name, hash)
+            self.remove_shards(layout)
+            return file_info
+        if self.files.has_name(name):
+            raise URFS.FileNameInUseError()
+
+        file_info = URFS.FileInfo(name, hash)
+        self.addErasureTo_registro(file_info, layout)
+        self.file_updates.newErasure(file_info, layout)
+        logging.info(f"Archivo con código de borrado guardado. Nombre: {name} Hash: {hash} "
+                     f"({layout.dataShards}+{layout.parityShards})")
+        return file_info
+
+    def remove_shards(self, layout):
+        """
+        Elimina los fragmentos de un archivo con código de borrado de sus FileManager. Los que no responden se
+        omiten.
+        
+        :param layout: Objeto `URFS.ErasureLayout` del archivo.
+        """
+        for shard in layout.shards:
+            try:
+                shard.fileManager.removeFile(shard.hash, '')
+            except (URFS.FileNotFoundError, Ice.Exception) as e:
+                logging.warning(f"No se ha podido eliminar el fragmento {shard.hash} de "
+                                f"{filemanager_key(shard.fileManager)}: {e}")
 
     def removeFile(self, hash, current=None):
         """
         Comprueba si existe un archivo con un hash determinado en una lista de archivos y, de ser así, 
-        lo elimina utilizando un administrador de archivos.
+        lo elimina utilizando un administrador de archivos. Si el contenido tiene varios nombres, solo se
+        elimina el más reciente según el registro y los datos se conservan hasta que se elimina el último. El
+        borrado se aplica en todas las réplicas, indicando el nombre, para que todas eliminen el mismo alias.
         
         :param hash: Identificador único para un archivo. Se utiliza para localizar y eliminar el archivo 
         de una lista de archivos
         :param current: Parámetro opcional que representa el objeto actual. Si se pasa como parámetro
         Zeroc Ice puede tener comportamientos inesperados.
         """
-        if not any(file_data.fileInfo.hash == hash for file_data in self.files):
+        layout = self.files.layout_of(hash)
+        if layout:
+            self.remove_erasure(hash, layout)
+            return
+
+        names = self.files.names_of(hash)
+        if not names:
             raise URFS.FileNotFoundError()
-    
-        filemanager_for_download_remove = self.get_filemanager_for_download_remove(hash, self.broker)
-        filemanager_for_download_remove.removeFile(hash)    
+        removed = False
+        for filemanager in self.files.holders_of(hash):
+            try:
+                URFS.FileManagerPrx.uncheckedCast(filemanager).removeFile(hash, names[-1])
+                removed = True
+            except (URFS.FileNotFoundError, Ice.Exception) as e:
+                logging.warning(f"No se ha podido eliminar {hash} de {filemanager_key(filemanager)}: {e}")
+        if not removed:
+            raise URFS.FileNotFoundError()
+
+    def remove_erasure(self, hash, layout):
+        """
+        Elimina el nombre más reciente de un archivo con código de borrado y, si era el último, sus fragmentos.
+        El borrado se publica en el canal de eventos como el de cualquier otro archivo.
+        
+        :param hash: Hash del archivo.
+        :param layout: Objeto `URFS.ErasureLayout` del archivo.
+        """
+        names = self.files.names_of(hash)
+        if not names:
+            raise URFS.FileNotFoundError()
+        if len(names) == 1:
+            self.remove_shards(layout)
+        file_data = URFS.FileData(URFS.FileInfo(names[-1], hash), None, [])
+        self.removeFrom_registro(file_data)
+        self.file_updates.removed(file_data)
+        logging.info(f"Archivo con código de borrado eliminado: {names[-1]} {hash}")
 
     def replyNewFrontend(self, oldFrontend, current=None):
         """
@@ -201,33 +830,30 @@ class FrontendI(URFS.Frontend):
         
         :param new_file_data: Objeto que representa los datos de un nuevo archivo que debe agregarse al registro
         """
-        file_data_already_exists = False
-        if len(self.files) == 0:
-            self.files.append(new_file_data)
-        else:  
-     #COMPRUEBA SI EL FICHERO YA ESTA EN EL REGISTRO (PARA EVITAR DUPLICADOS POR EL FRONTEND UPDATES) 
-            for file_data in list(self.files):  # Crea una copia de self.files
-                if file_data.fileInfo.hash == new_file_data.fileInfo.hash:                   
-                    file_data_already_exists = True  
-            
-            if not file_data_already_exists:
-                self.files.append(new_file_data)
+        #SOLO SE AÑADE SI EL FICHERO NO ESTA YA EN EL REGISTRO (PARA EVITAR DUPLICADOS POR EL FRONTEND UPDATES)
+        if self.files.add(new_file_data):
+            logging.info(f"Actualizado registro de archivos --> {len(self.files)} ficheros")
 
-        logging.info(f"Actualizada lista de archivos --> {self.files}")
+    def addErasureTo_registro(self, file_info, layout):
+        """
+        Agrega un archivo con código de borrado al registro si aún no existe.
+        
+        :param file_info: Objeto `URFS.FileInfo` del archivo.
+        :param layout: Objeto `URFS.ErasureLayout` con sus fragmentos.
+        """
+        if self.files.add_layout(file_info, layout):
+            logging.info(f"Actualizado registro de archivos --> {len(self.files)} ficheros")
     
     def removeFrom_registro(self, file_data_to_remove):
         """
-        Elimina un archivo específico de una lista de archivos según su valor hash.
+        Elimina un nombre de archivo del registro según su valor hash. El contenido deja de estar registrado
+        cuando se elimina su último nombre.
         
-        :param file_data_to_remove: Objeto que representa los datos del archivo que deben eliminarse de la lista `self.files`. 
+        :param file_data_to_remove: Objeto que representa los datos del archivo que deben eliminarse del registro `self.files`. 
         Se supone que este objeto tiene un atributo `fileInfo`, que a su vez tiene un atributo `hash`. Se utiliza el atributo `hash`
         """
-        for file_data in list(self.files):
-            if file_data.fileInfo.hash == file_data_to_remove.fileInfo.hash:
-                self.files.remove(file_data)
-                break
-
-        logging.info(f"Actualizada lista de archivos --> {self.files}")
+        if self.files.remove(file_data_to_remove.fileInfo.hash, file_data_to_remove.fileInfo.name):
+            logging.info(f"Actualizado registro de archivos --> {len(self.files)} ficheros")
 
     def get_filemanager_for_upload(self, broker):     #OBTIENE FILEMANAGER QUE MENOS CARGADO ESTE (MENOS FICHEROS EN EL REGISTRO)
         """
@@ -235,16 +861,10 @@ class FrontendI(URFS.Frontend):
         que tiene la menor cantidad de archivos. Este método es útil para equilibrar la 
         carga entre diferentes administradores de archivos.
 
-        Primero, la función obtiene todos los file managers disponibles. Luego, para cada uno de ellos, inicializa 
-        un contador en un diccionario.
-
-        Después, la función recorre la lista de archivos y aumenta el contador correspondiente al administrador 
-        de archivos de cada archivo en el diccionario.
+        Primero, la función obtiene todos los file managers disponibles. Luego selecciona el que menos ficheros
+        tiene según los contadores que el registro mantiene de forma incremental, sin recorrer la lista de ficheros.
 
-        Si ya se han cargado archivos antes (es decir, el diccionario no está vacío), la función selecciona el 
-        administrador de archivos con el contador más bajo y lo devuelve.
-
-        Si es la primera vez que se suben archivos (es decir, el diccionario está vacío), la función selecciona 
+        Si no se encuentra ningún administrador de archivos registrado en IceGrid, la función selecciona 
         un administrador de archivos predeterminado ("FileManager1") y lo devuelve.
 
         :param broker: Instancia de broker IceGrid. Se utiliza para comunicarse con el registro IceGrid y obtener
@@ -254,69 +874,97 @@ class FrontendI(URFS.Frontend):
         """
 
         
-        query = IceGrid.QueryPrx.checkedCast(broker.stringToProxy("IceGrid/Query")) 
-        file_managers = query.findAllObjectsByType("::URFS::FileManager") #OBTIENE TODOS LOS FILEMANAGERS DISPONIBLES
-        contador_filemanagers = {}
-
-        for fm in file_managers:
-            file_manager_proxy_str = fm.ice_toString()
-            file_manager_proxy = URFS.FileManagerPrx.checkedCast(broker.stringToProxy(file_manager_proxy_str))
-            contador_filemanagers[file_manager_proxy] = 0  # Add the FileManager to the dictionary with a count of 0
-       
-        for file_data in list(self.files):
-            filemanager = file_data.fileManager
-            if filemanager in contador_filemanagers:
-                contador_filemanagers[filemanager] += 1
-            else:
-                contador_filemanagers[filemanager] = 1
+        selected_filemanager = min(self.get_filemanagers(broker), key=self.files.count)
+
+        filemanager_for_upload = URFS.FileManagerPrx.checkedCast(selected_filemanager)
+        if not filemanager_for_upload:
+            raise RuntimeError('Invalid proxy')
         
-        if contador_filemanagers: #Controlamos que no sea la primera vez que se sube algún archivo
-            selected_filemanager = min(contador_filemanagers, key=contador_filemanagers.get)
-            # filemanager_proxy = broker.stringToProxy(selected_filemanager)
-            filemanager_for_upload = URFS.FileManagerPrx.checkedCast(selected_filemanager)
+        return filemanager_for_upload
 
-            if not filemanager_for_upload:
-                raise RuntimeError('Invalid proxy')
-            
-            return filemanager_for_upload
+    def get_replica_chain(self, primary, broker):
+        """
+        Elige los FileManager en los que se replica una subida además de `primary`: los `URFS.ReplicationFactor`
+        - 1 menos cargados del resto. Si no hay suficientes, se replica en los que haya.
         
-        else:
-            filemanager_proxy = broker.stringToProxy("FileManager1")
-            filemanager_for_upload = URFS.FileManagerPrx.checkedCast(filemanager_proxy)
+        :param primary: Proxy del FileManager que recibe la subida.
+        :param broker: Instancia de broker IceGrid, usada para consultar el registro.
+        :return: Lista de proxies `URFS.FileManagerPrx`, en el orden de la cadena de replicación.
+        """
+        if self.replication_factor <= 1:
+            return []
+        others = [filemanager for filemanager in self.get_filemanagers(broker)
+                  if filemanager_key(filemanager) != filemanager_key(primary)]
+        chain = sorted(others, key=self.files.count)[:self.replication_factor - 1]
+        if len(chain) < self.replication_factor - 1:
+            logging.warning(f"Solo hay {len(chain) + 1} FileManager para {self.replication_factor} réplicas")
+        return [URFS.FileManagerPrx.uncheckedCast(filemanager) for filemanager in chain]
 
-            if not filemanager_for_upload:
-                raise RuntimeError('Invalid proxy')
-            
-            return filemanager_for_upload
+    def get_filemanagers(self, broker):
+        """
+        Devuelve los proxies de todos los FileManager registrados en IceGrid o, si no hay ninguno, el
+        FileManager predeterminado ("FileManager1").
+        
+        :param broker: Instancia de broker IceGrid, usada para consultar el registro.
+        :return: Lista de proxies de FileManager, sin comprobar.
+        """
+        query = IceGrid.QueryPrx.checkedCast(broker.stringToProxy("IceGrid/Query")) 
+        file_managers = query.findAllObjectsByType("::URFS::FileManager") #OBTIENE TODOS LOS FILEMANAGERS DISPONIBLES
+        
+        if file_managers: #Controlamos que haya algún FileManager registrado
+            return file_managers
+        return [broker.stringToProxy("FileManager1")]
 
     def get_filemanager_for_download_remove(self, hash, broker):
         """
         Retorna el gestor de archivos para descargar y eliminar un archivo basado en su hash.
         
-        Inicialmente, la función recorre la lista de archivos buscando un archivo que coincida con el hash proporcionado.
-        Si existe tal archivo, selecciona el gestor de archivos asociado a dicho archivo.
+        Inicialmente, la función busca en el registro el archivo que coincida con el hash proporcionado.
+        Si existe tal archivo, selecciona el gestor de archivos asociado a dicho archivo. Si el archivo está
+        replicado, se pregunta a la vez a todos los poseedores por sus transferencias activas (`getLoad`) y se
+        elige el menos cargado de los que responden.
 
         A continuación, se crea un objeto proxy para el gestor de archivos seleccionado utilizando el broker. Si se produce 
         algún problema durante la creación del proxy, se lanza una excepción de tipo 'RuntimeError' con el mensaje 'Invalid proxy'.
         
-        :param hash: Identificador único de un archivo. Se emplea para buscar un archivo específico en la lista de archivos.
+        :param hash: Identificador único de un archivo. Se emplea para buscar un archivo específico en el registro.
         :param broker: Sirve como intermediario en la comunicación entre el cliente y el servidor. Su responsabilidad es crear 
         y gestionar conexiones con objetos remotos. En este código, se utiliza para crear un objeto proxy para el gestor de archivos seleccionado.
-        :return: Devuelve una instancia de `URFS.FileManagerPrx` si encuentra un archivo que coincide con el hash proporcionado en la lista
+        :return: Devuelve una instancia de `URFS.FileManagerPrx` si encuentra un archivo que coincide con el hash proporcionado en el registro
         `self.files`. Si no se encuentra ningún archivo coincidente, devuelve "None".
         """
-        for file_data in list(self.files):
-            if file_data.fileInfo.hash == hash:
-                selected_filemanager = file_data.fileManager
+        holders = self.files.holders_of(hash)
+        if not holders:
+            return None
+        if len(holders) > 1:
+            return self.least_loaded(holders)
 
-                filemanager_proxy = broker.stringToProxy(str(selected_filemanager))
-                filemanager_for_download = URFS.FileManagerPrx.checkedCast(filemanager_proxy)
+        filemanager_proxy = broker.stringToProxy(str(holders[0]))
+        filemanager_for_download = URFS.FileManagerPrx.checkedCast(filemanager_proxy)
 
-                if not filemanager_for_download:
-                    raise RuntimeError('Invalid proxy')
-                return filemanager_for_download
+        if not filemanager_for_download:
+            raise RuntimeError('Invalid proxy')
+        return filemanager_for_download
 
-        return None
+    def least_loaded(self, filemanagers):
+        """
+        Devuelve el FileManager con menos transferencias activas. Las consultas se hacen en paralelo y los que
+        no responden se descartan; si no responde ninguno se devuelve el primero.
+        
+        :param filemanagers: Lista de proxies de FileManager.
+        :return: Proxy `URFS.FileManagerPrx` elegido.
+        """
+        filemanagers = [URFS.FileManagerPrx.uncheckedCast(filemanager) for filemanager in filemanagers]
+        requests = [(filemanager, filemanager.getLoadAsync()) for filemanager in filemanagers]
+        loads = []
+        for filemanager, future in requests:
+            try:
+                loads.append((future.result(), filemanager_key(filemanager), filemanager))
+            except Ice.Exception as e:
+                logging.warning(f"{filemanager_key(filemanager)} no responde: {e}")
+        if not loads:
+            return filemanagers[0]
+        return min(loads, key=lambda load: load[:2])[2]
 
 class Frontend(Ice.Application):
     def run(self, argv):
@@ -424,6 +1072,7 @@ class Frontend(Ice.Application):
             topic_file_updates = topic_mgr.retrieve(file_updates_topic_name)
 
         topic_file_updates.subscribeAndGetPublisher({}, direct_proxy_file_updates)
+        frontend_servant.file_updates = URFS.FileUpdatesPrx.uncheckedCast(topic_file_updates.getPublisher())
         logging.info("Waiting events in file updates... '{}'".format(direct_proxy_file_updates))
         adapter.activate()
 
@@ -2,16 +2,19 @@
 
 import tkinter as tk
 from tkinter import filedialog, simpledialog, messagebox
+import os
 import sys
-import binascii
 import Ice
 Ice.loadSlice('urfs.ice')
 import URFS
 import tkinter.scrolledtext as scrolledtext
+from util import get_small_object_threshold
+from transfer import negotiate, send_file, download_to, file_md5, DEFAULT_UPLOAD_WINDOW, DEFAULT_DOWNLOAD_STREAMS
+from transfer import fetch_erasure
+from erasure import ReedSolomon
 
 
 DOWNLOAD_PATH = 'downloads'
-BLOCK_SIZE = 1024
 
 class IceClientGUI(tk.Tk):
     def __init__(self):
@@ -65,14 +68,25 @@ class IceClientGUI(tk.Tk):
         file_path = filedialog.askopenfilename()
         if file_path:
             try:
+                if os.path.getsize(file_path) <= get_small_object_threshold(self.ice_communicator.getProperties()):
+                    with open(file_path, 'rb') as _file:
+                        data = _file.read()
+                    try:
+                        file_info = self.frontend.putSmall(file_path, data)
+                        messagebox.showinfo("Éxito", f"Archivo subido: {file_info.name}")
+                        return
+                    except URFS.ObjectTooLargeError:  # El frontend tiene un umbral menor, se sube por bloques
+                        pass
+                file_hash = file_md5(file_path)
+                if self.frontend.hasFile(file_hash):
+                    file_info = self.frontend.linkFile(file_path, file_hash)
+                    messagebox.showinfo("Éxito", f"Archivo enlazado: {file_info.name}")
+                    return
                 with open(file_path, 'rb') as _file:
                     uploader = self.frontend.uploadFile(file_path)
-                    while True:
-                        data = _file.read(BLOCK_SIZE)
-                        if not data:
-                            break
-                        data = str(binascii.b2a_base64(data, newline=False))
-                        uploader.send(data)
+                    properties = self.ice_communicator.getProperties()
+                    sizer = negotiate(uploader, properties)
+                    send_file(uploader, _file, sizer, properties.getPropertyAsIntWithDefault('URFS.UploadWindow', DEFAULT_UPLOAD_WINDOW))
                     file_info = uploader.save()
                     messagebox.showinfo("Éxito", f"Archivo subido: {file_info.name}")
             except Exception as e:
@@ -82,15 +96,21 @@ class IceClientGUI(tk.Tk):
         file_hash = simpledialog.askstring("Descargar Archivo", "Introduce el hash del archivo:")
         if file_hash:
             try:
-                downloader = self.frontend.downloadFile(file_hash)
-                with open(f'{DOWNLOAD_PATH}/{file_hash}', 'wb') as _file:
-                    while True:
-                        data = downloader.recv(BLOCK_SIZE)
-                        data = data[2:-1]
-                        decoded_data = binascii.a2b_base64(data)
-                        _file.write(decoded_data)
-                        if len(data) < BLOCK_SIZE:
-                            break
+                properties = self.ice_communicator.getProperties()
+                try:
+                    ticket = self.frontend.openDownload(file_hash)
+                except URFS.ErasureCodedError as e:  # Se reconstruye a partir de sus fragmentos
+                    layout = e.layout
+                    fetch_erasure(lambda index: layout.shards[index].fileManager.openDownloader(layout.shards[index].hash).downloader,
+                                  f'{DOWNLOAD_PATH}/{file_hash}', file_hash, layout.size,
+                                  ReedSolomon(layout.dataShards, layout.parityShards), layout.cellSize,
+                                  properties.getPropertyAsIntWithDefault('URFS.DownloadStreams', DEFAULT_DOWNLOAD_STREAMS))
+                    messagebox.showinfo("Éxito", "Archivo descargado.")
+                    return
+                downloader = ticket.downloader
+                sizer = negotiate(downloader, properties)
+                download_to(downloader, f'{DOWNLOAD_PATH}/{file_hash}', file_hash, sizer,
+                            properties.getPropertyAsIntWithDefault('URFS.DownloadStreams', DEFAULT_DOWNLOAD_STREAMS), ticket.size)
                 downloader.destroy()
                 messagebox.showinfo("Éxito", "Archivo descargado.")
             except Exception as e:
@@ -0,0 +1,151 @@
+import random
+import hashlib
+
+try:
+    import numpy as np
+except ImportError:  # NumPy es opcional: sin él se usa la implementación en Python puro
+    np = None
+
+DEFAULT_AVERAGE_CHUNK_SIZE = 64 * 1024
+READ_WINDOW = 8 * 1024 * 1024  # Bytes que se leen del fichero en cada ventana
+GEAR_SEED = 0x55524653
+HASH_MASK = (1 << 64) - 1
+
+# Tabla Gear: un valor aleatorio de 64 bits por cada byte posible. La semilla es fija para que todos los
+# FileManager corten los ficheros en los mismos puntos.
+_generator = random.Random(GEAR_SEED)
+GEAR = tuple(_generator.getrandbits(64) for _ in range(256))
+GEAR_ARRAY = np.array(GEAR, dtype=np.uint64) if np is not None else None
+
+
+def chunk_id(data):
+    """
+    Devuelve el identificador de un bloque: su hash BLAKE2b de 128 bits en hexadecimal.
+
+    :param data: Contenido del bloque.
+    """
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class Chunker:
+    def __init__(self, average_size=DEFAULT_AVERAGE_CHUNK_SIZE, use_numpy=None):
+        """
+        Divide ficheros en bloques definidos por su contenido con el algoritmo FastCDC: un hash rodante Gear
+        (`h = (h << 1) + GEAR[byte]`) se evalúa en cada posición y se corta donde los bits altos de `h` son
+        cero. Como los cortes dependen solo de los datos cercanos, insertar o cambiar unos pocos bytes de un
+        fichero solo altera los bloques de alrededor, y el resto se deduplica.
+
+        Se usa normalización de nivel 1: antes del tamaño medio la máscara es más exigente y después lo es
+        menos, lo que concentra los tamaños alrededor de la media. Los bloques miden entre `average_size / 4`
+        y `average_size * 8` bytes.
+
+        Con NumPy el hash de toda una ventana se calcula vectorizado; sin él, byte a byte. Ambas
+        implementaciones producen exactamente los mismos cortes.
+
+        :param average_size: Tamaño medio de bloque deseado, potencia de dos.
+        :param use_numpy: Fuerza (True) o desactiva (False) NumPy; por defecto se usa si está instalado.
+        """
+        bits = average_size.bit_length() - 1
+        self.average_size = 1 << bits
+        self.min_size = self.average_size // 4
+        self.max_size = self.average_size * 8
+        self.mask_s = ((1 << (bits + 1)) - 1) << (64 - bits - 1)  # Bits altos: dependen de los últimos 64 bytes
+        self.mask_l = ((1 << (bits - 1)) - 1) << (64 - bits + 1)
+        self.use_numpy = np is not None if use_numpy is None else use_numpy
+        if self.use_numpy and np is None:
+            raise RuntimeError('NumPy no está instalado')
+
+    def split(self, f):
+        """
+        Lee un fichero por ventanas y devuelve sus bloques.
+
+        :param f: Fichero abierto en modo binario.
+        :return: Generador con el contenido de cada bloque, en orden.
+        """
+        buffer = b''
+        eof = False
+        while not eof:
+            data = f.read(READ_WINDOW)
+            eof = not data
+            buffer += data
+            start = 0
+            for end in self.cuts(buffer, eof):
+                yield buffer[start:end]
+                start = end
+            buffer = buffer[start:]
+
+    def cuts(self, data, eof):
+        """
+        Calcula los puntos de corte de un buffer que empieza en un límite de bloque.
+
+        :param data: Datos pendientes de dividir.
+        :param eof: True si no llegarán más datos detrás de `data`.
+        :return: Lista con la posición final de cada bloque que ya se puede decidir. Con `eof` el último corte
+        es siempre el final de `data`.
+        """
+        find_cut = self.numpy_cutter(data) if self.use_numpy else self.python_cutter(data)
+        cuts = []
+        start = 0
+        while start < len(data):
+            end = find_cut(start, eof)
+            if end is None:
+                break
+            cuts.append(end)
+            start = end
+        return cuts
+
+    def python_cutter(self, data):
+        n = len(data)
+
+        def find_cut(start, eof):
+            low, middle, high = start + self.min_size, start + self.average_size, start + self.max_size
+            if low >= n:
+                return n if eof else None
+            end = min(high, n)
+            h = 0
+            for i in range(max(start, low - 64), low):  # Solo los 64 bytes anteriores influyen en el hash
+                h = ((h << 1) + GEAR[data[i]]) & HASH_MASK
+            for i in range(low, min(middle, end)):
+                h = ((h << 1) + GEAR[data[i]]) & HASH_MASK
+                if not h & self.mask_s:
+                    return i + 1
+            for i in range(middle, end):
+                h = ((h << 1) + GEAR[data[i]]) & HASH_MASK
+                if not h & self.mask_l:
+                    return i + 1
+            if high <= n:
+                return high
+            return n if eof else None
+
+        return find_cut
+
+    def numpy_cutter(self, data):
+        n = len(data)
+        # h[i] = suma de GEAR[data[i - k]] << k para k < 64, calculada duplicando el alcance en cada paso
+        h = GEAR_ARRAY[np.frombuffer(data, dtype=np.uint8)]
+        shifted = np.empty_like(h)
+        span = 1
+        while span < 64:
+            np.left_shift(h[:-span], np.uint64(span), out=shifted[span:])
+            np.add(h[span:], shifted[span:], out=h[span:])
+            span *= 2
+        candidates_s = np.flatnonzero((h & np.uint64(self.mask_s)) == 0)
+        candidates_l = np.flatnonzero((h & np.uint64(self.mask_l)) == 0)
+
+        def find_cut(start, eof):
+            low, middle, high = start + self.min_size, start + self.average_size, start + self.max_size
+            if low >= n:
+                return n if eof else None
+            i = np.searchsorted(candidates_s, low)
+            if i < len(candidates_s) and candidates_s[i] < min(middle, n):
+                return int(candidates_s[i]) + 1
+            if middle >= n:
+                return n if eof else None
+            j = np.searchsorted(candidates_l, middle)
+            if j < len(candidates_l) and candidates_l[j] < min(high, n):
+                return int(candidates_l[j]) + 1
+            if high <= n:
+                return high
+            return n if eof else None
+
+        return find_cut
@@ -0,0 +1,136 @@
+import mmap
+import hashlib
+from itertools import accumulate
+
+CHECKSUM_MOD = 1 << 16
+MIN_DELTA_BLOCK_SIZE = 2 * 1024
+MAX_DELTA_BLOCKS = 8192  # Firmas por objeto como mucho, para que quepan en un mensaje Ice
+
+
+def delta_block_size(size):
+    """
+    Elige el tamaño de bloque de las firmas de un objeto: el mínimo mientras el número de bloques no pase de
+    `MAX_DELTA_BLOCKS`, y a partir de ahí el necesario para no pasar de ese número.
+
+    :param size: Tamaño del objeto base.
+    """
+    return max(MIN_DELTA_BLOCK_SIZE, -(-size // MAX_DELTA_BLOCKS))
+
+
+def weak_checksum(block):
+    """
+    Suma de comprobación débil de rsync: `a` es la suma de los bytes y `b` la suma de las sumas parciales,
+    ambas módulo 2^16. Se puede desplazar un byte en tiempo constante con `roll`.
+
+    :param block: Bytes del bloque.
+    :return: Tupla (a, b).
+    """
+    return sum(block) % CHECKSUM_MOD, sum(accumulate(block)) % CHECKSUM_MOD
+
+
+def roll(a, b, out, new, length):
+    """
+    Desplaza un byte la ventana de la suma débil: sale `out` por delante y entra `new` por detrás.
+
+    :return: Tupla (a, b) de la nueva ventana.
+    """
+    a = (a - out + new) % CHECKSUM_MOD
+    b = (b - length * out + a) % CHECKSUM_MOD
+    return a, b
+
+
+def strong_checksum(block):
+    """
+    Suma de comprobación fuerte de un bloque (MD5 en hexadecimal), que confirma las coincidencias de la débil.
+    """
+    return hashlib.md5(block).hexdigest()
+
+
+def signatures(reader, block_size):
+    """
+    Calcula las firmas de los bloques de un objeto.
+
+    :param reader: Lector con el atributo `size` y el método `pread(size, offset)`.
+    :param block_size: Tamaño de bloque.
+    :return: Lista de tuplas (suma débil, suma fuerte), una por bloque; la suma débil va empaquetada como
+    `a | b << 16`.
+    """
+    blocks = []
+    for offset in range(0, reader.size, block_size):
+        block = reader.pread(block_size, offset)
+        a, b = weak_checksum(block)
+        blocks.append((a | b << 16, strong_checksum(block)))
+    return blocks
+
+
+def compute_delta(_file, size, base_size, block_size, blocks, literal_limit):
+    """
+    Compara un fichero local con las firmas de un objeto base y genera las instrucciones para reconstruirlo:
+    la suma débil se desplaza byte a byte por el fichero y, cuando coincide con la de un bloque del objeto base
+    y la fuerte lo confirma, ese bloque se copia en lugar de enviarse. Las copias de bloques consecutivos se
+    agrupan en una sola instrucción.
+
+    :param _file: Fichero abierto en modo binario.
+    :param size: Tamaño del fichero.
+    :param base_size: Tamaño del objeto base.
+    :param block_size: Tamaño de bloque de las firmas.
+    :param blocks: Firmas del objeto base, como las devuelve `signatures`. El último bloque, si es más corto,
+    no se busca.
+    :param literal_limit: Tamaño máximo de cada tramo literal.
+    :return: Generador de tuplas `('data', bytes)` y `('copy', offset en el objeto base, tamaño)`, en orden.
+    """
+    if not size:
+        return
+    table = {}
+    for index, (weak, strong) in enumerate(blocks):
+        if (index + 1) * block_size <= base_size:
+            table.setdefault(weak, []).append((index, strong))
+
+    data = mmap.mmap(_file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        copy = None  # Copia pendiente de emitir: [offset en el objeto base, tamaño]
+        literal = 0  # Inicio del tramo literal pendiente
+        position = 0
+        if size >= block_size:
+            a, b = weak_checksum(data[:block_size])
+        while position + block_size <= size:
+            match = None
+            entries = table.get(a | b << 16)
+            if entries:
+                strong = strong_checksum(data[position:position + block_size])
+                match = next((index for index, expected in entries if expected == strong), None)
+            if match is not None:
+                if literal < position:
+                    if copy:
+                        yield ('copy', *copy)
+                        copy = None
+                    for start in range(literal, position, literal_limit):
+                        yield ('data', data[start:min(start + literal_limit, position)])
+                if copy and copy[0] + copy[1] == match * block_size:
+                    copy[1] += block_size
+                else:
+                    if copy:
+                        yield ('copy', *copy)
+                    copy = [match * block_size, block_size]
+                position += block_size
+                literal = position
+                if position + block_size <= size:
+                    a, b = weak_checksum(data[position:position + block_size])
+                continue
+
+            if position + block_size < size:
+                a, b = roll(a, b, data[position], data[position + block_size], block_size)
+            position += 1
+            if position - literal >= literal_limit:
+                if copy:
+                    yield ('copy', *copy)
+                    copy = None
+                yield ('data', data[literal:position])
+                literal = position
+
+        if copy:
+            yield ('copy', *copy)
+        for start in range(literal, size, literal_limit):
+            yield ('data', data[start:min(start + literal_limit, size)])
+    finally:
+        data.close()
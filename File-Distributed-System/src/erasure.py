@@ -0,0 +1,175 @@
+try:
+    import numpy as np
+except ImportError:  # NumPy es opcional: sin él se usa la implementación en Python puro
+    np = None
+
+GF_POLYNOMIAL = 0x11d  # x^8 + x^4 + x^3 + x^2 + 1, el polinomio habitual de Reed-Solomon sobre GF(2^8)
+DEFAULT_DATA_SHARDS = 2
+DEFAULT_PARITY_SHARDS = 1
+DEFAULT_CELL_SIZE = 64 * 1024
+
+# Tablas de exponenciales y logaritmos en base 2. EXP se duplica para no tener que reducir la suma de logaritmos.
+EXP = [0] * 512
+LOG = [0] * 256
+_value = 1
+for _power in range(255):
+    EXP[_power] = _value
+    LOG[_value] = _power
+    _value <<= 1
+    if _value & 0x100:
+        _value ^= GF_POLYNOMIAL
+for _power in range(255, 512):
+    EXP[_power] = EXP[_power - 255]
+
+
+def gf_mul(a, b):
+    """
+    Producto de dos elementos de GF(256).
+    """
+    if not a or not b:
+        return 0
+    return EXP[LOG[a] + LOG[b]]
+
+
+def gf_inv(a):
+    """
+    Inverso multiplicativo de un elemento no nulo de GF(256).
+    """
+    if not a:
+        raise ZeroDivisionError('El 0 no tiene inverso en GF(256)')
+    return EXP[255 - LOG[a]]
+
+
+# MUL_TABLES[c] traduce cada byte x a c·x, de modo que multiplicar un bloque entero por una constante es un
+# `bytes.translate` (o una indexación de NumPy), sin bucles en Python.
+MUL_TABLES = [bytes(gf_mul(c, x) for x in range(256)) for c in range(256)]
+MUL_ARRAY = np.frombuffer(b''.join(MUL_TABLES), dtype=np.uint8).reshape(256, 256) if np is not None else None
+
+
+def invert_matrix(matrix):
+    """
+    Invierte una matriz cuadrada sobre GF(256) por eliminación de Gauss-Jordan.
+
+    :param matrix: Lista de filas.
+    :return: Matriz inversa, como lista de filas.
+    :raises ValueError: Si la matriz es singular.
+    """
+    n = len(matrix)
+    rows = [list(row) + [int(i == j) for j in range(n)] for i, row in enumerate(matrix)]
+    for column in range(n):
+        pivot = next((i for i in range(column, n) if rows[i][column]), None)
+        if pivot is None:
+            raise ValueError('Matriz singular')
+        rows[column], rows[pivot] = rows[pivot], rows[column]
+        factor = gf_inv(rows[column][column])
+        rows[column] = [gf_mul(factor, value) for value in rows[column]]
+        for i in range(n):
+            if i != column and rows[i][column]:
+                factor = rows[i][column]
+                rows[i] = [value ^ gf_mul(factor, pivot_value) for value, pivot_value in zip(rows[i], rows[column])]
+    return [row[n:] for row in rows]
+
+
+class ReedSolomon:
+    def __init__(self, data_shards=DEFAULT_DATA_SHARDS, parity_shards=DEFAULT_PARITY_SHARDS, use_numpy=None):
+        """
+        Código Reed-Solomon sistemático sobre GF(256): `data_shards` fragmentos de datos (k) se completan con
+        `parity_shards` fragmentos de paridad (m), y el contenido se puede reconstruir con cualquier k de los
+        k + m. Los fragmentos de datos son el propio contenido, así que mientras estén todos no hay que decodificar.
+
+        La matriz de paridad es una matriz de Cauchy, `1 / (x_i + y_j)` con `x_i = k + i` e `y_j = j`, de modo que
+        cualquier submatriz cuadrada de la matriz generadora completa (identidad más paridad) es invertible.
+
+        Con NumPy cada producto se calcula como una indexación vectorizada de la tabla de multiplicar; sin él,
+        como un `bytes.translate` por fragmento y las sumas (XOR) con enteros de Python. Ambas implementaciones
+        producen exactamente los mismos fragmentos.
+
+        :param data_shards: Número de fragmentos de datos (k).
+        :param parity_shards: Número de fragmentos de paridad (m).
+        :param use_numpy: Fuerza (True) o desactiva (False) NumPy; por defecto se usa si está instalado.
+        """
+        if data_shards < 1 or parity_shards < 0 or data_shards + parity_shards > 256:
+            raise ValueError(f'Parámetros de codificación no válidos: {data_shards}+{parity_shards}')
+        self.data_shards = data_shards
+        self.parity_shards = parity_shards
+        self.total_shards = data_shards + parity_shards
+        self.parity_matrix = [[gf_inv((data_shards + i) ^ j) for j in range(data_shards)]
+                              for i in range(parity_shards)]
+        self.use_numpy = np is not None if use_numpy is None else use_numpy
+        if self.use_numpy and np is None:
+            raise RuntimeError('NumPy no está instalado')
+
+    def row(self, index):
+        """
+        Devuelve la fila de la matriz generadora que produce el fragmento `index`.
+        """
+        if index < self.data_shards:
+            return [int(j == index) for j in range(self.data_shards)]
+        return self.parity_matrix[index - self.data_shards]
+
+    def split(self, data, cell_size):
+        """
+        Divide una franja del contenido en k celdas de `cell_size` bytes. En la última franja del fichero las
+        celdas se rellenan con ceros para poder calcular la paridad; sin paridad (k+0, un fichero repartido en
+        franjas) no hace falta y las últimas celdas quedan más cortas o vacías.
+
+        :param data: Como mucho `k * cell_size` bytes.
+        :return: Lista de k celdas.
+        """
+        if self.parity_shards:
+            data = data.ljust(self.data_shards * cell_size, b'\0')
+        return [data[i * cell_size:(i + 1) * cell_size] for i in range(self.data_shards)]
+
+    def encode(self, cells):
+        """
+        Calcula las celdas de paridad de una franja.
+
+        :param cells: Lista con las k celdas de datos, todas del mismo tamaño.
+        :return: Lista con las m celdas de paridad.
+        """
+        return self.combine(self.parity_matrix, cells)
+
+    def decode(self, cells):
+        """
+        Reconstruye las celdas de datos de una franja a partir de k celdas cualesquiera.
+
+        :param cells: Diccionario índice de fragmento -> celda, con al menos k entradas.
+        :return: Lista con las k celdas de datos.
+        :raises ValueError: Si hay menos de k celdas.
+        """
+        if len(cells) < self.data_shards:
+            raise ValueError(f'Se necesitan {self.data_shards} fragmentos y solo hay {len(cells)}')
+        indices = sorted(cells)[:self.data_shards]
+        if indices == list(range(self.data_shards)):  # Están todos los datos: no hay nada que calcular
+            return [cells[i] for i in indices]
+        matrix = invert_matrix([self.row(i) for i in indices])
+        return self.combine(matrix, [cells[i] for i in indices])
+
+    def combine(self, matrix, cells):
+        """
+        Multiplica una matriz por un vector de celdas: cada fila produce la suma (XOR) de las celdas
+        multiplicadas por sus coeficientes.
+
+        :param matrix: Lista de filas de coeficientes, una columna por celda.
+        :param cells: Lista de celdas del mismo tamaño.
+        :return: Lista de celdas, una por fila.
+        """
+        if not matrix:
+            return []
+        if self.use_numpy:
+            coefficients = np.array(matrix, dtype=np.uint8)
+            stacked = np.frombuffer(b''.join(cells), dtype=np.uint8).reshape(len(cells), -1)
+            products = MUL_ARRAY[coefficients[:, :, None], stacked[None, :, :]]
+            return [row.tobytes() for row in np.bitwise_xor.reduce(products, axis=1)]
+
+        size = len(cells[0])
+        results = []
+        for coefficients in matrix:
+            total = 0
+            for coefficient, cell in zip(coefficients, cells):
+                if coefficient == 1:
+                    total ^= int.from_bytes(cell, 'little')
+                elif coefficient:
+                    total ^= int.from_bytes(cell.translate(MUL_TABLES[coefficient]), 'little')
+            results.append(total.to_bytes(size, 'little'))
+        return results
@@ -0,0 +1,1215 @@
+import os
+import json
+import time
+import uuid
+import bisect
+import shutil
+import hashlib
+import logging
+import struct
+import sqlite3
+import threading
+from collections import namedtuple
+
+from chunking import chunk_id
+
+INDEX_NAME = '.index.sqlite'
+TMP_DIR = '.tmp'
+SEGMENTS_DIR = '.segments'
+TRASH_DIR = '.trash'
+MANIFESTS_DIR = '.manifests'
+READ_BLOCK_SIZE = 1024 * 1024
+MB = 1024 * 1024
+SEGMENT_SIZE = 64 * 1024 * 1024  # Tamaño a partir del cual se empieza un segmento nuevo
+RECORD_MAGIC = b'URFS'
+TOMBSTONE_MAGIC = b'URFD'  # Registro sin datos que marca como borrado un objeto de un segmento anterior
+RECORD_HEADER = struct.Struct('>4s32sHQ')  # Marca, hash, longitud del nombre, longitud de los datos
+
+# Ubicación de un objeto: fichero, offset de sus datos dentro de él y tamaño. Los objetos sueltos tienen offset 0.
+ObjectLocation = namedtuple('ObjectLocation', 'path offset size')
+# Fichero guardado por bloques: tamaño total y lista de (identificador de bloque, longitud) en orden.
+Manifest = namedtuple('Manifest', 'size chunks')
+
+
+def file_md5(path):
+    """
+    Calcula el hash MD5 de un fichero leyéndolo por bloques, sin cargarlo entero en memoria.
+
+    :param path: Ruta del fichero.
+    :return: Hash en formato hexadecimal.
+    """
+    hash_object = hashlib.md5()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(READ_BLOCK_SIZE)
+            if not data:
+                return hash_object.hexdigest()
+            hash_object.update(data)
+
+
+def fsync_dir(path):
+    """
+    Sincroniza un directorio con el disco para que un `rename` recién hecho en él sea persistente.
+
+    :param path: Ruta del directorio.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def scan_segment(path):
+    """
+    Recorre los registros de un segmento sin leer sus datos.
+
+    :param path: Ruta del segmento.
+    :return: Generador de tuplas (hash, nombre, offset de los datos, longitud, lápida). `lápida` es True para
+    los registros de borrado. Se detiene en el primer registro incompleto o dañado, que solo puede ser la cola
+    de una escritura interrumpida.
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        position = 0
+        while position + RECORD_HEADER.size <= size:
+            magic, hash, name_length, length = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+            data_offset = position + RECORD_HEADER.size + name_length
+            if magic not in (RECORD_MAGIC, TOMBSTONE_MAGIC) or data_offset + length > size:
+                return
+            name = f.read(name_length).decode()
+            yield hash.decode(), name, data_offset, length, magic == TOMBSTONE_MAGIC
+            position = data_offset + length
+            f.seek(position)
+
+
+class SegmentLog:
+    def __init__(self, path, segment_size=SEGMENT_SIZE):
+        """
+        Ficheros de segmento de solo añadido en los que se guardan juntos los objetos pequeños, para que no
+        ocupen un inodo cada uno. Cada registro lleva una cabecera con el hash, el nombre y la longitud,
+        seguida de los datos. Los borrados se registran añadiendo una lápida, sin tocar los datos, y el espacio
+        se recupera más tarde reescribiendo los segmentos (ver `Compactor`). Al abrir el segmento activo se
+        descarta una posible cola incompleta.
+
+        :param path: Directorio de los segmentos.
+        :param segment_size: Tamaño a partir del cual se empieza un segmento nuevo.
+        """
+        self.path = path
+        self.segment_size = segment_size
+        os.makedirs(path, exist_ok=True)
+        segments = self.segments()
+        self.open(segments[-1] if segments else self.segment_path(1))
+
+    def segments(self):
+        """
+        Devuelve las rutas de todos los segmentos, en orden de creación.
+        """
+        return sorted(os.path.join(self.path, name) for name in os.listdir(self.path) if name.endswith('.seg'))
+
+    def segment_path(self, number):
+        return os.path.join(self.path, f'{number:08d}.seg')
+
+    def open(self, path):
+        """
+        Abre un segmento para añadir registros, recortando la cola que no forme un registro completo.
+
+        :param path: Ruta del segmento.
+        """
+        end = 0
+        if os.path.exists(path):
+            for hash, name, offset, length, deleted in scan_segment(path):
+                end = offset + length
+        self.current = path
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+        if os.fstat(self.fd).st_size != end:
+            logging.warning(f"Segmento con un registro incompleto, se recorta --> {path}")
+            os.ftruncate(self.fd, end)
+        self.end = end
+
+    def append(self, hash, name, data):
+        """
+        Añade un objeto al segmento activo y lo sincroniza con el disco. Debe llamarse con el cerrojo del
+        almacenamiento tomado.
+
+        :param hash: Hash MD5 del contenido.
+        :param name: Nombre del objeto, que se guarda para poder reconstruir el índice.
+        :param data: Contenido del objeto.
+        :return: `ObjectLocation` de los datos dentro del segmento.
+        """
+        return self.write(RECORD_MAGIC, hash, name, data)
+
+    def tombstone(self, hash):
+        """
+        Añade una lápida que marca como borrado un objeto, para que no reaparezca al reconstruir el índice.
+        Debe llamarse con el cerrojo del almacenamiento tomado.
+
+        :param hash: Hash MD5 del contenido borrado.
+        """
+        self.write(TOMBSTONE_MAGIC, hash, '', b'')
+
+    def seal(self):
+        """
+        Cierra el segmento activo y empieza uno nuevo, de modo que el anterior se pueda compactar.
+        """
+        os.close(self.fd)
+        number = int(os.path.basename(self.current).split('.')[0]) + 1
+        self.open(self.segment_path(number))
+
+    def write(self, magic, hash, name, data):
+        if self.end >= self.segment_size:
+            self.seal()
+
+        encoded_name = name.encode()
+        record = RECORD_HEADER.pack(magic, hash.encode(), len(encoded_name), len(data)) + encoded_name + data
+        written = 0
+        while written < len(record):
+            written += os.pwrite(self.fd, record[written:], self.end + written)
+        os.fdatasync(self.fd)
+
+        location = ObjectLocation(self.current, self.end + RECORD_HEADER.size + len(encoded_name), len(data))
+        self.end += len(record)
+        return location
+
+
+class StorageIndex:
+    def __init__(self, storage_path):
+        """
+        Índice persistente de un FileManager: hash -> (ruta, tamaño, mtime, offset) de cada objeto y nombre -> hash.
+        Los objetos guardados en un segmento tienen offset; los que tienen fichero propio, no. Los ficheros
+        guardados por bloques tienen un manifiesto (hash -> tamaño y bloques) y cada bloque, que se guarda como
+        un objeto más sin nombre, lleva la cuenta de los manifiestos que lo usan.
+
+        Para la anti-entropía se guarda además, por cada objeto replicado, qué otros FileManager deberían tenerlo
+        y si se ha borrado (con la hora del cambio), de modo que cada par de réplicas compara solo lo que comparte.
+
+        Se guarda en una base de datos SQLite dentro del propio directorio de almacenamiento, de modo que
+        sobrevive a los reinicios. Si el índice no existe se construye una única vez recorriendo el árbol.
+
+        :param storage_path: Directorio de almacenamiento del FileManager.
+        """
+        self.storage_path = storage_path
+        self.lock = threading.Lock()
+        os.makedirs(storage_path, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(storage_path, INDEX_NAME), check_same_thread=False)
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS objects ('
+                            'hash TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL, mtime REAL NOT NULL, '
+                            'offset INTEGER)')
+            columns = [row[1] for row in self.db.execute('PRAGMA table_info(objects)')]
+            if 'offset' not in columns:  # Índice creado antes de que existieran los segmentos
+                self.db.execute('ALTER TABLE objects ADD COLUMN offset INTEGER')
+            self.db.execute('CREATE TABLE IF NOT EXISTS names (name TEXT PRIMARY KEY, hash TEXT NOT NULL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS names_hash ON names (hash)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS objects_path ON objects (path)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS manifests ('
+                            'hash TEXT PRIMARY KEY, size INTEGER NOT NULL, chunks TEXT NOT NULL)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, refs INTEGER NOT NULL)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS replicas ('
+                            'peer TEXT NOT NULL, hash TEXT NOT NULL, deleted INTEGER NOT NULL, updated REAL NOT NULL, '
+                            'PRIMARY KEY (peer, hash))')
+            self.db.execute('CREATE INDEX IF NOT EXISTS replicas_hash ON replicas (hash)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS peers (peer TEXT PRIMARY KEY, proxy TEXT NOT NULL)')
+
+        if not self.db.execute("SELECT 1 FROM meta WHERE key = 'built'").fetchone():
+            self.rebuild()
+
+    def rebuild(self):
+        """
+        Reconstruye el índice recorriendo el árbol de objetos y los segmentos. En el árbol cada fichero se llama
+        como su hash, así que no hace falta leerlo; los objetos sin nombre registrado usan el propio hash como
+        nombre. De los segmentos solo se leen las cabeceras de los registros, en orden, de forma que una lápida
+        anula los registros anteriores del mismo hash. Los manifiestos se leen de `<storage>/.manifests/` y con
+        ellos se recalculan las referencias de los bloques, que no reciben nombre.
+        """
+        logging.info(f"Construyendo índice de {self.storage_path}")
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM objects')
+            self.db.execute('DELETE FROM manifests')
+            self.db.execute('DELETE FROM chunks')
+            for dirpath, dirnames, filenames in os.walk(os.path.join(self.storage_path, MANIFESTS_DIR)):
+                for filename in filenames:
+                    with open(os.path.join(dirpath, filename)) as f:
+                        manifest = json.load(f)
+                    self.db.execute('INSERT OR REPLACE INTO manifests VALUES (?, ?, ?)',
+                                    (filename, manifest['size'], json.dumps(manifest['chunks'])))
+                    self.db.execute('INSERT OR IGNORE INTO names VALUES (?, ?)', (manifest['name'], filename))
+                    for chunk, length in manifest['chunks']:
+                        self.db.execute('INSERT OR IGNORE INTO chunks VALUES (?, 0)', (chunk,))
+                        self.db.execute('UPDATE chunks SET refs = refs + 1 WHERE id = ?', (chunk,))
+            for dirpath, dirnames, filenames in os.walk(self.storage_path):
+                dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+                if dirpath == self.storage_path:
+                    continue
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    stat = os.stat(path)
+                    self.db.execute('INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, NULL)',
+                                    (filename, path, stat.st_size, stat.st_mtime))
+                    self.db.execute('INSERT OR IGNORE INTO names SELECT ?, ? WHERE NOT EXISTS '
+                                    '(SELECT 1 FROM names WHERE hash = ?) AND NOT EXISTS '
+                                    '(SELECT 1 FROM chunks WHERE id = ?)', (filename, filename, filename, filename))
+            segments_path = os.path.join(self.storage_path, SEGMENTS_DIR)
+            segments = sorted(os.listdir(segments_path)) if os.path.isdir(segments_path) else []
+            for segment in segments:
+                path = os.path.join(segments_path, segment)
+                for hash, name, offset, length, deleted in scan_segment(path):
+                    if deleted:
+                        self.db.execute('DELETE FROM objects WHERE hash = ?', (hash,))
+                        self.db.execute('DELETE FROM names WHERE hash = ?', (hash,))
+                        continue
+                    self.db.execute('INSERT OR REPLACE INTO objects VALUES (?, ?, ?, 0, ?)', (hash, path, length, offset))
+                    if name:  # Los bloques se guardan sin nombre
+                        self.db.execute('INSERT OR IGNORE INTO names VALUES (?, ?)', (name, hash))
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('built', '1')")
+
+    def add(self, hash, path, name):
+        """
+        Registra (o actualiza) un objeto guardado en su propio fichero y su nombre.
+
+        :param hash: Hash MD5 del contenido.
+        :param path: Ruta del fichero en el almacenamiento.
+        :param name: Nombre con el que se subió el fichero, o None para un bloque.
+        """
+        stat = os.stat(path)
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, NULL)',
+                            (hash, path, stat.st_size, stat.st_mtime))
+            if name is not None:
+                self.db.execute('INSERT OR REPLACE INTO names VALUES (?, ?)', (name, hash))
+
+    def add_packed(self, hash, location, name):
+        """
+        Registra un objeto guardado dentro de un segmento y su nombre.
+
+        :param hash: Hash MD5 del contenido.
+        :param location: `ObjectLocation` de los datos en el segmento.
+        :param name: Nombre con el que se subió el fichero, o None para un bloque.
+        """
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO objects VALUES (?, ?, ?, 0, ?)',
+                            (hash, location.path, location.size, location.offset))
+            if name is not None:
+                self.db.execute('INSERT OR REPLACE INTO names VALUES (?, ?)', (name, hash))
+
+    def add_manifest(self, hash, size, chunks, name):
+        """
+        Registra un fichero guardado por bloques y su nombre. Las referencias de los bloques se cuentan aparte,
+        con `ref_chunk`/`add_chunk`.
+
+        :param hash: Hash MD5 del contenido completo.
+        :param size: Tamaño del fichero.
+        :param chunks: Lista de (identificador de bloque, longitud).
+        :param name: Nombre con el que se subió el fichero.
+        """
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO manifests VALUES (?, ?, ?)', (hash, size, json.dumps(chunks)))
+            self.db.execute('INSERT OR REPLACE INTO names VALUES (?, ?)', (name, hash))
+
+    def ref_chunk(self, chunk):
+        """
+        Añade una referencia a un bloque si ya está guardado.
+
+        :param chunk: Identificador del bloque.
+        :return: True si el bloque existía, False si hay que guardarlo.
+        """
+        with self.lock, self.db:
+            return self.db.execute('UPDATE chunks SET refs = refs + 1 WHERE id = ?', (chunk,)).rowcount > 0
+
+    def add_chunk(self, chunk):
+        """
+        Registra un bloque recién guardado con una referencia.
+        """
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO chunks VALUES (?, 1)', (chunk,))
+
+    def unref_chunk(self, chunk):
+        """
+        Quita una referencia a un bloque.
+
+        :param chunk: Identificador del bloque.
+        :return: Referencias restantes. Con 0 el bloque deja de estar registrado y se puede borrar.
+        """
+        with self.lock, self.db:
+            self.db.execute('UPDATE chunks SET refs = refs - 1 WHERE id = ?', (chunk,))
+            row = self.db.execute('SELECT refs FROM chunks WHERE id = ?', (chunk,)).fetchone()
+            if row and row[0] > 0:
+                return row[0]
+            self.db.execute('DELETE FROM chunks WHERE id = ?', (chunk,))
+            return 0
+
+    def lookup(self, hash):
+        """
+        Busca un objeto por su hash. Si el fichero ha desaparecido o ha cambiado desde que se registró (o, para
+        un objeto de un segmento, si el segmento ya no llega hasta el final de sus datos), la entrada se descarta.
+
+        :param hash: Hash MD5 del contenido.
+        :return: `ObjectLocation` del objeto, `Manifest` si está guardado por bloques, o None si no está.
+        """
+        with self.lock:
+            row = self.db.execute('SELECT path, size, mtime, offset FROM objects WHERE hash = ?', (hash,)).fetchone()
+            if not row:
+                manifest = self.db.execute('SELECT size, chunks FROM manifests WHERE hash = ?', (hash,)).fetchone()
+                if manifest:
+                    return Manifest(manifest[0], [tuple(chunk) for chunk in json.loads(manifest[1])])
+        if not row:
+            return None
+
+        path, size, mtime, offset = row
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            stat = None
+        if offset is None:
+            valid = stat and stat.st_size == size and stat.st_mtime == mtime
+        else:
+            valid = stat and stat.st_size >= offset + size  # Los segmentos crecen, así que no se compara su mtime
+        if not valid:
+            logging.warning(f"Entrada del índice obsoleta, se descarta --> {hash} {path}")
+            self.remove(hash)
+            self.drop_replicas(hash)  # Sin lápida: las otras réplicas verán que falta y lo volverán a enviar
+            return None
+        return ObjectLocation(path, offset or 0, size)
+
+    def relocate(self, hash, location):
+        """
+        Cambia la ubicación de un objeto de un segmento, conservando sus nombres.
+
+        :param hash: Hash MD5 del contenido.
+        :param location: Nueva `ObjectLocation` de los datos.
+        """
+        with self.lock, self.db:
+            self.db.execute('UPDATE objects SET path = ?, size = ?, offset = ? WHERE hash = ?',
+                            (location.path, location.size, location.offset, hash))
+
+    def locations(self, path):
+        """
+        Devuelve los objetos vivos guardados en un segmento.
+
+        :param path: Ruta del segmento.
+        :return: Diccionario offset -> hash.
+        """
+        with self.lock:
+            rows = self.db.execute('SELECT offset, hash FROM objects WHERE path = ?', (path,)).fetchall()
+        return dict(rows)
+
+    def link(self, hash, name):
+        """
+        Registra un nombre más para un objeto. Cada nombre es una referencia al objeto.
+
+        :param hash: Hash MD5 del contenido.
+        :param name: Nombre que se añade.
+        :return: True si el nombre queda apuntando al objeto, False si ya se usa para otro contenido.
+        """
+        with self.lock, self.db:
+            row = self.db.execute('SELECT hash FROM names WHERE name = ?', (name,)).fetchone()
+            if row:
+                return row[0] == hash
+            self.db.execute('INSERT INTO names VALUES (?, ?)', (name, hash))
+            return True
+
+    def unlink(self, hash, name=None):
+        """
+        Elimina un nombre de un objeto: el indicado o, si no se indica, el más reciente.
+
+        :param hash: Hash MD5 del contenido.
+        :param name: Nombre que se elimina, o None para el más reciente.
+        :return: Tupla (nombre eliminado, referencias restantes). Si el objeto no tenía nombres se devuelve el
+        propio hash como nombre y 0 referencias. Si no tiene el nombre indicado se devuelve None como nombre.
+        """
+        with self.lock, self.db:
+            if name is None:
+                row = self.db.execute('SELECT rowid, name FROM names WHERE hash = ? ORDER BY rowid DESC LIMIT 1',
+                                      (hash,)).fetchone()
+            else:
+                row = self.db.execute('SELECT rowid, name FROM names WHERE hash = ? AND name = ?',
+                                      (hash, name)).fetchone()
+            if not row:
+                if name is not None:
+                    return None, self.db.execute('SELECT COUNT(*) FROM names WHERE hash = ?', (hash,)).fetchone()[0]
+                return hash, 0
+            self.db.execute('DELETE FROM names WHERE rowid = ?', (row[0],))
+            remaining = self.db.execute('SELECT COUNT(*) FROM names WHERE hash = ?', (hash,)).fetchone()[0]
+            return row[1], remaining
+
+    def names(self, hash):
+        """
+        Devuelve todos los nombres registrados para un objeto, en orden de creación.
+        """
+        with self.lock:
+            return [row[0] for row in self.db.execute('SELECT name FROM names WHERE hash = ? ORDER BY rowid', (hash,))]
+
+    def name(self, hash):
+        """
+        Devuelve el nombre registrado para un objeto.
+
+        :param hash: Hash MD5 del contenido.
+        :return: Nombre del fichero, o el propio hash si no tiene nombre registrado.
+        """
+        with self.lock:
+            row = self.db.execute('SELECT name FROM names WHERE hash = ?', (hash,)).fetchone()
+        return row[0] if row else hash
+
+    def bump(self, **counters):
+        """
+        Incrementa contadores persistentes guardados en la tabla `meta`.
+
+        :param counters: Pares nombre -> incremento.
+        """
+        with self.lock, self.db:
+            for key, amount in counters.items():
+                row = self.db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+                value = int(row[0]) if row else 0
+                self.db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, str(value + amount)))
+
+    def counter(self, key):
+        """
+        Devuelve el valor de un contador persistente, o 0 si no existe.
+
+        :param key: Nombre del contador.
+        """
+        with self.lock:
+            row = self.db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return int(row[0]) if row else 0
+
+    def total_size(self):
+        """
+        Devuelve la suma de los tamaños de todos los objetos del índice.
+        """
+        with self.lock:
+            return self.db.execute('SELECT COALESCE(SUM(size), 0) FROM objects').fetchone()[0]
+
+    def remove(self, hash):
+        """
+        Elimina un objeto o un manifiesto y sus nombres del índice (no borra el fichero ni toca los bloques).
+
+        :param hash: Hash MD5 del contenido.
+        """
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM objects WHERE hash = ?', (hash,))
+            self.db.execute('DELETE FROM manifests WHERE hash = ?', (hash,))
+            self.db.execute('DELETE FROM names WHERE hash = ?', (hash,))
+
+    def add_replicas(self, hash, peers):
+        """
+        Registra que un objeto guardado aquí debe estar también en otros FileManager. Si se había borrado, la
+        entrada vuelve a estar viva.
+
+        :param hash: Hash MD5 del contenido.
+        :param peers: Diccionario nombre de la identidad -> proxy en texto de los otros FileManager.
+        """
+        now = time.time()
+        with self.lock, self.db:
+            for peer, proxy in peers.items():
+                self.db.execute('INSERT OR REPLACE INTO replicas VALUES (?, ?, 0, ?)', (peer, hash, now))
+                self.db.execute('INSERT OR REPLACE INTO peers VALUES (?, ?)', (peer, proxy))
+
+    def tombstone_replicas(self, hash):
+        """
+        Marca como borrado un objeto en todas sus entradas de réplica, con la hora del borrado.
+        """
+        with self.lock, self.db:
+            self.db.execute('UPDATE replicas SET deleted = 1, updated = ? WHERE hash = ?', (time.time(), hash))
+
+    def drop_replicas(self, hash):
+        """
+        Olvida las entradas de réplica de un objeto cuyos datos se han perdido, sin dejar lápida.
+        """
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM replicas WHERE hash = ?', (hash,))
+
+    def purge_replicas(self, before):
+        """
+        Elimina las lápidas de réplica anteriores a `before` (segundos desde la época).
+
+        :return: Número de lápidas eliminadas.
+        """
+        with self.lock, self.db:
+            return self.db.execute('DELETE FROM replicas WHERE deleted = 1 AND updated < ?', (before,)).rowcount
+
+    def replica_peers(self, hash=None):
+        """
+        Devuelve los FileManager con los que se comparten objetos, o solo los que deberían tener uno vivo.
+
+        :param hash: Hash MD5 del contenido, o None para todos los FileManager con alguna entrada.
+        :return: Diccionario nombre de la identidad -> proxy en texto.
+        """
+        with self.lock:
+            if hash is None:
+                return dict(self.db.execute('SELECT peer, proxy FROM peers WHERE peer IN '
+                                            '(SELECT DISTINCT peer FROM replicas)'))
+            return dict(self.db.execute('SELECT peers.peer, proxy FROM replicas JOIN peers USING (peer) '
+                                        'WHERE hash = ? AND deleted = 0', (hash,)))
+
+    def replica_rows(self, peer, prefix):
+        """
+        Devuelve, ordenadas por hash, las entradas de réplica compartidas con `peer` cuyo hash empieza por
+        `prefix`. Como la clave primaria es (peer, hash), es un recorrido de rango sobre el índice.
+
+        :return: Lista de tuplas (hash, borrado, hora del último cambio).
+        """
+        with self.lock:
+            return self.db.execute('SELECT hash, deleted, updated FROM replicas WHERE peer = ? AND hash >= ? AND '
+                                   'hash < ? ORDER BY hash', (peer, prefix, prefix + '~')).fetchall()
+
+    def merkle_nodes(self, peer, prefixes):
+        """
+        Calcula los nodos del árbol de Merkle de las entradas compartidas con `peer`: cada prefijo de hash es
+        un nodo cuyo resumen es el MD5 de los hashes de sus entradas, en orden y con su estado (vivo o borrado).
+        La hora del cambio no entra en el resumen, ya que cada FileManager registra la suya.
+
+        :param peer: Nombre de la identidad del otro FileManager.
+        :param prefixes: Prefijos hexadecimales de los nodos ('' es la raíz).
+        :return: Lista de tuplas (resumen, número de entradas), una por prefijo.
+        """
+        nodes = []
+        for prefix in prefixes:
+            digest = hashlib.md5()
+            rows = self.replica_rows(peer, prefix)
+            for hash, deleted, updated in rows:
+                digest.update(f"{hash}{'-' if deleted else '+'}".encode())
+            nodes.append((digest.hexdigest(), len(rows)))
+        return nodes
+
+
+class ObjectStore:
+    def __init__(self, storage_path, pack_threshold=0, chunker=None):
+        """
+        Almacenamiento direccionado por contenido. Cada objeto se guarda en `<storage>/ab/cd/<hash>`, de modo
+        que ningún directorio crece demasiado, y los nombres de los ficheros se guardan solo en el índice.
+
+        Las subidas se escriben en `<storage>/.tmp/` y se confirman con un `rename` atómico, así que un fallo a
+        mitad de subida nunca deja un fichero incompleto en su ruta definitiva. Al arrancar se descartan los
+        temporales que hayan quedado y se migran al árbol los ficheros que estén sueltos en la raíz.
+
+        Los objetos de como mucho `pack_threshold` bytes no tienen fichero propio: se añaden a los segmentos de
+        `<storage>/.segments/` y se leen con `pread` a partir de su offset.
+
+        Con un `chunker` los ficheros mayores se dividen en bloques definidos por su contenido: cada bloque
+        distinto se guarda una sola vez (en un segmento o con fichero propio, según su tamaño) y el fichero
+        queda como un manifiesto con la lista de sus bloques, copiado en `<storage>/.manifests/` para poder
+        reconstruir el índice.
+
+        :param storage_path: Directorio de almacenamiento del FileManager.
+        :param pack_threshold: Tamaño máximo de los objetos que se guardan en segmentos (0 = ninguno).
+        :param chunker: `chunking.Chunker` con el que dividir los ficheros, o None para guardarlos enteros.
+        """
+        self.storage_path = storage_path
+        self.tmp_path = os.path.join(storage_path, TMP_DIR)
+        self.manifests_path = os.path.join(storage_path, MANIFESTS_DIR)
+        self.pack_threshold = pack_threshold
+        self.chunker = chunker
+        self.lock = threading.Lock()
+        self.index = StorageIndex(storage_path)
+        self.segments = SegmentLog(os.path.join(storage_path, SEGMENTS_DIR))
+        self.segment_hashes = {}  # Ruta de segmento -> (tamaño, hashes de sus registros de objeto)
+        self.trash_path = os.path.join(storage_path, TRASH_DIR)
+        os.makedirs(self.trash_path, exist_ok=True)
+
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+        self.migrate()
+
+    def object_path(self, hash):
+        """
+        Devuelve la ruta definitiva de un objeto dentro del árbol.
+
+        :param hash: Hash MD5 del contenido.
+        """
+        return os.path.join(self.storage_path, hash[:2], hash[2:4], hash)
+
+    def manifest_path(self, hash):
+        """
+        Devuelve la ruta de la copia en disco del manifiesto de un fichero guardado por bloques.
+
+        :param hash: Hash MD5 del contenido.
+        """
+        return os.path.join(self.manifests_path, hash[:2], hash)
+
+    def create_temp(self):
+        """
+        Devuelve una ruta nueva en el directorio de temporales en la que escribir una subida.
+        """
+        return os.path.join(self.tmp_path, str(uuid.uuid4()))
+
+    def commit(self, temp_path, hash, name):
+        """
+        Confirma una subida moviendo el temporal a su ruta definitiva. El fichero temporal debe estar cerrado.
+        Si es un objeto pequeño, su contenido se añade a un segmento y el temporal se elimina.
+
+        :param temp_path: Ruta del temporal con el contenido completo.
+        :param hash: Hash MD5 del contenido.
+        :param name: Nombre con el que se subió el fichero.
+        :return: True si el objeto se ha guardado, False si ya existía (en ese caso el temporal se elimina).
+        """
+        if self.chunker and os.path.getsize(temp_path) > self.pack_threshold:
+            return self.commit_chunked(temp_path, hash, name)
+
+        with self.lock:
+            if self.index.lookup(hash):
+                os.remove(temp_path)
+                return False
+
+            if os.path.getsize(temp_path) <= self.pack_threshold:
+                with open(temp_path, 'rb') as f:
+                    self.index.add_packed(hash, self.segments.append(hash, name, f.read()), name)
+                os.remove(temp_path)
+                return True
+
+            path = self.object_path(hash)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.rename(temp_path, path)
+            fsync_dir(os.path.dirname(path))
+            self.index.add(hash, path, name)
+            return True
+
+    def commit_chunked(self, temp_path, hash, name):
+        """
+        Confirma una subida dividiéndola en bloques. Los bloques que ya estaban guardados solo suman una
+        referencia; los nuevos se guardan como objetos sin nombre. Los bytes que no se han escrito por estar
+        repetidos se suman a `bytes_saved`.
+
+        :param temp_path: Ruta del temporal con el contenido completo.
+        :param hash: Hash MD5 del contenido.
+        :param name: Nombre con el que se subió el fichero.
+        :return: True si el fichero se ha guardado, False si ya existía (el temporal se elimina siempre).
+        """
+        if self.index.lookup(hash):
+            os.remove(temp_path)
+            return False
+
+        start = time.perf_counter()
+        chunks = []
+        saved = 0
+        with open(temp_path, 'rb') as f:
+            for data in self.chunker.split(f):
+                chunk = chunk_id(data)
+                with self.lock:
+                    if self.index.ref_chunk(chunk):
+                        saved += len(data)
+                    else:
+                        self.store_chunk(chunk, data)
+                chunks.append((chunk, len(data)))
+        os.remove(temp_path)
+        size = sum(length for _, length in chunks)
+
+        path = self.manifest_path(hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({'size': size, 'chunks': chunks, 'name': name}, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        with self.lock:
+            if self.index.lookup(hash):  # Otra subida del mismo contenido se ha adelantado
+                for chunk, length in chunks:
+                    self.release_chunk(chunk)
+                return False
+            self.index.add_manifest(hash, size, chunks, name)
+        if saved:
+            self.index.bump(bytes_saved=saved)
+
+        elapsed = time.perf_counter() - start
+        logging.info(f"Fichero dividido en {len(chunks)} bloques ({saved} bytes repetidos) a "
+                     f"{size / MB / max(elapsed, 1e-9):.2f} MB/s --> {name} {hash}")
+        return True
+
+    def store_chunk(self, chunk, data):
+        """
+        Guarda un bloque nuevo con una referencia. Debe llamarse con el cerrojo tomado.
+
+        :param chunk: Identificador del bloque.
+        :param data: Contenido del bloque.
+        """
+        if len(data) <= self.pack_threshold:
+            self.index.add_packed(chunk, self.segments.append(chunk, '', data), None)
+        else:
+            temp_path = self.create_temp()
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            path = self.object_path(chunk)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.rename(temp_path, path)
+            fsync_dir(os.path.dirname(path))
+            self.index.add(chunk, path, None)
+        self.index.add_chunk(chunk)
+
+    def release_chunk(self, chunk):
+        """
+        Quita una referencia a un bloque y, si era la última, lo descarta como un objeto eliminado. Debe
+        llamarse con el cerrojo tomado.
+
+        :param chunk: Identificador del bloque.
+        """
+        if self.index.unref_chunk(chunk):
+            return
+        location = self.index.lookup(chunk)
+        if location:
+            self.discard(chunk, location)
+
+    def discard(self, hash, location):
+        """
+        Saca un objeto del índice y deja sus datos para el `Compactor`. Debe llamarse con el cerrojo tomado.
+
+        :param hash: Hash del objeto o identificador del bloque.
+        :param location: `ObjectLocation` del objeto.
+        """
+        self.index.remove(hash)
+        if os.path.dirname(location.path) == self.segments.path:
+            self.segments.tombstone(hash)
+        else:
+            os.rename(location.path, os.path.join(self.trash_path, str(uuid.uuid4())))
+
+    def put(self, hash, data, name):
+        """
+        Guarda un objeto recibido entero en memoria, sin pasar por un temporal si cabe en un segmento.
+
+        :param hash: Hash MD5 del contenido.
+        :param data: Contenido del objeto.
+        :param name: Nombre con el que se subió el fichero.
+        :return: True si el objeto se ha guardado, False si ya existía.
+        """
+        if len(data) > self.pack_threshold:
+            temp_path = self.create_temp()
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            return self.commit(temp_path, hash, name)
+
+        with self.lock:
+            if self.index.lookup(hash):
+                return False
+            self.index.add_packed(hash, self.segments.append(hash, name, data), name)
+            return True
+
+    def lookup(self, hash):
+        """
+        Busca un objeto por su hash.
+
+        :param hash: Hash MD5 del contenido.
+        :return: `ObjectLocation` o `Manifest` del objeto, o None si no está.
+        """
+        return self.index.lookup(hash)
+
+    def read(self, location):
+        """
+        Lee entero un objeto a partir de su ubicación.
+
+        :param location: `ObjectLocation` o `Manifest` devuelto por `lookup`.
+        :return: Contenido del objeto.
+        """
+        reader = self.open(location)
+        try:
+            return reader.pread(reader.size, 0)
+        finally:
+            reader.close()
+
+    def open(self, location):
+        """
+        Abre un objeto para leerlo por rangos.
+
+        :param location: `ObjectLocation` o `Manifest` devuelto por `lookup`.
+        :return: Lector con el atributo `size` y los métodos `pread(size, offset)` y `close()`.
+        :raises FileNotFoundError: Si falta algún bloque de un manifiesto.
+        """
+        if isinstance(location, Manifest):
+            return ManifestReader(self, location)
+        return ObjectReader(location)
+
+    def link(self, hash, name):
+        """
+        Añade un nombre (alias) a un objeto ya guardado, sin tocar sus datos.
+
+        :param hash: Hash MD5 del contenido.
+        :param name: Nombre que se añade.
+        :return: Tamaño del objeto si el nombre queda apuntando a él, o None si el nombre ya se usa para otro
+        contenido.
+        :raises FileNotFoundError: Si el objeto no está en el almacenamiento.
+        """
+        with self.lock:
+            location = self.index.lookup(hash)
+            if not location:
+                raise FileNotFoundError(hash)
+            if not self.index.link(hash, name):
+                return None
+            return location.size
+
+    def record_upload(self, size, duplicate):
+        """
+        Contabiliza una subida terminada para las estadísticas de deduplicación.
+
+        :param size: Tamaño en bytes del contenido subido.
+        :param duplicate: True si el contenido ya estaba guardado y no se ha almacenado de nuevo.
+        """
+        if duplicate:
+            self.index.bump(uploads=1, duplicates=1, bytes_saved=size)
+        else:
+            self.index.bump(uploads=1)
+
+    def stats(self):
+        """
+        Devuelve las estadísticas de deduplicación de este almacenamiento.
+
+        :return: Diccionario con `uploads`, `duplicates`, `bytes_stored`, `bytes_saved` y `bytes_reclaimed`.
+        """
+        return {
+            'uploads': self.index.counter('uploads'),
+            'duplicates': self.index.counter('duplicates'),
+            'bytes_stored': self.index.total_size(),
+            'bytes_saved': self.index.counter('bytes_saved'),
+            'bytes_reclaimed': self.index.counter('bytes_reclaimed'),
+        }
+
+    def remove(self, hash, name=None):
+        """
+        Elimina un nombre de un objeto, el indicado o el más reciente. Cuando el objeto se queda sin nombres sale del índice, pero
+        sus datos no se borran aquí: un objeto de un segmento recibe una lápida y un fichero propio se mueve a
+        `<storage>/.trash/`. El `Compactor` recupera después el espacio en segundo plano. Un fichero guardado
+        por bloques suelta una referencia de cada bloque, y los que se quedan sin ninguna se descartan igual.
+        Las entradas de réplica del objeto se quedan como lápidas, para que la anti-entropía propague el borrado.
+
+        :param hash: Hash MD5 del contenido.
+        :param name: Nombre que se elimina, o None para el más reciente.
+        :return: Nombre eliminado, o None si el objeto no existía o no tenía ese nombre.
+        """
+        with self.lock:
+            location = self.index.lookup(hash)
+            if not location:
+                return None
+            name, remaining = self.index.unlink(hash, name)
+            if name is None or remaining:
+                return name
+            self.index.tombstone_replicas(hash)
+            if isinstance(location, Manifest):
+                self.index.remove(hash)
+                os.remove(self.manifest_path(hash))
+                for chunk, length in location.chunks:
+                    self.release_chunk(chunk)
+            else:
+                self.discard(hash, location)
+            return name
+
+    def empty_trash(self, throttle):
+        """
+        Borra del disco los ficheros de los objetos eliminados.
+
+        :param throttle: `Throttle` que limita el ritmo de E/S.
+        :return: Bytes recuperados.
+        """
+        reclaimed = 0
+        for name in os.listdir(self.trash_path):
+            path = os.path.join(self.trash_path, name)
+            size = os.path.getsize(path)
+            os.remove(path)
+            reclaimed += size
+            throttle.consume(size)
+        return reclaimed
+
+    def segment_usage(self, path):
+        """
+        Mide cuánto de un segmento sigue en uso. Cada registro vivo cuenta entero: cabecera, nombre y datos.
+
+        :param path: Ruta del segmento.
+        :return: Tupla (bytes vivos, tamaño del segmento).
+        """
+        size = os.path.getsize(path)
+        live = sum(RECORD_HEADER.size + len(name.encode()) + length
+                   for _, name, _, length, _ in self.live_records(path))
+        return live, size
+
+    def record_hashes(self, path):
+        """
+        Devuelve los hashes de los registros de objeto (no las lápidas) de un segmento, vivos o no. Se guardan
+        en memoria mientras el segmento no cambie de tamaño.
+
+        :param path: Ruta del segmento.
+        """
+        size = os.path.getsize(path)
+        cached = self.segment_hashes.get(path)
+        if cached and cached[0] == size:
+            return cached[1]
+        hashes = {hash for hash, _, _, _, deleted in scan_segment(path) if not deleted}
+        self.segment_hashes[path] = (size, hashes)
+        return hashes
+
+    def live_records(self, path):
+        """
+        Recorre los registros de un segmento que siguen en uso: objetos a los que apunta el índice y lápidas
+        de objetos no indexados de los que aún queda un registro en un segmento anterior, que reaparecería al
+        reconstruir el índice. Las demás lápidas ya no anulan nada y se descartan.
+
+        :param path: Ruta del segmento.
+        :return: Generador de tuplas como las de `scan_segment`.
+        """
+        live = self.index.locations(path)
+        older = None
+        for record in scan_segment(path):
+            hash, name, offset, length, deleted = record
+            if deleted:
+                if self.index.lookup(hash):
+                    continue
+                if older is None:
+                    older = set().union(*(self.record_hashes(segment) for segment in self.segments.segments()
+                                          if segment < path))
+                if hash in older:
+                    yield record
+            elif live.get(offset) == hash:
+                yield record
+
+    def compact(self, path, throttle):
+        """
+        Reescribe un segmento copiando al segmento activo solo sus registros vivos, y después lo borra.
+        Cada objeto se cambia de ubicación en el índice con el cerrojo tomado, así que las lecturas y los
+        borrados pueden continuar mientras tanto; los Downloader que ya tuvieran abierto el segmento siguen
+        leyendo de él hasta que lo cierran.
+
+        :param path: Ruta de un segmento que no sea el activo.
+        :param throttle: `Throttle` que limita el ritmo de E/S.
+        :return: Bytes recuperados.
+        """
+        size = os.path.getsize(path)
+        copied = 0
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            for hash, name, offset, length, deleted in self.live_records(path):
+                data = os.pread(fd, length, offset)
+                with self.lock:
+                    if deleted:
+                        if not self.index.lookup(hash):
+                            self.segments.tombstone(hash)
+                    elif self.index.lookup(hash) == ObjectLocation(path, offset, length):
+                        self.index.relocate(hash, self.segments.append(hash, name, data))
+                copied += RECORD_HEADER.size + len(name.encode()) + length
+                throttle.consume(2 * length)  # Lectura y escritura
+        finally:
+            os.close(fd)
+
+        with self.lock:
+            if self.index.locations(path):  # No debería ocurrir: solo se escribe en el segmento activo
+                logging.error(f"El segmento sigue teniendo objetos vivos, no se borra --> {path}")
+                return 0
+            os.remove(path)
+            self.segment_hashes.pop(path, None)
+        return max(size - copied, 0)
+
+    def migrate(self):
+        """
+        Mueve al árbol direccionado por contenido los ficheros que estén sueltos en la raíz del almacenamiento
+        (la disposición anterior), conservando su nombre en el índice. Los duplicados se eliminan.
+        """
+        for filename in os.listdir(self.storage_path):
+            path = os.path.join(self.storage_path, filename)
+            if filename.startswith('.') or not os.path.isfile(path):
+                continue
+            hash = file_md5(path)
+            temp_path = self.create_temp()
+            os.rename(path, temp_path)
+            if self.commit(temp_path, hash, filename):
+                logging.info(f"Fichero migrado al almacenamiento por contenido --> {filename} {hash}")
+            else:
+                logging.warning(f"Fichero duplicado eliminado durante la migración --> {filename} {hash}")
+
+
+class ObjectReader:
+    def __init__(self, location):
+        """
+        Lector de un objeto guardado de una pieza, con fichero propio o dentro de un segmento.
+
+        :param location: `ObjectLocation` del objeto.
+        """
+        self.fd = os.open(location.path, os.O_RDONLY)
+        self.base = location.offset
+        self.size = location.size
+
+    def pread(self, size, offset):
+        """
+        Lee `size` bytes a partir de `offset` (relativo al objeto), sin pasar del final del objeto.
+        """
+        size = max(min(size, self.size - offset), 0)
+        return os.pread(self.fd, size, self.base + offset)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ManifestReader:
+    def __init__(self, store, manifest):
+        """
+        Lector de un fichero guardado por bloques. Localiza los bloques al abrirlo, para que la descarga no
+        dependa del índice mientras dura, y abre cada uno solo cuando se lee de él (abrirlos todos a la vez
+        podría agotar los descriptores con ficheros de miles de bloques). Si mientras tanto el compactador ha
+        movido un bloque y borrado su segmento, se vuelve a localizar en el índice.
+
+        :param store: `ObjectStore` que contiene los bloques.
+        :param manifest: `Manifest` del fichero.
+        :raises FileNotFoundError: Si falta algún bloque.
+        """
+        self.store = store
+        self.size = manifest.size
+        self.chunks = [chunk for chunk, length in manifest.chunks]
+        self.locations = []
+        self.starts = []
+        position = 0
+        for chunk, length in manifest.chunks:
+            location = store.lookup(chunk)
+            if not isinstance(location, ObjectLocation):
+                raise FileNotFoundError(chunk)
+            self.locations.append(location)
+            self.starts.append(position)
+            position += length
+        self.readers = {}
+
+    def pread(self, size, offset):
+        """
+        Lee `size` bytes a partir de `offset`, juntando los trozos de los bloques que abarque el rango.
+        """
+        end = min(offset + size, self.size)
+        parts = []
+        i = bisect.bisect_right(self.starts, offset) - 1
+        while offset < end:
+            if i not in self.readers:
+                self.readers[i] = self.open_chunk(i)
+            start = self.starts[i]
+            data = self.readers[i].pread(end - offset, offset - start)
+            parts.append(data)
+            offset += len(data)
+            i += 1
+        return b''.join(parts)
+
+    def open_chunk(self, i):
+        """
+        Abre el bloque `i` en la ubicación registrada al abrir el fichero o, si ya no existe porque se ha
+        compactado su segmento, en la actual. La segunda búsqueda se hace con el cerrojo del almacenamiento
+        tomado, de modo que el compactador no puede borrar el segmento entre la búsqueda y la apertura.
+
+        :raises FileNotFoundError: Si el bloque ya no está en el almacenamiento.
+        """
+        try:
+            return ObjectReader(self.locations[i])
+        except FileNotFoundError:
+            pass
+        with self.store.lock:
+            location = self.store.index.lookup(self.chunks[i])
+            if not isinstance(location, ObjectLocation):
+                raise FileNotFoundError(self.chunks[i])
+            self.locations[i] = location
+            return ObjectReader(location)
+
+    def close(self):
+        for reader in self.readers.values():
+            reader.close()
+        self.readers.clear()
+
+
+class Throttle:
+    def __init__(self, rate):
+        """
+        Limita el ritmo de E/S de una o varias tareas en segundo plano a `rate` bytes por segundo en total. Se
+        puede compartir entre hilos, y el tiempo sin actividad no se acumula para ráfagas posteriores.
+
+        :param rate: Bytes por segundo permitidos (0 = sin límite).
+        """
+        self.rate = rate
+        self.start = time.monotonic()
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def consume(self, nbytes):
+        """
+        Contabiliza `nbytes` de E/S y espera lo necesario para no superar el ritmo.
+        """
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            if self.used / self.rate < now - self.start:  # Ha estado parado: se empieza a contar de nuevo
+                self.start = now
+                self.used = 0
+            self.used += nbytes
+            ahead = self.used / self.rate - (now - self.start)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+class Compactor:
+    def __init__(self, store, interval, live_ratio, bandwidth, min_reclaim=0):
+        """
+        Tarea en segundo plano que recupera el espacio de los objetos eliminados: vacía la papelera y reescribe
+        los segmentos cuya fracción de datos vivos ha bajado de `live_ratio`, siempre que así se recuperen al
+        menos `min_reclaim` bytes (los que no tienen nada vivo se borran sin más). Toda la E/S se limita a
+        `bandwidth` bytes por segundo para no competir con las transferencias.
+
+        :param store: `ObjectStore` que se compacta.
+        :param interval: Segundos entre pasadas.
+        :param live_ratio: Fracción de datos vivos por debajo de la cual se reescribe un segmento.
+        :param bandwidth: Bytes por segundo de E/S permitidos (0 = sin límite).
+        :param min_reclaim: Bytes recuperables por debajo de los cuales no merece la pena reescribir un segmento.
+        """
+        self.store = store
+        self.interval = interval
+        self.live_ratio = live_ratio
+        self.min_reclaim = min_reclaim
+        self.bandwidth = bandwidth
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def loop(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception:
+                logging.exception("Error durante la compactación")
+
+    def run_once(self):
+        """
+        Hace una pasada completa de recuperación de espacio.
+
+        :return: Bytes recuperados.
+        """
+        throttle = Throttle(self.bandwidth)
+        reclaimed = self.store.empty_trash(throttle)
+        compacted = 0
+        for path in self.store.segments.segments():
+            if path == self.store.segments.current or self.stopped.is_set():
+                continue
+            if self.worth_compacting(path):
+                reclaimed += self.store.compact(path, throttle)
+                compacted += 1
+        # El segmento activo se mira al final, cuando sus lápidas ya no anulan registros que acaban de compactarse.
+        # Si tiene mucho espacio sin uso se cierra para compactarlo en la misma pasada.
+        with self.store.lock:
+            sealed = self.store.segments.current
+            if not self.store.segments.end or not self.worth_compacting(sealed):
+                sealed = None
+            else:
+                self.store.segments.seal()
+        if sealed and not self.stopped.is_set():
+            reclaimed += self.store.compact(sealed, throttle)
+            compacted += 1
+
+        if reclaimed or compacted:
+            self.store.index.bump(bytes_reclaimed=reclaimed, segments_compacted=compacted)
+            logging.info(f"Compactación terminada --> {compacted} segmentos, {reclaimed} bytes recuperados")
+        return reclaimed
+
+    def worth_compacting(self, path):
+        """
+        Decide si se reescribe un segmento: no debe tener nada vivo, o bien tener menos de `live_ratio` de
+        datos vivos y al menos `min_reclaim` bytes recuperables.
+
+        :param path: Ruta del segmento.
+        """
+        live, size = self.store.segment_usage(path)
+        if not live:
+            return size > 0
+        return live < self.live_ratio * size and size - live >= self.min_reclaim
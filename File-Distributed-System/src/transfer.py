@@ -0,0 +1,754 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import deque
+
+from util import get_max_chunk_size
+from delta import compute_delta
+
+MIN_CHUNK_SIZE = 16 * 1024
+RTT_FACTOR = 16  # Cada llamada debe durar ~RTT_FACTOR veces el RTT para que la latencia pese poco
+EWMA_WEIGHT = 0.25
+RTT_PROBES = 3  # Llamadas sin datos con las que se mide el RTT al negociar
+DEFAULT_UPLOAD_WINDOW = 4
+DEFAULT_DOWNLOAD_STREAMS = 4
+UPLOAD_SESSIONS_PATH = '.urfs_sessions'
+PROGRESS_INTERVAL = 1.0  # Segundos entre puntos de control de una descarga por rangos
+
+
+class ChunkSizer:
+    def __init__(self, preferred, maximum, rtt):
+        """
+        Ajusta el tamaño de bloque de una transferencia a partir del RTT y del rendimiento medidos.
+
+        El objetivo es que cada bloque sea del orden del producto ancho de banda x RTT multiplicado por
+        `RTT_FACTOR`, de forma que el tiempo de ida y vuelta de cada llamada apenas reduzca el rendimiento.
+        El tamaño crece como mucho al doble y decrece como mucho a la mitad en cada ajuste.
+
+        :param preferred: Tamaño de bloque inicial, normalmente el preferido por el FileManager.
+        :param maximum: Tamaño máximo de bloque permitido por ambos extremos.
+        :param rtt: Tiempo de ida y vuelta inicial en segundos, medido con llamadas sin datos.
+        """
+        self.maximum = maximum
+        self.minimum = min(MIN_CHUNK_SIZE, maximum)
+        self.size = max(self.minimum, min(preferred, maximum))
+        self.rtt = rtt
+        self.throughput = None
+
+    def update(self, nbytes, elapsed):
+        """
+        Registra una llamada completada y recalcula el tamaño de bloque para la siguiente. Se modela la
+        duración como RTT + `nbytes` / rendimiento, así que una llamada que no tarda más que el RTT no dice
+        nada del rendimiento y se descarta en lugar de tomarse como una transferencia casi instantánea.
+
+        :param nbytes: Número de bytes transferidos en la llamada.
+        :param elapsed: Segundos que tardó la llamada.
+        """
+        if elapsed <= self.rtt:
+            return
+        sample = nbytes / (elapsed - self.rtt)
+        if self.throughput is None:
+            self.throughput = sample
+        else:
+            self.throughput = (1 - EWMA_WEIGHT) * self.throughput + EWMA_WEIGHT * sample
+
+        target = int(self.throughput * self.rtt * RTT_FACTOR)
+        if target > self.size:
+            self.size = min(self.size * 2, target, self.maximum)
+        else:
+            self.size = max(self.size // 2, target, self.minimum)
+
+
+def negotiate(proxy, properties):
+    """
+    Negocia el tamaño de bloque con un Uploader o Downloader. El RTT es el mínimo de `RTT_PROBES` llamadas
+    sin datos (`ice_ping`) hechas después de `getTransferParams`, que ya ha abierto la conexión y no cuenta.
+
+    :param proxy: Proxy `URFS.UploaderPrx` o `URFS.DownloaderPrx`.
+    :param properties: Propiedades del comunicador local, que limitan el tamaño máximo de mensaje del cliente.
+    :return: Un `ChunkSizer` inicializado con los tamaños anunciados por el FileManager.
+    """
+    params = proxy.getTransferParams()
+    rtt = float('inf')
+    for _ in range(RTT_PROBES):
+        start = time.perf_counter()
+        proxy.ice_ping()
+        rtt = min(rtt, time.perf_counter() - start)
+
+    local_max = get_max_chunk_size(properties)
+    sizer = ChunkSizer(min(params.preferredChunkSize, local_max), min(params.maxChunkSize, local_max), rtt)
+    logging.info(f"Tamaño de bloque negociado: {sizer.size} (máximo {sizer.maximum}, RTT {rtt * 1000:.2f} ms)")
+    return sizer
+
+
+def send_file(uploader, _file, sizer, window=1):
+    """
+    Envía el contenido de un fichero abierto a un Uploader.
+
+    Con `window` igual a 1 cada bloque espera su respuesta antes de leer el siguiente y el tamaño de bloque
+    se ajusta con `sizer`. Con una ventana mayor se usan invocaciones asíncronas (`sendAtAsync`) y se
+    mantienen hasta `window` bloques en vuelo, cada uno con su offset, de forma que el rendimiento deja
+    de depender del RTT. En este modo se usa el tamaño de bloque negociado sin ajustarlo, y la subida
+    falla en cuanto cualquier bloque devuelve un error.
+
+    :param uploader: Proxy `URFS.UploaderPrx`.
+    :param _file: Fichero abierto en modo binario, posicionado donde debe empezar el envío.
+    :param sizer: `ChunkSizer` obtenido con `negotiate`.
+    :param window: Número máximo de bloques en vuelo.
+    :return: Posición del fichero tras el último byte enviado.
+    """
+    if window <= 1:
+        while True:
+            data = _file.read(sizer.size)
+            if not data:
+                return _file.tell()
+            logging.info("Enviando datos. Tamaño: {}".format(len(data)))
+            start = time.perf_counter()
+            uploader.sendBytes(data)  # Bytes en crudo, sin base64
+            sizer.update(len(data), time.perf_counter() - start)
+
+    in_flight = deque()
+    errors = []
+    failed = threading.Event()
+
+    def on_done(future):
+        if future.exception() is not None:
+            errors.append(future.exception())
+            failed.set()
+
+    offset = _file.tell()
+    try:
+        while not failed.is_set():
+            data = _file.read(sizer.size)
+            if not data:
+                break
+            while len(in_flight) >= window:
+                in_flight.popleft().result()
+            logging.info(f"Enviando datos. Offset: {offset} Tamaño: {len(data)}")
+            future = uploader.sendAtAsync(offset, data)
+            future.add_done_callback(on_done)
+            in_flight.append(future)
+            offset += len(data)
+
+        while in_flight:
+            in_flight.popleft().result()
+    except Exception:
+        for future in in_flight:
+            future.cancel()
+        raise
+
+    if errors:
+        raise errors[0]
+    return _file.tell()
+
+
+def send_delta(uploader, _file, base_hash, signatures, chunk_size, window=1):
+    """
+    Envía un fichero como diferencia respecto a un objeto base: los tramos que coinciden con bloques del objeto
+    base se piden con `copyAt` y solo el resto viaja por la red con `sendAt`. Igual que en `send_file`, se
+    mantienen hasta `window` llamadas en vuelo y la subida falla en cuanto cualquiera devuelve un error.
+
+    :param uploader: Proxy `URFS.UploaderPrx` creado con `Frontend.uploadDelta`.
+    :param _file: Fichero abierto en modo binario.
+    :param base_hash: Hash del objeto base.
+    :param signatures: Objeto `URFS.Signatures` del objeto base.
+    :param chunk_size: Tamaño máximo de cada tramo literal.
+    :param window: Número máximo de llamadas en vuelo.
+    :return: Tupla (bytes enviados, bytes copiados del objeto base).
+    """
+    size = os.fstat(_file.fileno()).st_size
+    blocks = [(block.weak, block.strong) for block in signatures.blocks]
+    in_flight = deque()
+    offset = sent = copied = 0
+    try:
+        for instruction in compute_delta(_file, size, signatures.size, signatures.blockSize, blocks, chunk_size):
+            while len(in_flight) >= max(window, 1):
+                in_flight.popleft().result()
+            if instruction[0] == 'data':
+                data = instruction[1]
+                logging.info(f"Enviando datos. Offset: {offset} Tamaño: {len(data)}")
+                in_flight.append(uploader.sendAtAsync(offset, data))
+                length = len(data)
+                sent += length
+            else:
+                _, base_offset, length = instruction
+                logging.info(f"Copiando del objeto base. Offset: {offset} Tamaño: {length}")
+                in_flight.append(uploader.copyAtAsync(offset, base_hash, base_offset, length))
+                copied += length
+            offset += length
+
+        while in_flight:
+            in_flight.popleft().result()
+    except Exception:
+        for future in in_flight:
+            future.cancel()
+        raise
+    return sent, copied
+
+
+def fetch_ranges(downloaders, fd, start, size, chunk_size, multi_source=False, progress_path=None):
+    """
+    Descarga un fichero por rangos disjuntos repartidos entre varios Downloaders, que trabajan en paralelo.
+
+    Cada Downloader se atiende desde su propio hilo y va tomando el siguiente rango pendiente de una cola
+    común, de modo que los más rápidos descargan más rangos. Los datos se escriben directamente en su
+    posición con `os.pwrite`, por lo que el fichero de salida debe estar ya reservado con su tamaño final.
+
+    Con `multi_source` los Downloaders leen de réplicas distintas del mismo contenido y la descarga tolera
+    que alguna falle: su rango vuelve a la cola y el resto continúa, y solo se aborta si fallan todas. Además,
+    cuando la cola se vacía, los hilos que quedan libres piden también el rango que lleva más tiempo en curso
+    (fase final), de modo que una fuente lenta no retrasa el final de la descarga: se queda el primero que llega.
+
+    Si la descarga falla o se interrumpe, el fichero se recorta al mayor prefijo escrito por completo para
+    que una descarga posterior pueda continuar desde ahí. Como los rangos terminan en cualquier orden y el
+    fichero está reservado con su tamaño final, tras una caída del proceso su tamaño no indica nada: con
+    `progress_path`, cada `PROGRESS_INTERVAL` segundos se sincroniza el fichero con el disco y se guarda en
+    ese fichero auxiliar el prefijo completo, que es desde donde se continúa.
+
+    :param downloaders: Lista de proxies `URFS.DownloaderPrx`, normalmente cada uno sobre su propia conexión.
+    :param fd: Descriptor del fichero de salida, abierto para escritura.
+    :param start: Offset desde el que se descarga; los bytes anteriores ya están en el fichero.
+    :param size: Tamaño total del fichero.
+    :param chunk_size: Tamaño de cada rango.
+    :param multi_source: True si los Downloaders leen de FileManager distintos.
+    :param progress_path: Fichero auxiliar en el que se guarda el progreso (`save_progress`), o None.
+    :return: Lista con los bytes escritos por cada Downloader, en el mismo orden.
+    """
+    offsets = range(start, size, chunk_size)
+    ranges = deque((offset, min(chunk_size, size - offset)) for offset in offsets)
+    in_progress = {}  # offset -> [tamaño, instante en que se pidió, hilos que lo están descargando]
+    written = set()
+    received = [0] * len(downloaders)
+    alive = [len(downloaders)]
+    errors = []
+    stop = threading.Event()
+    changed = threading.Condition()
+    prefix = [start]  # Fin del mayor prefijo escrito por completo
+    checkpoint = [time.perf_counter()]  # Instante del último punto de control
+    saving = threading.Lock()  # Los puntos de control de los distintos hilos se escriben de uno en uno
+    saved = [None]  # Último prefijo anotado
+
+    def save_checkpoint(mark):
+        with saving:
+            if saved[0] is not None and mark <= saved[0]:
+                return
+            os.fdatasync(fd)  # Los datos del prefijo deben estar en disco antes de anotarlo
+            save_progress(progress_path, mark)
+            saved[0] = mark
+
+    def next_range():
+        with changed:
+            while not stop.is_set():
+                if ranges:
+                    offset, length = ranges.popleft()
+                    in_progress[offset] = [length, time.perf_counter(), 1]
+                    return offset, length
+                if not multi_source or not in_progress:
+                    return None
+                single = [offset for offset, (_, _, workers) in in_progress.items() if workers == 1]
+                if single:  # Fase final: se duplica el rango que lleva más tiempo en curso
+                    offset = min(single, key=lambda candidate: in_progress[candidate][1])
+                    in_progress[offset][2] += 1
+                    return offset, in_progress[offset][0]
+                changed.wait()
+            return None
+
+    def worker(index, downloader):
+        try:
+            while True:
+                task = next_range()
+                if task is None:
+                    return
+                offset, length = task
+                try:
+                    data = downloader.recvAt(offset, length)
+                    if len(data) != length:
+                        raise IOError(f"Rango incompleto en el offset {offset}: {len(data)} de {length} bytes")
+                except Exception as e:
+                    if not multi_source:
+                        raise
+                    with changed:
+                        entry = in_progress.get(offset)
+                        if entry:
+                            entry[2] -= 1
+                            if not entry[2]:  # Nadie más lo está descargando: vuelve a la cola
+                                del in_progress[offset]
+                                ranges.appendleft((offset, length))
+                        alive[0] -= 1
+                        if not alive[0]:
+                            errors.append(e)
+                            stop.set()
+                        changed.notify_all()
+                    logging.warning(f"Fuente {index} descartada: {e}")
+                    return
+                with changed:
+                    if offset in written:  # Lo ha traído antes otra fuente
+                        continue
+                    os.pwrite(fd, data, offset)
+                    written.add(offset)
+                    in_progress.pop(offset, None)
+                    received[index] += length
+                    while prefix[0] < size and prefix[0] in written:
+                        prefix[0] = min(prefix[0] + chunk_size, size)
+                    mark = None
+                    if progress_path and time.perf_counter() - checkpoint[0] >= PROGRESS_INTERVAL:
+                        checkpoint[0] = time.perf_counter()
+                        mark = prefix[0]
+                    changed.notify_all()
+                if mark is not None:
+                    save_checkpoint(mark)
+                logging.info(f"Recibiendo rango. Offset: {offset} Tamaño: {length}")
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+            with changed:
+                changed.notify_all()
+
+    threads = [threading.Thread(target=worker, args=(index, downloader)) for index, downloader in enumerate(downloaders)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    except BaseException:
+        stop.set()
+        with changed:
+            changed.notify_all()
+        for thread in threads:
+            thread.join()
+        raise
+    finally:
+        if stop.is_set():
+            os.ftruncate(fd, prefix[0])
+        if progress_path:
+            save_checkpoint(prefix[0])
+
+    if errors:
+        raise errors[0]
+    return received
+
+
+def send_erasure(uploaders, _file, codec, cell_size, window=1):
+    """
+    Codifica un fichero con un código de borrado y envía cada fragmento a su Uploader. El fichero se lee por
+    franjas de k celdas de datos, se calculan las m celdas de paridad de cada franja y cada celda se envía con
+    `sendAtAsync` al offset que le corresponde dentro de su fragmento, de modo que todos los FileManager reciben
+    a la vez. Se mantienen hasta `window` franjas en vuelo y la subida falla en cuanto cualquier celda devuelve
+    un error. Sin paridad (k+0) es una subida repartida en franjas: las celdas vacías del final no se envían.
+
+    :param uploaders: Lista de proxies `URFS.UploaderPrx`, uno por fragmento: primero los de datos y después
+    los de paridad.
+    :param _file: Fichero abierto en modo binario.
+    :param codec: `erasure.ReedSolomon` con los parámetros de la subida.
+    :param cell_size: Tamaño de cada celda.
+    :param window: Número máximo de franjas en vuelo.
+    :return: Lista con el hash MD5 de cada fragmento, en el mismo orden que `uploaders`.
+    """
+    digests = [hashlib.md5() for _ in uploaders]
+    in_flight = deque()
+    offset = 0
+    try:
+        while True:
+            data = _file.read(codec.data_shards * cell_size)
+            if not data:
+                break
+            cells = codec.split(data, cell_size)
+            cells += codec.encode(cells)
+            while len(in_flight) >= max(window, 1):
+                for future in in_flight.popleft():
+                    future.result()
+            logging.info(f"Enviando franja. Offset: {offset} Tamaño: {len(data)}")
+            futures = []
+            for uploader, digest, cell in zip(uploaders, digests, cells):
+                if cell:
+                    digest.update(cell)
+                    futures.append(uploader.sendAtAsync(offset // codec.data_shards, cell))
+            in_flight.append(futures)
+            offset += len(data)
+
+        while in_flight:
+            for future in in_flight.popleft():
+                future.result()
+    except Exception:
+        for futures in in_flight:
+            for future in futures:
+                future.cancel()
+        raise
+    return [digest.hexdigest() for digest in digests]
+
+
+class ShardSet:
+    def __init__(self, open_shard, codec):
+        """
+        Fragmentos de un fichero con código de borrado de los que se está leyendo. Se abren los k primeros que
+        responden, empezando por los de datos, y cuando uno falla se sustituye por el siguiente de reserva: la
+        lectura solo falla si quedan menos de k fragmentos disponibles.
+
+        :param open_shard: Función que recibe el índice de un fragmento y devuelve un proxy `URFS.DownloaderPrx`
+        para leerlo, o lanza una excepción si no está disponible.
+        :param codec: `erasure.ReedSolomon` con los parámetros del fichero.
+        """
+        self.open_shard = open_shard
+        self.codec = codec
+        self.active = {}  # índice del fragmento -> Downloader
+        self.spares = deque(range(codec.total_shards))
+        self.fill()
+
+    def fill(self):
+        """
+        Abre fragmentos de reserva hasta tener k activos.
+
+        :raises IOError: Si no quedan suficientes fragmentos disponibles.
+        """
+        while len(self.active) < self.codec.data_shards and self.spares:
+            index = self.spares.popleft()
+            try:
+                self.active[index] = self.open_shard(index)
+            except Exception as e:
+                logging.warning(f"Fragmento {index} no disponible: {e}")
+        if len(self.active) < self.codec.data_shards:
+            raise IOError(f"Solo hay {len(self.active)} fragmentos disponibles de los "
+                          f"{self.codec.data_shards} necesarios")
+
+    def drop(self, index, error):
+        """
+        Descarta un fragmento que ha fallado durante la lectura.
+        """
+        downloader = self.active.pop(index, None)
+        if downloader is not None:
+            logging.warning(f"Fragmento {index} descartado: {error}")
+
+    def request(self, offset, size):
+        """
+        Pide una celda a cada fragmento activo, de forma asíncrona.
+
+        :return: Lista de tuplas (índice, futuro).
+        """
+        return [(index, downloader.recvAtAsync(offset, size)) for index, downloader in self.active.items()]
+
+    def gather(self, requests, offset, size):
+        """
+        Recoge las celdas de una franja. Si algún fragmento ha fallado se sustituye y la celda que falta se
+        pide de nuevo, de forma síncrona, a los fragmentos activos que no la han entregado todavía.
+
+        :param requests: Lista devuelta por `request`.
+        :return: Diccionario índice -> celda, con k entradas.
+        """
+        cells = {}
+        for index, future in requests:
+            try:
+                cells[index] = future.result()
+            except Exception as e:
+                self.drop(index, e)
+        while len(cells) < self.codec.data_shards:
+            self.fill()
+            for index, downloader in list(self.active.items()):
+                if index in cells or len(cells) >= self.codec.data_shards:
+                    continue
+                try:
+                    cells[index] = downloader.recvAt(offset, size)
+                except Exception as e:
+                    self.drop(index, e)
+        return cells
+
+    def destroy(self):
+        for downloader in self.active.values():
+            try:
+                downloader.destroy()
+            except Exception:
+                pass
+
+
+def fetch_erasure(open_shard, path, file_hash, size, codec, cell_size, window=1):
+    """
+    Descarga un fichero con código de borrado reconstruyéndolo franja a franja a partir de k de sus fragmentos.
+    Si están todos los de datos basta con intercalar sus celdas; si falta alguno (porque su FileManager no
+    responde o ha perdido el fragmento) se decodifica con los de paridad. Se piden hasta `window` franjas por
+    adelantado a la vez a todos los fragmentos, cada uno en su FileManager.
+
+    El resultado se escribe en `<path>.part` y, si su MD5 coincide con `file_hash`, se renombra a `path`.
+
+    :param open_shard: Función que recibe el índice de un fragmento y devuelve un proxy `URFS.DownloaderPrx`
+    para leerlo, o lanza una excepción si no está disponible.
+    :param path: Ruta del fichero de salida.
+    :param file_hash: Hash MD5 esperado del contenido.
+    :param size: Tamaño del fichero.
+    :param codec: `erasure.ReedSolomon` con los parámetros del fichero.
+    :param cell_size: Tamaño de cada celda.
+    :param window: Número máximo de franjas pedidas por adelantado.
+    :return: Número de franjas que ha habido que decodificar con fragmentos de paridad.
+    """
+    stripe_size = codec.data_shards * cell_size
+    shards = ShardSet(open_shard, codec)
+    part_path = path + '.part'
+    in_flight = deque()
+    degraded = 0
+    try:
+        with open(part_path, 'wb') as _file:
+            offsets = iter(range(0, size, stripe_size))
+            while True:
+                while len(in_flight) < max(window, 1):
+                    offset = next(offsets, None)
+                    if offset is None:
+                        break
+                    in_flight.append((offset, shards.request(offset // codec.data_shards, cell_size)))
+                if not in_flight:
+                    break
+                offset, requests = in_flight.popleft()
+                cells = shards.gather(requests, offset // codec.data_shards, cell_size)
+                if any(index >= codec.data_shards for index in cells):
+                    degraded += 1
+                data = b''.join(codec.decode(cells))
+                _file.write(data[:size - offset])
+                logging.info(f"Recibiendo franja. Offset: {offset} Tamaño: {min(stripe_size, size - offset)}")
+    finally:
+        for _, requests in in_flight:
+            for _, future in requests:
+                future.cancel()
+        shards.destroy()
+
+    digest = file_md5(part_path)
+    if digest != file_hash:
+        os.remove(part_path)
+        raise DigestMismatchError(f"El hash descargado {digest} no coincide con {file_hash}")
+    os.replace(part_path, path)
+    return degraded
+
+
+def preallocate(fd, size):
+    """
+    Reserva el espacio del fichero de salida antes de escribir rangos en él.
+
+    :param fd: Descriptor del fichero de salida.
+    :param size: Tamaño final del fichero.
+    """
+    os.ftruncate(fd, size)
+    if size and hasattr(os, 'posix_fallocate'):
+        os.posix_fallocate(fd, 0, size)
+
+
+class DigestMismatchError(Exception):
+    """
+    El contenido descargado no coincide con el hash solicitado.
+    """
+
+
+def file_md5(path):
+    """
+    Calcula el hash MD5 de un fichero local leyéndolo por bloques.
+
+    :param path: Ruta del fichero.
+    :return: Hash en formato hexadecimal.
+    """
+    hash_object = hashlib.md5()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(1024 * 1024)
+            if not data:
+                return hash_object.hexdigest()
+            hash_object.update(data)
+
+
+def download_to(downloader, path, file_hash, sizer, streams=1, size=None, replicas=()):
+    """
+    Descarga el contenido de un Downloader en un fichero local y comprueba su hash.
+
+    Los datos se escriben primero en `<path>.part`. Si ese fichero ya existe por una descarga anterior
+    interrumpida, se continúa desde su tamaño en lugar de empezar de cero o, si la descarga anterior era
+    por rangos, desde el progreso anotado en `<path>.part.progress` (el tamaño del fichero reservado no
+    sirve tras una caída del proceso). Al terminar se verifica el MD5
+    del fichero completo frente a `file_hash` y, si coincide, se renombra a `path`; si no, se descarta.
+
+    Con `streams` igual a 1 se lee de forma secuencial ajustando el tamaño de bloque con `sizer`. Si se
+    conoce el tamaño del fichero (el que devuelve `Frontend.openDownload`), se usa `recvChunk` y la lectura
+    termina cuando el servidor marca el último bloque, sin llamadas de más. Con más flujos se reserva la
+    salida con el tamaño final y se descargan rangos en paralelo, cada flujo sobre su propia conexión.
+
+    Con `replicas` se descarga a la vez de varios FileManager que guardan el mismo contenido: se abren
+    `streams` flujos con cada uno, los rangos se reparten entre todos según lo rápido que responde cada uno y
+    una réplica que falla no interrumpe la descarga (`fetch_ranges` con `multi_source`).
+
+    :param downloader: Proxy `URFS.DownloaderPrx`.
+    :param path: Ruta del fichero de salida.
+    :param file_hash: Hash MD5 esperado del contenido.
+    :param sizer: `ChunkSizer` obtenido con `negotiate`.
+    :param streams: Número de conexiones paralelas.
+    :param size: Tamaño del fichero informado por el servidor, o None si no se conoce.
+    :param replicas: Proxies `URFS.DownloaderPrx` del mismo contenido en otros FileManager.
+    """
+    part_path = path + '.part'
+    progress_path = part_path + '.progress'
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    progress = load_progress(progress_path)
+    if progress is not None and progress < offset:
+        offset = progress
+        os.truncate(part_path, offset)  # Lo que pase del prefijo anotado puede estar a medias
+    if size is not None and offset > size:
+        offset = 0
+        os.remove(part_path)
+    if offset:
+        logging.info(f"Descarga parcial encontrada, se continúa desde el offset {offset}")
+
+    if streams <= 1 and not replicas:
+        clear_progress(progress_path)  # En modo secuencial el tamaño del fichero es el progreso
+        if offset:
+            downloader.seek(offset)
+        with open(part_path, 'ab') as _file:
+            done = size is not None and offset >= size
+            while not done:
+                chunk_size = sizer.size
+                start = time.perf_counter()
+                if size is not None:
+                    chunk = downloader.recvChunk(chunk_size)
+                    data, done = chunk.data, chunk.eof
+                else:
+                    data = downloader.recvBytes(chunk_size)
+                    done = len(data) < chunk_size
+                sizer.update(len(data), time.perf_counter() - start)
+                _file.write(data)
+                logging.info(f"Recibiendo datos. Tamaño: {len(data)}")
+    else:
+        if size is None:
+            size = downloader.getSize()
+        if offset > size:
+            offset = 0
+        save_progress(progress_path, offset)  # Antes de reservar el fichero con su tamaño final
+        sources = [downloader, *replicas]
+        ranges = -(-(size - offset) // sizer.size)
+        streams = max(1, min(streams, -(-ranges // len(sources))))
+        downloaders = [source.ice_connectionId(f'stream-{i}') for source in sources for i in range(streams)]
+        fd = os.open(part_path, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            preallocate(fd, size)
+            received = fetch_ranges(downloaders, fd, offset, size, sizer.size, multi_source=bool(replicas),
+                                    progress_path=progress_path)
+        finally:
+            os.close(fd)
+        if replicas:
+            for index in range(len(sources)):
+                nbytes = sum(received[index * streams:(index + 1) * streams])
+                logging.info(f"Bytes recibidos de la fuente {index}: {nbytes}")
+
+    digest = file_md5(part_path)
+    clear_progress(progress_path)
+    if digest != file_hash:
+        os.remove(part_path)
+        raise DigestMismatchError(f"El hash descargado {digest} no coincide con {file_hash}")
+    os.replace(part_path, path)
+
+
+def load_progress(progress_path):
+    """
+    Devuelve el progreso anotado de una descarga por rangos, o None si no hay ninguno.
+
+    :param progress_path: Ruta del fichero auxiliar de progreso.
+    :return: Bytes del prefijo del fichero parcial que están completos y en disco.
+    """
+    try:
+        with open(progress_path) as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def save_progress(progress_path, offset):
+    """
+    Anota de forma atómica y persistente el progreso de una descarga por rangos: se escribe un temporal, se
+    sincroniza y se renombra, y después se sincroniza el directorio.
+
+    :param progress_path: Ruta del fichero auxiliar de progreso.
+    :param offset: Bytes del prefijo del fichero parcial que están completos y en disco.
+    """
+    temp_path = progress_path + '.tmp'
+    with open(temp_path, 'w') as f:
+        f.write(str(offset))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, progress_path)
+    fd = os.open(os.path.dirname(os.path.abspath(progress_path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def clear_progress(progress_path):
+    """
+    Elimina el progreso anotado de una descarga, una vez terminada o si se continúa en modo secuencial.
+    """
+    try:
+        os.remove(progress_path)
+    except FileNotFoundError:
+        pass
+
+
+def write_verified(path, data, file_hash):
+    """
+    Guarda en `path` un contenido recibido entero (por ejemplo con `getSmall`) tras comprobar su hash. El
+    fichero se escribe en `<path>.part` y se renombra al final, igual que en `download_to`.
+
+    :param path: Ruta del fichero de salida.
+    :param data: Contenido completo.
+    :param file_hash: Hash MD5 esperado del contenido.
+    """
+    digest = hashlib.md5(data).hexdigest()
+    if digest != file_hash:
+        raise DigestMismatchError(f"El hash descargado {digest} no coincide con {file_hash}")
+    part_path = path + '.part'
+    with open(part_path, 'wb') as _file:
+        _file.write(data)
+    os.replace(part_path, path)
+
+
+def _session_path(file_name):
+    key = hashlib.md5(os.path.abspath(file_name).encode()).hexdigest()
+    return os.path.join(UPLOAD_SESSIONS_PATH, key)
+
+
+def load_upload_session(file_name):
+    """
+    Devuelve el identificador de la sesión de subida pendiente de un fichero local, si existe y el fichero
+    no ha cambiado desde que se inició.
+
+    :param file_name: Ruta del fichero local que se está subiendo.
+    :return: Identificador de sesión o None.
+    """
+    try:
+        with open(_session_path(file_name)) as f:
+            session = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    stat = os.stat(file_name)
+    if session.get('size') != stat.st_size or session.get('mtime') != stat.st_mtime:
+        clear_upload_session(file_name)
+        return None
+    return session.get('session')
+
+
+def save_upload_session(file_name, session_id):
+    """
+    Guarda el identificador de la sesión de subida de un fichero local para poder reanudarla más tarde.
+
+    :param file_name: Ruta del fichero local que se está subiendo.
+    :param session_id: Identificador devuelto por `Uploader.getSessionId()`.
+    """
+    stat = os.stat(file_name)
+    os.makedirs(UPLOAD_SESSIONS_PATH, exist_ok=True)
+    with open(_session_path(file_name), 'w') as f:
+        json.dump({'session': session_id, 'size': stat.st_size, 'mtime': stat.st_mtime}, f)
+
+
+def clear_upload_session(file_name):
+    """
+    Olvida la sesión de subida de un fichero local, una vez terminada o descartada.
+
+    :param file_name: Ruta del fichero local.
+    """
+    try:
+        os.remove(_session_path(file_name))
+    except FileNotFoundError:
+        pass
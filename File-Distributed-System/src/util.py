@@ -1,6 +1,10 @@
 import IceStorm
 import logging
 
+MESSAGE_OVERHEAD = 4096  # Margen reservado para las cabeceras del protocolo Ice en cada mensaje
+DEFAULT_PREFERRED_CHUNK_SIZE = 256 * 1024
+DEFAULT_SMALL_OBJECT_THRESHOLD = 64 * 1024
+
 def get_topic_manager(broker):
     """
     Devuelve un proxy IceStorm TopicManager.
@@ -16,3 +20,40 @@ def get_topic_manager(broker):
 
     logging.info(f"Usando IceStorm en: '{proxy_string}'")
     return IceStorm.TopicManagerPrx.checkedCast(proxy)
+
+
+def get_max_chunk_size(properties):
+    """
+    Calcula el tamaño máximo de bloque que cabe en un mensaje Ice según la propiedad `Ice.MessageSizeMax`.
+    
+    :param properties: Propiedades del comunicador (`Ice.Properties`).
+    :return: Tamaño máximo en bytes de los datos de un bloque, descontando el margen de cabeceras.
+    """
+    message_size_max = properties.getPropertyAsIntWithDefault('Ice.MessageSizeMax', 1024)  # En KiB, 0 = sin límite
+    if message_size_max <= 0:
+        message_size_max = 1024 * 1024
+    return message_size_max * 1024 - MESSAGE_OVERHEAD
+
+
+def get_preferred_chunk_size(properties):
+    """
+    Devuelve el tamaño de bloque preferido, configurable con la propiedad `URFS.PreferredChunkSize`
+    y limitado por el tamaño máximo de mensaje.
+    
+    :param properties: Propiedades del comunicador (`Ice.Properties`).
+    :return: Tamaño de bloque preferido en bytes.
+    """
+    preferred = properties.getPropertyAsIntWithDefault('URFS.PreferredChunkSize', DEFAULT_PREFERRED_CHUNK_SIZE)
+    return min(preferred, get_max_chunk_size(properties))
+
+
+def get_small_object_threshold(properties):
+    """
+    Devuelve el tamaño máximo de los objetos que se transfieren en una sola llamada (`putSmall`/`getSmall`),
+    configurable con la propiedad `URFS.SmallObjectThreshold` y limitado por el tamaño máximo de mensaje.
+    
+    :param properties: Propiedades del comunicador (`Ice.Properties`).
+    :return: Tamaño máximo en bytes de un objeto pequeño.
+    """
+    threshold = properties.getPropertyAsIntWithDefault('URFS.SmallObjectThreshold', DEFAULT_SMALL_OBJECT_THRESHOLD)
+    return min(threshold, get_max_chunk_size(properties))
@@ -0,0 +1,58 @@
+import os
+import sys
+import hashlib
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from storage import ObjectStore, Compactor  # noqa: E402
+
+
+class CompactorTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = ObjectStore(self.tmp.name, pack_threshold=1024)
+        self.compactor = Compactor(self.store, 3600, 0.5, 0)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def put(self, data, name):
+        hash = hashlib.md5(data).hexdigest()
+        self.store.put(hash, data, name)
+        return hash
+
+    def assert_second_pass_is_noop(self):
+        self.compactor.run_once()
+        segments = self.store.segments.segments()
+        compacted = self.store.index.counter('segments_compacted')
+        self.assertEqual(self.compactor.run_once(), 0)
+        self.assertEqual(self.store.segments.segments(), segments)
+        self.assertEqual(self.store.index.counter('segments_compacted'), compacted)
+
+    def test_small_live_objects_are_not_rewritten(self):
+        hashes = [self.put(str(i).encode(), f'f{i}') for i in range(100)]
+        self.assert_second_pass_is_noop()
+        self.assertEqual(self.store.index.counter('segments_compacted'), 0)
+        for i, hash in enumerate(hashes):
+            self.assertEqual(self.store.read(self.store.lookup(hash)), str(i).encode())
+
+    def test_tombstones_are_dropped_once_their_records_are_gone(self):
+        kept = [self.put(str(i).encode(), f'f{i}') for i in range(100)]
+        self.store.segments.seal()
+        removed = [self.put(f'removed {i}'.encode(), f'r{i}') for i in range(100)]
+        self.store.segments.seal()
+        for hash in removed:
+            self.store.remove(hash)
+        first = self.store.segments.segments()[0]
+        self.assert_second_pass_is_noop()
+        self.assertEqual(self.store.segments.segments()[0], first)
+        self.assertEqual(len(self.store.segments.segments()), 2)
+        for hash in removed:
+            self.assertIsNone(self.store.lookup(hash))
+        for i, hash in enumerate(kept):
+            self.assertEqual(self.store.read(self.store.lookup(hash)), str(i).encode())
+
+if __name__ == '__main__':
+    unittest.main()